@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# analitico.py
+# Caminho estruturado do tema mysql_escola: cópia colunar da tabela + agregados pré-calculados.
+import json
+import os
+import re
+import threading
+import unicodedata
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+TEMA_ANALITICO = "mysql_escola"
+ANALITICO_ATIVO = os.getenv("ANALITICO_ESCOLA", "1") != "0"
+ARQUIVO_COPIA = "alunos.parquet"
+ARQUIVO_AGREGADOS = "agregados.json"
+
+# colunas categóricas usadas para agrupar e métricas numéricas agregadas
+DIMENSOES = ["curso", "modalidade", "bolsa", "trabalha", "renda_familiar", "genero", "evadiu"]
+METRICAS = ["media_final", "reprovacoes", "faltas_pct"]
+# cruzamentos mais pedidos (além dos agrupamentos por uma dimensão)
+CRUZAMENTOS = [("curso", "modalidade"), ("curso", "bolsa"), ("modalidade", "bolsa")]
+
+# palavras da pergunta que indicam cada dimensão (sem acento, minúsculas)
+_GATILHOS = {
+    "curso": ["curso", "cursos", "graduacao"],
+    "modalidade": ["modalidade", "ead", "presencial", "distancia", "hibrido"],
+    "bolsa": ["bolsa", "bolsas", "bolsista", "bolsistas"],
+    "trabalha": ["trabalha", "trabalham", "trabalho", "emprego"],
+    "renda_familiar": ["renda"],
+    "genero": ["genero", "sexo", "homens", "mulheres", "masculino", "feminino"],
+    "evadiu": [],
+}
+# palavras que indicam pergunta sobre o conjunto (taxas, médias, contagens, comparações)
+_AGREGACAO = {
+    "taxa", "taxas", "media", "medias", "quantos", "quantas", "quantidade", "total", "totais",
+    "percentual", "porcentagem", "proporcao", "distribuicao", "comparar", "compara", "comparacao",
+    "maior", "menor", "mais", "menos", "ranking", "geral", "evadem", "tendem",
+}
+_PADRAO = ["curso", "modalidade", "bolsa"]
+_SIM = {"sim", "s", "1", "true", "yes", "y", "verdadeiro"}
+
+
+def _sem_acento(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _sim(serie: pd.Series) -> pd.Series:
+    """'Sim'/'Não', 1/0 ou booleano -> bool."""
+    return serie.astype(str).str.strip().map(_sem_acento).isin(_SIM)
+
+
+# ================== CÓPIA COLUNAR ==================
+def exportar_copia(lotes, pasta: str) -> int:
+    """
+    Grava os lotes (DataFrames) num Parquet só com as colunas analíticas.
+    Escreve num temporário e troca no fim: leitores nunca veem um arquivo pela metade.
+    """
+    caminho = os.path.join(pasta, ARQUIVO_COPIA)
+    temporario = caminho + ".tmp"
+    escritor, total = None, 0
+    try:
+        for lote in lotes:
+            colunas = [c for c in DIMENSOES + METRICAS if c in lote.columns]
+            lote = lote[colunas].copy()
+            for c in DIMENSOES:
+                if c in lote.columns:
+                    lote[c] = lote[c].astype(str)
+            for c in METRICAS:
+                if c in lote.columns:
+                    lote[c] = pd.to_numeric(lote[c], errors="coerce").astype("float64")
+            tabela = pa.Table.from_pandas(lote, preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(temporario, tabela.schema)
+            escritor.write_table(tabela.cast(escritor.schema))
+            total += len(lote)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    if escritor is not None:
+        os.replace(temporario, caminho)
+    return total
+
+
+# ================== AGREGADOS ==================
+def _resumo(df: pd.DataFrame) -> dict:
+    resumo = {"alunos": int(len(df))}
+    if "evadiu" in df.columns:
+        evadidos = int(_sim(df["evadiu"]).sum())
+        resumo["evadidos"] = evadidos
+        resumo["taxa_evasao"] = round(evadidos / len(df), 4) if len(df) else 0.0
+    for c in METRICAS:
+        if c in df.columns:
+            media = df[c].mean()
+            resumo[f"{c}_media"] = None if pd.isna(media) else round(float(media), 2)
+    return resumo
+
+
+def _agrupar(df: pd.DataFrame, colunas) -> list:
+    linhas = []
+    for chave, grupo in df.groupby(list(colunas), sort=True, dropna=False):
+        chave = chave if isinstance(chave, tuple) else (chave,)
+        linhas.append({**dict(zip(colunas, map(str, chave))), **_resumo(grupo)})
+    return linhas
+
+
+def calcular_agregados(df: pd.DataFrame) -> dict:
+    """Totais, agrupamentos por cada dimensão e os cruzamentos de CRUZAMENTOS."""
+    agregados = {"total": _resumo(df), "por": {}, "valores": {}}
+    for d in DIMENSOES:
+        if d in df.columns:
+            agregados["por"][d] = _agrupar(df, [d])
+            agregados["valores"][d] = sorted(df[d].astype(str).unique().tolist())
+    for a, b in CRUZAMENTOS:
+        if a in df.columns and b in df.columns:
+            agregados["por"][f"{a}+{b}"] = _agrupar(df, [a, b])
+    return agregados
+
+
+def atualizar_agregados(pasta: str) -> dict:
+    """Recalcula os agregados a partir da cópia colunar e grava `agregados.json`."""
+    df = pd.read_parquet(os.path.join(pasta, ARQUIVO_COPIA))
+    agregados = calcular_agregados(df)
+    caminho = os.path.join(pasta, ARQUIVO_AGREGADOS)
+    with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(agregados, f, ensure_ascii=False, indent=2)
+    os.replace(caminho + ".tmp", caminho)
+    return agregados
+
+
+_AGREGADOS = {}  # pasta -> (mtime, agregados)
+_AGREGADOS_LOCK = threading.Lock()
+
+
+def carregar_agregados(pasta: str):
+    """Agregados da pasta (relidos só quando o arquivo muda). None se não existem."""
+    caminho = os.path.join(pasta, ARQUIVO_AGREGADOS)
+    try:
+        mtime = os.stat(caminho).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    atual = _AGREGADOS.get(pasta)
+    if atual and atual[0] == mtime:
+        return atual[1]
+    with _AGREGADOS_LOCK:
+        with open(caminho, "r", encoding="utf-8") as f:
+            agregados = json.load(f)
+        _AGREGADOS[pasta] = (mtime, agregados)
+    return agregados
+
+
+# ================== CONTEXTO PARA O PROMPT ==================
+def dimensoes_da_pergunta(pergunta: str, agregados: dict) -> list:
+    """Dimensões citadas na pergunta, por palavra-gatilho ou por um valor da coluna (ex.: 'Direito')."""
+    texto = _sem_acento(pergunta)
+    palavras = set(re.findall(r"\w+", texto))
+    citadas = []
+    for d in DIMENSOES:
+        if d == "evadiu" or d not in agregados["por"]:
+            continue
+        gatilhos = any(g in palavras for g in _GATILHOS[d])
+        valores = d in {"curso", "modalidade"} and any(
+            len(v) > 2 and re.search(rf"\b{re.escape(_sem_acento(v))}\b", texto)
+            for v in agregados["valores"].get(d, [])
+        )
+        if gatilhos or valores:
+            citadas.append(d)
+    return citadas
+
+
+def pergunta_agregada(pergunta: str) -> bool:
+    """Pergunta sobre o conjunto de alunos (e não sobre um aluno ou linha específica)?"""
+    return bool(_AGREGACAO & set(re.findall(r"\w+", _sem_acento(pergunta))))
+
+
+def _tabela(linhas: list, colunas: list) -> str:
+    cabecalho = colunas + ["alunos", "evadidos", "taxa de evasão", "média final", "reprovações (média)", "faltas % (média)"]
+    saida = ["| " + " | ".join(cabecalho) + " |", "|" + "---|" * len(cabecalho)]
+    for l in linhas:
+        taxa = l.get("taxa_evasao")
+        valores = [l[c] for c in colunas] + [
+            l["alunos"],
+            l.get("evadidos", "-"),
+            f"{taxa:.1%}" if taxa is not None else "-",
+            l.get("media_final_media", "-"),
+            l.get("reprovacoes_media", "-"),
+            l.get("faltas_pct_media", "-"),
+        ]
+        saida.append("| " + " | ".join(map(str, valores)) + " |")
+    return "\n".join(saida)
+
+
+def contexto_analitico(pergunta: str, pasta: str):
+    """
+    Texto com os agregados relevantes para a pergunta (tabelas markdown), ou None
+    quando a pergunta não é agregada ou a cópia analítica ainda não foi gerada.
+    Com contexto, a pergunta é respondida só pelos agregados: o pipeline não recupera linhas.
+    """
+    if not pergunta_agregada(pergunta):
+        return None
+    agregados = carregar_agregados(pasta)
+    if not agregados:
+        return None
+
+    dimensoes = dimensoes_da_pergunta(pergunta, agregados) or [d for d in _PADRAO if d in agregados["por"]]
+    partes = [
+        "Dados agregados da base de alunos (calculados sobre a tabela inteira, não sobre amostras):",
+        "Total:\n" + _tabela([agregados["total"]], []),
+    ]
+    for d in dimensoes:
+        partes.append(f"Por {d}:\n" + _tabela(agregados["por"][d], [d]))
+    for a, b in CRUZAMENTOS:
+        if a in dimensoes and b in dimensoes and f"{a}+{b}" in agregados["por"]:
+            partes.append(f"Por {a} e {b}:\n" + _tabela(agregados["por"][f"{a}+{b}"], [a, b]))
+    return "\n\n".join(partes)
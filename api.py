@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# api.py
+# API HTTP (ASGI) com o mesmo pipeline da interface: roteamento + recuperação + resposta.
+#
+# Uso:
+#   uvicorn api:app --port 8000
+#   NATHALIA_LLM=fake uvicorn api:app        # LLM local determinístico (testes e carga, sem rede)
+#
+#   POST /perguntar          {"pergunta": "...", "sessao": "opcional"}  -> resposta completa
+#   POST /perguntar/stream   mesmo corpo -> text/event-stream (eventos "token" e "fim")
+#   POST /perguntar/lote     {"perguntas": ["...", ...]}                -> respostas (sem histórico)
+#   GET  /saude              estado do serviço e do agrupamento de embeddings
+#   GET  /metricas           p50/p95/p99 por etapa (?formato=prometheus para o formato de exposição)
+#
+# Com API_TOKEN definido, as rotas de pergunta exigem "Authorization: Bearer <token>".
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+# antes dos módulos do projeto, que leem a configuração ao serem importados
+load_dotenv()
+
+from fastapi import Depends, FastAPI, Header, HTTPException  # noqa: E402
+from fastapi.responses import PlainTextResponse, StreamingResponse  # noqa: E402
+from pydantic import BaseModel, Field  # noqa: E402
+
+from conversa import criar_memoria  # noqa: E402
+from pipeline import obter_agrupador  # noqa: E402
+from rastreamento import obter_metricas  # noqa: E402
+from registro import obter_registro  # noqa: E402
+from reranqueamento import obter_reranqueador  # noqa: E402
+from servico import obter_servico  # noqa: E402
+
+API_TOKEN = os.getenv("API_TOKEN", "")
+# conversas mantidas em memória (as mais antigas saem primeiro)
+API_MAX_SESSOES = int(os.getenv("API_MAX_SESSOES", "1000"))
+API_MAX_LOTE = int(os.getenv("API_MAX_LOTE", "64"))
+
+
+# ================== SESSÕES ==================
+_SESSOES = OrderedDict()  # sessao -> (memória, trava da conversa)
+_SESSOES_LOCK = threading.Lock()
+
+
+def _sessao(sessao: Optional[str]):
+    """Memória e trava da conversa `sessao` (novas e descartáveis sem sessão)."""
+    if not sessao:
+        return criar_memoria(), asyncio.Lock()
+    with _SESSOES_LOCK:
+        conversa = _SESSOES.pop(sessao, None) or (criar_memoria(), asyncio.Lock())
+        _SESSOES[sessao] = conversa
+        while len(_SESSOES) > API_MAX_SESSOES:
+            _SESSOES.popitem(last=False)
+    return conversa
+
+
+async def _responder(corpo, ao_token=None) -> dict:
+    """
+    Perguntas da mesma sessão são atendidas uma de cada vez: a memória (save_context e o
+    resumo das trocas antigas) não é segura para duas respostas intercaladas.
+    """
+    memoria, trava = _sessao(corpo.sessao)
+    async with trava:
+        return await obter_servico().responder(corpo.pergunta, memoria, corpo.estrategia, ao_token=ao_token)
+
+
+# ================== APP ==================
+def _aquecer():
+    obter_reranqueador()
+    obter_registro().aquecer()
+    obter_servico()
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # modelos e bases carregados uma vez, antes da primeira requisição
+    await asyncio.get_running_loop().run_in_executor(None, _aquecer)
+    yield
+    obter_servico().fechar()
+
+
+app = FastAPI(title="Nathal.IA", lifespan=ciclo_de_vida)
+
+
+def _autorizar(authorization: Optional[str] = Header(None)):
+    if API_TOKEN and authorization != f"Bearer {API_TOKEN}":
+        raise HTTPException(status_code=401, detail="Token inválido.")
+
+
+class Pergunta(BaseModel):
+    pergunta: str = Field(..., min_length=1)
+    sessao: Optional[str] = None
+    estrategia: Optional[str] = None
+
+
+class LotePerguntas(BaseModel):
+    perguntas: List[str] = Field(..., min_length=1, max_length=API_MAX_LOTE)
+    estrategia: Optional[str] = None
+
+
+def _saida(resultado: dict, sessao: Optional[str] = None) -> dict:
+    return {
+        "resposta": resultado["answer"],
+        "tema": resultado["tema"],
+        "cache": resultado["cache"],
+        "sessao": sessao,
+        "metricas": resultado.get("metricas", {}),
+    }
+
+
+@app.get("/saude")
+def saude():
+    agrupador = obter_agrupador()
+    return {
+        "servico": obter_servico().estatisticas(),
+        "sessoes": len(_SESSOES),
+        "embeddings": {"lotes": agrupador.lotes, "perguntas_por_lote": round(agrupador.media_por_lote, 2)},
+    }
+
+
+@app.get("/metricas")
+def metricas(formato: str = "json"):
+    if formato == "prometheus":
+        return PlainTextResponse(obter_metricas().prometheus())
+    return obter_metricas().resumo()
+
+
+@app.post("/perguntar", dependencies=[Depends(_autorizar)])
+async def perguntar(corpo: Pergunta):
+    resultado = await _responder(corpo)
+    return _saida(resultado, corpo.sessao)
+
+
+@app.post("/perguntar/lote", dependencies=[Depends(_autorizar)])
+async def perguntar_lote(corpo: LotePerguntas):
+    # perguntas independentes; chegam juntas ao agrupador e são vetorizadas em lote
+    servico = obter_servico()
+    resultados = await asyncio.gather(
+        *(servico.responder(p, criar_memoria(), corpo.estrategia) for p in corpo.perguntas)
+    )
+    return {"respostas": [_saida(r) for r in resultados]}
+
+
+def _evento(nome: str, dados: dict) -> str:
+    return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.post("/perguntar/stream", dependencies=[Depends(_autorizar)])
+async def perguntar_stream(corpo: Pergunta):
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+
+    def ao_token(texto: str):
+        # chamado no loop do serviço: repassa ao loop desta requisição
+        loop.call_soon_threadsafe(fila.put_nowait, texto)
+
+    tarefa = asyncio.ensure_future(_responder(corpo, ao_token=ao_token))
+
+    async def eventos():
+        enviado = 0
+        while True:
+            proximo = asyncio.ensure_future(fila.get())
+            await asyncio.wait({proximo, tarefa}, return_when=asyncio.FIRST_COMPLETED)
+            if not proximo.done():
+                proximo.cancel()
+                if fila.empty():
+                    break
+                continue
+            texto = proximo.result()
+            if len(texto) > enviado:
+                yield _evento("token", {"texto": texto[enviado:]})
+                enviado = len(texto)
+        try:
+            resultado = tarefa.result()
+        except Exception as e:
+            yield _evento("erro", {"detalhe": str(e)})
+            return
+        yield _evento("fim", _saida(resultado, corpo.sessao))
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# benchmark.py
+# Suíte de benchmark offline: roteamento, recuperação, ingestão e ponta a ponta (com LLM falso).
+#
+# Uso:
+#   python benchmark.py --saida atual.json                     # todas as seções
+#   python benchmark.py --secoes roteamento recuperacao        # só algumas
+#   python benchmark.py --ingestao-tema SQL --ingestao-pdfs 3  # ingestão numa cópia temporária
+#   python benchmark.py --saida atual.json --comparar base.json --tolerancia 0.1
+#       -> lista as métricas que pioraram mais que 10% e sai com código 1 (para CI / antes do deploy)
+#
+# Perguntas fixas por tema em perguntas_benchmark.json: {"tema": [{"pergunta", "termos"}]}.
+# Um trecho é relevante para a pergunta se contém todos os `termos` (sem acento, minúsculas).
+# O LLM de resposta é sempre o falso, os caches ficam desligados e o re-ranqueamento pontua
+# todos os candidatos (sem orçamento em ms, que depende da máquina e da carga): os números
+# de qualidade só mudam quando mudam o código, a configuração ou as bases.
+import os
+
+os.environ["NATHALIA_LLM"] = "fake"
+os.environ["CACHE_RESPOSTAS"] = "0"
+os.environ["CACHE_EMBEDDINGS"] = "0"
+os.environ["RERANK_LIMITE_MS"] = "0"
+os.environ.setdefault("RASTRO_LOG", "0")
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import platform  # noqa: E402
+import shutil  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+import unicodedata  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from conversa import criar_memoria  # noqa: E402
+from indices_vetoriais import INDICE_VETORIAL  # noqa: E402
+from montagem_prompt import COMPRESSAO_ATIVA, ORCAMENTO_PROMPT  # noqa: E402
+from pipeline import BUSCA_HIBRIDA, K_DOCUMENTOS, criar_retriever, responder_pergunta  # noqa: E402
+from registro import TEMAS_DISPONIVEIS, obter_registro  # noqa: E402
+from reranqueamento import RERANK_ATIVO, RERANK_CANDIDATOS, RERANK_LIMITE_MS  # noqa: E402
+from roteamento import identificar_tema  # noqa: E402
+
+ARQUIVO_PERGUNTAS = "perguntas_benchmark.json"
+SECOES = ["roteamento", "recuperacao", "ingestao", "ponta_a_ponta"]
+LOTE_LEITURA = 5000
+
+# (caminho no relatório, maior é melhor) comparados com --comparar
+METRICAS_COMPARADAS = [
+    ("roteamento.acuracia", True),
+    ("roteamento.latencia.p95_ms", False),
+    ("recuperacao.recall", True),
+    ("recuperacao.acerto", True),
+    ("recuperacao.latencia.p95_ms", False),
+    ("ingestao.paginas_por_s", True),
+    ("ingestao.chunks_por_s", True),
+    ("ponta_a_ponta.latencia.p50_ms", False),
+    ("ponta_a_ponta.latencia.p95_ms", False),
+]
+
+
+def _sem_acento(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return " ".join("".join(c for c in texto if not unicodedata.combining(c)).split())
+
+
+def _latencias(segundos) -> dict:
+    if not len(segundos):
+        return {}
+    ms = np.asarray(segundos) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "media_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def carregar_perguntas(caminho: str = ARQUIVO_PERGUNTAS) -> dict:
+    with open(caminho, "r", encoding="utf-8") as f:
+        perguntas = json.load(f)
+    return {tema: itens for tema, itens in perguntas.items() if tema in TEMAS_DISPONIVEIS and itens}
+
+
+def _ambiente() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit,
+        "data": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "k": K_DOCUMENTOS,
+            "indice_vetorial": INDICE_VETORIAL,
+            "busca_hibrida": BUSCA_HIBRIDA,
+            "rerank": RERANK_ATIVO,
+            "rerank_candidatos": RERANK_CANDIDATOS,
+            "rerank_limite_ms": RERANK_LIMITE_MS,
+            "compressao": COMPRESSAO_ATIVA,
+            "orcamento_prompt": ORCAMENTO_PROMPT,
+        },
+    }
+
+
+# ================== SEÇÕES ==================
+def avaliar_roteamento(perguntas: dict, vetores: dict) -> dict:
+    acertos, latencias, por_tema, erros = [], [], {}, []
+    for tema, itens in perguntas.items():
+        certos = 0
+        for item in itens:
+            t0 = time.perf_counter()
+            escolhido = identificar_tema(item["pergunta"], vetor=vetores[item["pergunta"]])
+            latencias.append(time.perf_counter() - t0)
+            certos += escolhido == tema
+            if escolhido != tema:
+                erros.append({"pergunta": item["pergunta"], "esperado": tema, "escolhido": escolhido})
+        acertos.append(certos)
+        por_tema[tema] = round(certos / len(itens), 4)
+    total = sum(len(i) for i in perguntas.values())
+    return {
+        "perguntas": total,
+        "acuracia": round(sum(acertos) / total, 4) if total else 0.0,
+        "por_tema": por_tema,
+        "latencia": _latencias(latencias),
+        "erros": erros,
+    }
+
+
+def _textos_do_tema(store) -> dict:
+    """{id: texto normalizado} de todos os trechos da base (para achar os relevantes)."""
+    total = store._collection.count()
+    textos = {}
+    for offset in range(0, total, LOTE_LEITURA):
+        lote = store._collection.get(limit=LOTE_LEITURA, offset=offset, include=["documents"])
+        textos.update({i: _sem_acento(t) for i, t in zip(lote["ids"], lote["documents"])})
+    return textos
+
+
+def avaliar_recuperacao(perguntas: dict, vetores: dict, k: int = K_DOCUMENTOS) -> dict:
+    registro = obter_registro()
+    recalls, acertos, latencias, por_tema, sem_relevantes = [], [], [], {}, 0
+    for tema, itens in perguntas.items():
+        store = registro.obter_store(tema)
+        if store is None:
+            continue
+        textos = _textos_do_tema(store)
+        recalls_tema = []
+        for item in itens:
+            termos = [_sem_acento(t) for t in item.get("termos", [])]
+            relevantes = {i for i, t in textos.items() if termos and all(termo in t for termo in termos)}
+            if not relevantes:
+                sem_relevantes += 1
+                continue
+            retriever = criar_retriever(tema, item["pergunta"], vetores[item["pergunta"]], store=store, k=k)
+            t0 = time.perf_counter()
+            documentos = retriever.invoke(item["pergunta"])
+            latencias.append(time.perf_counter() - t0)
+            encontrados = {d.id for d in documentos[:k]} & relevantes
+            recalls_tema.append(len(encontrados) / min(k, len(relevantes)))
+            acertos.append(bool(encontrados))
+        recalls += recalls_tema
+        if recalls_tema:
+            por_tema[tema] = round(float(np.mean(recalls_tema)), 4)
+    return {
+        "k": k,
+        "avaliadas": len(recalls),
+        "sem_relevantes": sem_relevantes,
+        "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+        "acerto": round(float(np.mean(acertos)), 4) if acertos else None,
+        "por_tema": por_tema,
+        "latencia": _latencias(latencias),
+    }
+
+
+def avaliar_ingestao(tema: str = None, max_pdfs: int = 3) -> dict:
+    """Ingere até `max_pdfs` PDFs de docs/<tema> numa pasta temporária (sem cache de embeddings)."""
+    from ingest_docs import CAMINHO_DOCS, listar_pdfs, vetorizar_tema
+
+    temas = [tema] if tema else sorted(os.listdir(CAMINHO_DOCS)) if os.path.isdir(CAMINHO_DOCS) else []
+    pdfs = []
+    for candidato in temas:
+        pdfs = sorted(listar_pdfs(os.path.join(CAMINHO_DOCS, candidato)))[:max_pdfs]
+        if pdfs:
+            tema = candidato
+            break
+    if not pdfs:
+        return {"erro": "nenhum PDF em docs/<tema>"}
+
+    try:
+        from motor_embeddings import MotorEmbeddings
+
+        embeddings = MotorEmbeddings()
+    except ImportError as e:
+        return {"erro": f"motor de embeddings indisponível ({e})"}
+
+    temporaria = tempfile.mkdtemp(prefix="benchmark_ingestao_")
+    try:
+        pasta_docs = os.path.join(temporaria, "docs")
+        os.makedirs(pasta_docs)
+        for caminho in pdfs:
+            shutil.copy2(caminho, pasta_docs)
+        estatisticas = vetorizar_tema(tema, pasta_docs, os.path.join(temporaria, "data"), embeddings)
+    finally:
+        embeddings.fechar()
+        shutil.rmtree(temporaria, ignore_errors=True)
+    return {"tema": tema, **estatisticas}
+
+
+def avaliar_ponta_a_ponta(perguntas: dict) -> dict:
+    """Pipeline completo (memória nova por pergunta) com o LLM falso."""
+    totais, etapas, temas_certos = [], {}, 0
+    for tema, itens in perguntas.items():
+        for item in itens:
+            resultado = responder_pergunta(item["pergunta"], criar_memoria())
+            metricas = resultado["metricas"]
+            totais.append(metricas["total_s"])
+            temas_certos += resultado["tema"] == tema
+            for etapa, segundos in metricas["etapas"].items():
+                etapas.setdefault(etapa, []).append(segundos)
+    return {
+        "perguntas": len(totais),
+        "tema_correto": round(temas_certos / len(totais), 4) if totais else 0.0,
+        "latencia": _latencias(totais),
+        "etapas_media_ms": {e: round(float(np.mean(s)) * 1000, 3) for e, s in sorted(etapas.items())},
+    }
+
+
+# ================== COMPARAÇÃO ==================
+def _valor(relatorio: dict, caminho: str):
+    for chave in caminho.split("."):
+        if not isinstance(relatorio, dict) or chave not in relatorio:
+            return None
+        relatorio = relatorio[chave]
+    return relatorio if isinstance(relatorio, (int, float)) else None
+
+
+def comparar(atual: dict, base: dict, tolerancia: float = 0.1) -> list:
+    """Imprime atual x base e retorna as métricas que pioraram mais que `tolerancia` (relativa)."""
+    regressoes = []
+    print(f"\n📊 Comparação com {base.get('ambiente', {}).get('commit') or 'base'} (tolerância {tolerancia:.0%})")
+    for caminho, maior_melhor in METRICAS_COMPARADAS:
+        novo, antigo = _valor(atual, caminho), _valor(base, caminho)
+        if novo is None or antigo is None:
+            continue
+        variacao = (novo - antigo) / abs(antigo) if antigo else 0.0
+        piorou = -variacao if maior_melhor else variacao
+        marca = "❌" if piorou > tolerancia else "✅"
+        print(f"   {marca} {caminho:<32} {antigo:>10.3f} -> {novo:>10.3f} ({variacao:+.1%})")
+        if piorou > tolerancia:
+            regressoes.append({"metrica": caminho, "base": antigo, "atual": novo, "variacao": round(variacao, 4)})
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do roteamento, recuperação, ingestão e pipeline")
+    parser.add_argument("--perguntas", default=ARQUIVO_PERGUNTAS, help="JSON {tema: [{pergunta, termos}]}")
+    parser.add_argument("--secoes", nargs="*", choices=SECOES, default=SECOES)
+    parser.add_argument("--k", type=int, default=K_DOCUMENTOS)
+    parser.add_argument("--ingestao-tema", help="subpasta de docs/ usada na ingestão (padrão: a primeira com PDFs)")
+    parser.add_argument("--ingestao-pdfs", type=int, default=3)
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--comparar", help="relatório anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.1)
+    args = parser.parse_args()
+
+    registro = obter_registro().aquecer()
+    perguntas = carregar_perguntas(args.perguntas)
+    textos = [item["pergunta"] for itens in perguntas.values() for item in itens]
+    vetores = dict(zip(textos, registro.embeddings.embed_documents(textos))) if textos else {}
+
+    relatorio = {"ambiente": _ambiente()}
+    if "roteamento" in args.secoes:
+        print("🧭 Roteamento...")
+        relatorio["roteamento"] = avaliar_roteamento(perguntas, vetores)
+    if "recuperacao" in args.secoes:
+        print("🔎 Recuperação...")
+        relatorio["recuperacao"] = avaliar_recuperacao(perguntas, vetores, k=args.k)
+    if "ingestao" in args.secoes:
+        print("📥 Ingestão...")
+        relatorio["ingestao"] = avaliar_ingestao(args.ingestao_tema, args.ingestao_pdfs)
+    if "ponta_a_ponta" in args.secoes:
+        print("🤖 Ponta a ponta (LLM falso)...")
+        relatorio["ponta_a_ponta"] = avaliar_ponta_a_ponta(perguntas)
+
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"💾 Relatório salvo em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            regressoes = comparar(relatorio, json.load(f), args.tolerancia)
+        if regressoes:
+            print(f"❌ {len(regressoes)} métrica(s) pioraram além da tolerância.")
+            sys.exit(1)
+        print("✅ Sem regressões.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# benchmark_indices.py
+# Recall@k x latência x memória dos backends vetoriais (Chroma, exato, IVF, HNSW, int8) sobre as bases dos temas.
+#
+# Uso:
+#   python benchmark_indices.py                          # todos os temas com vetores.npy
+#   python benchmark_indices.py SQL global --k 4 --consultas 200 --saida indices.json
+#
+# As consultas são trechos sorteados da própria base com ruído gaussiano (renormalizados),
+# então o vizinho mais próximo nem sempre é o próprio trecho. A referência é a busca exata.
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmark_roteamento import _percentis
+from indices_vetoriais import ARQUIVO_INT8, ARQUIVO_VETORES, criar_indice_vetorial
+from recuperacao import buscar_por_vetor
+from registro import TEMAS_DISPONIVEIS, obter_registro
+
+SONDAS_IVF = [1, 2, 4, 8, 16, 32]
+EF_HNSW = [16, 32, 64, 128, 256]
+# (rerank, sondas) do int8: rerank 0 = só códigos; sondas 0 = varre tudo
+CONFIGS_INT8 = [(0, 0), (2, 0), (4, 0), (4, 4), (4, 8)]
+
+
+def _mb(pasta: str, arquivo: str) -> float:
+    caminho = os.path.join(pasta, arquivo)
+    return round(os.path.getsize(caminho) / 1e6, 2) if os.path.exists(caminho) else 0.0
+
+
+def gerar_consultas(pasta: str, n: int, ruido: float, semente: int = 42):
+    matriz = np.load(f"{pasta}/{ARQUIVO_VETORES}", mmap_mode="r")
+    rng = np.random.default_rng(semente)
+    linhas = rng.choice(len(matriz), size=min(n, len(matriz)), replace=False)
+    consultas = np.asarray(matriz[np.sort(linhas)], dtype=np.float32)
+    consultas += rng.normal(0, ruido, consultas.shape).astype(np.float32)
+    return consultas / np.linalg.norm(consultas, axis=1, keepdims=True)
+
+
+def medir(nome, funcao, consultas, referencia, k: int, parametros=None):
+    latencias, recalls = [], []
+    for consulta, esperado in zip(consultas, referencia):
+        t0 = time.perf_counter()
+        ids = funcao(consulta)
+        latencias.append(time.perf_counter() - t0)
+        recalls.append(len(set(ids[:k]) & esperado) / max(1, len(esperado)))
+    return {"backend": nome, **(parametros or {}), f"recall@{k}": round(float(np.mean(recalls)), 4), **_percentis(latencias)}
+
+
+def avaliar_tema(tema: str, k: int, n_consultas: int, ruido: float) -> dict:
+    registro = obter_registro()
+    pasta = registro.pasta_tema(tema)
+    consultas = gerar_consultas(pasta, n_consultas, ruido)
+
+    exato = criar_indice_vetorial(pasta, "exato")
+    referencia = [{i for i, _ in exato.buscar(c, k)} for c in consultas]
+    mb_float, mb_int8 = _mb(pasta, ARQUIVO_VETORES), _mb(pasta, ARQUIVO_INT8)
+    resultados = [medir("exato", lambda c: [i for i, _ in exato.buscar(c, k)], consultas, referencia, k, {"mb": mb_float})]
+
+    db = registro.obter_store(tema)
+    if db is not None:
+        resultados.append(medir(
+            "chroma", lambda c: [d.id for d, _ in buscar_por_vetor(db, c, k=k)], consultas, referencia, k
+        ))
+
+    for sondas in SONDAS_IVF:
+        ivf = criar_indice_vetorial(pasta, "ivf", sondas=sondas)
+        resultados.append(medir(
+            "ivf", lambda c: [i for i, _ in ivf.buscar(c, k)], consultas, referencia, k, {"sondas": sondas, "mb": mb_float}
+        ))
+
+    if mb_int8:
+        for rerank, sondas in CONFIGS_INT8:
+            int8 = criar_indice_vetorial(pasta, "int8", rerank=rerank, sondas=sondas)
+            # memória residente: só os códigos (o float32 é lido por linha no re-ranqueamento)
+            resultados.append(medir(
+                "int8", lambda c: [i for i, _ in int8.buscar(c, k)], consultas, referencia, k,
+                {"rerank": rerank, "sondas": sondas, "mb": mb_int8},
+            ))
+    else:
+        print("⚠️ Sem vetores_int8.npy: int8 fora do benchmark (exporte com QUANTIZACAO_INT8=1).")
+
+    try:
+        for ef in EF_HNSW:
+            hnsw = criar_indice_vetorial(pasta, "hnsw", ef=max(ef, k))
+            resultados.append(medir(
+                "hnsw", lambda c: [i for i, _ in hnsw.buscar(c, k)], consultas, referencia, k, {"ef": ef}
+            ))
+    except ImportError:
+        print("⚠️ hnswlib não instalado: HNSW fora do benchmark.")
+
+    return {"tema": tema, "vetores": int(np.load(f"{pasta}/{ARQUIVO_VETORES}", mmap_mode="r").shape[0]),
+            "consultas": len(consultas), "resultados": resultados}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall x latência dos backends vetoriais")
+    parser.add_argument("temas", nargs="*", help="temas (padrão: todos com vetores exportados)")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--ruido", type=float, default=0.03, help="desvio do ruído somado aos trechos")
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    args = parser.parse_args()
+
+    registro = obter_registro()
+    temas = args.temas or [
+        t for t in TEMAS_DISPONIVEIS if criar_indice_vetorial(registro.pasta_tema(t), "exato").disponivel
+    ]
+    if not temas:
+        print("⚠️ Nenhum tema com vetores exportados (rode a ingestão ou `python indices_vetoriais.py`).")
+        return
+
+    relatorio = []
+    for tema in temas:
+        print(f"📏 Avaliando {tema}...")
+        avaliacao = avaliar_tema(tema, args.k, args.consultas, args.ruido)
+        relatorio.append(avaliacao)
+        for r in avaliacao["resultados"]:
+            parametro = "/".join(str(r[p]) for p in ("rerank", "sondas", "ef") if p in r)
+            memoria = f"  {r['mb']:.1f}MB" if "mb" in r else ""
+            print(f"   {r['backend']:<7}{parametro:>5}  recall@{args.k}={r[f'recall@{args.k}']:.3f}  "
+                  f"p50={r['p50_ms']:.2f}ms  p95={r['p95_ms']:.2f}ms{memoria}")
+
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"💾 Relatório salvo em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
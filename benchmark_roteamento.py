@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# benchmark_roteamento.py
+# Compara acurácia e latência do roteamento por centroides x busca exaustiva.
+#
+# Uso:
+#   python benchmark_roteamento.py                       # amostra trechos das próprias bases
+#   python benchmark_roteamento.py --perguntas p.json    # {"tema": ["pergunta", ...], ...}
+import argparse
+import json
+import time
+
+import numpy as np
+
+from registro import TEMAS_DISPONIVEIS, obter_registro
+from roteamento import (
+    MARGEM_ROTEAMENTO,
+    identificar_tema_centroides,
+    identificar_tema_exaustivo,
+    obter_indice_roteamento,
+    temas_sem_prototipos,
+)
+
+
+def amostrar_perguntas(por_tema: int, tamanho: int = 150, semente: int = 42) -> dict:
+    """Usa o início de trechos sorteados de cada base como pergunta rotulada com o tema."""
+    registro = obter_registro()
+    rng = np.random.default_rng(semente)
+    perguntas = {}
+    for tema in TEMAS_DISPONIVEIS:
+        db = registro.obter_store(tema)
+        if db is None:
+            continue
+        total = db._collection.count()
+        if not total:
+            continue
+        offsets = rng.choice(total, size=min(por_tema, total), replace=False)
+        textos = []
+        for offset in offsets:
+            doc = db.get(limit=1, offset=int(offset), include=["documents"])["documents"]
+            if doc and doc[0].strip():
+                textos.append(doc[0].strip()[:tamanho])
+        if textos:
+            perguntas[tema] = textos
+    return perguntas
+
+
+def _percentis(latencias):
+    ms = np.asarray(latencias) * 1000
+    return {
+        "media_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+def medir(nome, funcao, vetores, rotulos, referencia=None):
+    escolhas, latencias = [], []
+    for vetor in vetores:
+        t0 = time.perf_counter()
+        escolhas.append(funcao(vetor))
+        latencias.append(time.perf_counter() - t0)
+
+    resultado = {
+        "metodo": nome,
+        "acuracia": round(float(np.mean([e == r for e, r in zip(escolhas, rotulos)])), 4),
+        **_percentis(latencias),
+    }
+    if referencia is not None:
+        resultado["concordancia_exaustivo"] = round(
+            float(np.mean([e == r for e, r in zip(escolhas, referencia)])), 4
+        )
+    return resultado, escolhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do roteamento de temas")
+    parser.add_argument("--perguntas", help="JSON {tema: [perguntas]} com rótulos conhecidos")
+    parser.add_argument("--por-tema", type=int, default=30, help="amostras por tema (sem --perguntas)")
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    args = parser.parse_args()
+
+    registro = obter_registro().aquecer()
+
+    if args.perguntas:
+        with open(args.perguntas, "r", encoding="utf-8") as f:
+            perguntas = json.load(f)
+    else:
+        perguntas = amostrar_perguntas(args.por_tema)
+
+    textos = [p for tema in perguntas for p in perguntas[tema]]
+    rotulos = [tema for tema in perguntas for _ in perguntas[tema]]
+    if not textos:
+        print("⚠️ Nenhuma pergunta para avaliar (bases vazias?).")
+        return
+
+    print(f"🔍 Vetorizando {len(textos)} perguntas...")
+    vetores = registro.embeddings.embed_documents(textos)
+
+    exaustivo, escolhas_exaustivo = medir(
+        "exaustivo", lambda v: identificar_tema_exaustivo(v)[0], vetores, rotulos
+    )
+    centroides, _ = medir(
+        "centroides", identificar_tema_centroides, vetores, rotulos, referencia=escolhas_exaustivo
+    )
+
+    # fração de perguntas que caem no desempate exaustivo
+    indice = obter_indice_roteamento()
+    faltando = temas_sem_prototipos(indice, registro)
+    fallback = 0
+    for vetor in vetores:
+        sims = sorted(indice.pontuar(vetor).values(), reverse=True)
+        if faltando or len(sims) < 2 or sims[0] - sims[1] < MARGEM_ROTEAMENTO:
+            fallback += 1
+    centroides["taxa_fallback"] = round(fallback / len(vetores), 4)
+
+    relatorio = {
+        "perguntas": len(textos),
+        "temas": {t: len(p) for t, p in perguntas.items()},
+        "temas_sem_prototipos": faltando,
+        "margem": MARGEM_ROTEAMENTO,
+        "resultados": [exaustivo, centroides],
+    }
+
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    print(texto)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"💾 Relatório salvo em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+# cache_embeddings.py
+# Cache persistente de embeddings: (modelo, hash do texto normalizado) -> vetor float32.
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CACHE_EMBEDDINGS_ATIVO = os.getenv("CACHE_EMBEDDINGS", "1") != "0"
+CAMINHO_CACHE_EMBEDDINGS = os.getenv("CACHE_EMBEDDINGS_PASTA", os.path.join("data", "_cache", "embeddings"))
+# teto de vetores guardados (384 dims do MiniLM: ~1,5 KB por vetor)
+CACHE_EMBEDDINGS_MAX = int(os.getenv("CACHE_EMBEDDINGS_MAX", "200000"))
+# o arquivo de vetores cresce nesse passo (em vetores) até o teto
+_PASSO_CRESCIMENTO = 4096
+# acessos (LRU) e contadores da consulta ficam em memória e vão ao SQLite a cada N segundos
+# (e em toda gravação): a consulta não escreve no índice
+CACHE_EMBEDDINGS_DESCARGA_S = float(os.getenv("CACHE_EMBEDDINGS_DESCARGA_S", "30"))
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS vetores (
+    modelo TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    slot INTEGER NOT NULL UNIQUE,
+    geracao INTEGER NOT NULL DEFAULT 0,
+    acessado_em REAL NOT NULL,
+    PRIMARY KEY (modelo, hash)
+);
+CREATE INDEX IF NOT EXISTS idx_vetores_acesso ON vetores (acessado_em);
+CREATE TABLE IF NOT EXISTS meta (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS estatisticas (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# geração gravada no slot enquanto o vetor está sendo escrito
+_ESCREVENDO = -1
+
+_ESPACOS = re.compile(r"\s+")
+
+
+def normalizar_texto(texto: str) -> str:
+    """Unicode NFC e espaços colapsados (o tokenizer do MiniLM ignora a diferença)."""
+    return _ESPACOS.sub(" ", unicodedata.normalize("NFC", texto or "")).strip()
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha1(normalizar_texto(texto).encode("utf-8")).hexdigest()
+
+
+class CacheEmbeddings:
+    """
+    Vetores num arquivo float32 mapeado em memória (`vetores.f32`, uma linha por slot)
+    e o índice (modelo, hash) -> (slot, geração) num SQLite (`indice.sqlite3`).
+    - acima de `max_entradas`, os slots acessados há mais tempo são reaproveitados (LRU)
+    - cada slot tem a geração do vetor que está nele (`geracoes.i64`); a leitura confere a
+      geração antes e depois de copiar o vetor, então um slot reaproveitado por outro
+      processo no meio da leitura vira falta, nunca o vetor de outro texto
+    - gravações e crescimento dos arquivos sob uma trava entre processos (`trava.lock`):
+      a ingestão e o app compartilham a mesma pasta
+    - contadores de acertos/faltas persistidos para a taxa de acerto
+    - a consulta só lê o índice: último acesso e contadores são acumulados em memória e
+      descarregados na próxima gravação ou a cada `descarga_s` segundos
+    """
+
+    def __init__(self, pasta: str = CAMINHO_CACHE_EMBEDDINGS, max_entradas: int = CACHE_EMBEDDINGS_MAX,
+                 descarga_s: float = CACHE_EMBEDDINGS_DESCARGA_S):
+        self.pasta = pasta
+        self.max_entradas = max_entradas
+        self.descarga_s = descarga_s
+        self.caminho_indice = os.path.join(pasta, "indice.sqlite3")
+        self.caminho_vetores = os.path.join(pasta, "vetores.f32")
+        self.caminho_geracoes = os.path.join(pasta, "geracoes.i64")
+        self.caminho_trava = os.path.join(pasta, "trava.lock")
+        self._lock = threading.Lock()
+        self._mapa = None
+        self._geracoes = None
+        self._dim = None
+        # pendentes de descarga: (modelo, hash) -> último acesso e chave -> incremento
+        self._acessos = {}
+        self._pendentes = {}
+        self._ultima_descarga = time.monotonic()
+        os.makedirs(pasta, exist_ok=True)
+        with self._trava(), self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+            colunas = {linha[1] for linha in con.execute("PRAGMA table_info(vetores)")}
+            if "geracao" not in colunas:
+                # caches anteriores: todos os slots na geração 0 (arquivo de gerações zerado)
+                con.execute("ALTER TABLE vetores ADD COLUMN geracao INTEGER NOT NULL DEFAULT 0")
+            dim = self._meta(con, "dim")
+            if dim and os.path.exists(self.caminho_vetores):
+                linhas = os.path.getsize(self.caminho_vetores) // (dim * 4)
+                with open(self.caminho_geracoes, "ab") as f:
+                    if f.tell() < linhas * 8:
+                        f.truncate(linhas * 8)
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho_indice, timeout=30)
+        con.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _trava(self):
+        """Trava exclusiva entre processos (e threads) para gravar e aumentar os arquivos."""
+        with open(self.caminho_trava, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @staticmethod
+    def _contar(con, chave: str, n: int = 1):
+        if n:
+            con.execute(
+                "INSERT INTO estatisticas (chave, valor) VALUES (?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET valor = valor + excluded.valor",
+                (chave, n),
+            )
+
+    def _acumular(self, chave: str, n: int = 1):
+        if n:
+            self._pendentes[chave] = self._pendentes.get(chave, 0) + n
+
+    def _descarregar(self, con):
+        """Grava acessos e contadores acumulados (chamar com self._lock)."""
+        if self._acessos:
+            con.executemany(
+                "UPDATE vetores SET acessado_em = ? WHERE modelo = ? AND hash = ?",
+                [(quando, modelo, h) for (modelo, h), quando in self._acessos.items()],
+            )
+        for chave, n in self._pendentes.items():
+            self._contar(con, chave, n)
+        self._acessos, self._pendentes = {}, {}
+        self._ultima_descarga = time.monotonic()
+
+    def descarregar(self):
+        """Grava já o que está acumulado (ex.: ao encerrar o processo)."""
+        with self._lock:
+            if self._acessos or self._pendentes:
+                with self._conectar() as con:
+                    self._descarregar(con)
+
+    @staticmethod
+    def _meta(con, chave: str, padrao=None):
+        linha = con.execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else padrao
+
+    @staticmethod
+    def _definir_meta(con, chave: str, valor: int):
+        con.execute(
+            "INSERT INTO meta (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+            (chave, valor),
+        )
+
+    # ---------- arquivos de vetores e gerações ----------
+    def _linhas_em_disco(self, dim: int) -> int:
+        def linhas(caminho, tamanho_linha):
+            return os.path.getsize(caminho) // tamanho_linha if os.path.exists(caminho) else 0
+
+        return min(linhas(self.caminho_vetores, dim * 4), linhas(self.caminho_geracoes, 8))
+
+    def _mapas(self, dim: int, slots: int, crescer: bool = False):
+        """
+        (vetores, gerações) mapeados com pelo menos `slots` linhas. Só quem grava (sob a trava)
+        aumenta os arquivos; a leitura só remapeia o que outro processo já aumentou.
+        """
+        if self._mapa is not None and self._dim == dim and len(self._mapa) >= slots:
+            return self._mapa, self._geracoes
+        linhas = self._linhas_em_disco(dim)
+        if linhas < slots:
+            if not crescer:
+                raise ValueError(f"slot {slots - 1} além do arquivo de vetores ({linhas} linhas)")
+            # nunca encolhe: o tamanho é relido sob a trava
+            linhas = min(self.max_entradas, max(slots, linhas + _PASSO_CRESCIMENTO))
+            for caminho, tamanho_linha in ((self.caminho_vetores, dim * 4), (self.caminho_geracoes, 8)):
+                with open(caminho, "ab") as f:
+                    if f.tell() < linhas * tamanho_linha:
+                        f.truncate(linhas * tamanho_linha)
+        if self._mapa is not None:
+            self._mapa.flush()
+            self._geracoes.flush()
+        self._mapa = np.memmap(self.caminho_vetores, dtype=np.float32, mode="r+", shape=(linhas, dim))
+        self._geracoes = np.memmap(self.caminho_geracoes, dtype=np.int64, mode="r+", shape=(linhas,))
+        self._dim = dim
+        return self._mapa, self._geracoes
+
+    # ---------- consulta / gravação ----------
+    def buscar(self, modelo: str, hashes: List[str]) -> dict:
+        """Retorna {hash: vetor} só para os hashes presentes (e íntegros) no cache."""
+        if not hashes:
+            return {}
+        encontrados = {}
+        unicos = list(dict.fromkeys(hashes))
+        with self._lock, self._conectar() as con:
+            dim = self._meta(con, "dim")
+            linhas = []
+            for i in range(0, len(unicos), 500):
+                parte = unicos[i:i + 500]
+                linhas += con.execute(
+                    f"SELECT hash, slot, geracao FROM vetores WHERE modelo = ? AND hash IN ({','.join('?' * len(parte))})",
+                    [modelo, *parte],
+                ).fetchall()
+            if linhas:
+                mapa, geracoes = self._mapas(dim, max(slot for _, slot, _ in linhas) + 1)
+                for h, slot, geracao in linhas:
+                    antes = geracoes[slot]
+                    vetor = np.array(mapa[slot])
+                    # slot reaproveitado (ou sendo escrito) por outro processo: trata como falta
+                    if antes == geracao and geracoes[slot] == geracao:
+                        encontrados[h] = vetor
+                self._acumular("geracao_divergente", len(linhas) - len(encontrados))
+                agora = time.time()
+                for h in encontrados:
+                    self._acessos[(modelo, h)] = agora
+            acertos = sum(1 for h in hashes if h in encontrados)
+            self._acumular("acertos", acertos)
+            self._acumular("faltas", len(hashes) - acertos)
+            if time.monotonic() - self._ultima_descarga >= self.descarga_s:
+                self._descarregar(con)
+        return encontrados
+
+    def guardar(self, modelo: str, itens: dict) -> int:
+        """
+        Grava {hash: vetor} e retorna quantos entraram. Reaproveita os slots menos usados quando
+        o cache está cheio; o que não couber nem assim fica de fora (contado em `nao_gravados`).
+        """
+        if not itens:
+            return 0
+        hashes = list(itens)
+        matriz = np.asarray([itens[h] for h in hashes], dtype=np.float32)
+        dim = matriz.shape[1]
+        agora = time.time()
+        with self._lock, self._trava(), self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            # acessos pendentes antes de escolher quem sai pelo LRU
+            self._descarregar(con)
+            dim_cache = self._meta(con, "dim")
+            if dim_cache is None:
+                self._definir_meta(con, "dim", dim)
+            elif dim_cache != dim:
+                print(f"⚠️ Cache de embeddings tem dimensão {dim_cache}, vetores com {dim}: não gravados.")
+                return 0
+
+            # já presentes (ex.: outro processo gravou antes) não ocupam slot novo
+            existentes = set()
+            for i in range(0, len(hashes), 500):
+                parte = hashes[i:i + 500]
+                existentes.update(
+                    h for (h,) in con.execute(
+                        f"SELECT hash FROM vetores WHERE modelo = ? AND hash IN ({','.join('?' * len(parte))})",
+                        [modelo, *parte],
+                    )
+                )
+            novos = [i for i, h in enumerate(hashes) if h not in existentes]
+            if not novos:
+                return 0
+
+            proximo = self._meta(con, "proximo_slot", 0)
+            livres = max(0, min(len(novos), self.max_entradas - proximo))
+            slots = list(range(proximo, proximo + livres))
+            faltam = len(novos) - livres
+            if faltam:
+                despejados = con.execute(
+                    "SELECT slot FROM vetores ORDER BY acessado_em LIMIT ?", (faltam,)
+                ).fetchall()
+                slots += [s for (s,) in despejados]
+                con.executemany("DELETE FROM vetores WHERE slot = ?", despejados)
+                self._contar(con, "despejados_lru", len(despejados))
+            self._definir_meta(con, "proximo_slot", proximo + livres)
+
+            # lote maior que o cache inteiro: grava o que cabe e avisa
+            nao_gravados = len(novos) - len(slots)
+            if nao_gravados:
+                novos = novos[: len(slots)]
+                self._contar(con, "nao_gravados", nao_gravados)
+                print(f"⚠️ Cache de embeddings cheio: {nao_gravados} vetores não gravados (CACHE_EMBEDDINGS_MAX).")
+            if not slots:
+                return 0
+
+            geracao = self._meta(con, "geracao", 0) + 1
+            self._definir_meta(con, "geracao", geracao)
+            mapa, geracoes = self._mapas(dim, max(slots) + 1, crescer=True)
+            # slot marcado como "em escrita" antes do vetor e com a geração nova só depois
+            geracoes[slots] = _ESCREVENDO
+            for i, slot in zip(novos, slots):
+                mapa[slot] = matriz[i]
+            geracoes[slots] = geracao
+            mapa.flush()
+            geracoes.flush()
+            con.executemany(
+                "INSERT INTO vetores (modelo, hash, slot, geracao, acessado_em) VALUES (?, ?, ?, ?, ?)",
+                [(modelo, hashes[i], slot, geracao, agora) for i, slot in zip(novos, slots)],
+            )
+            return len(novos)
+
+    def estatisticas(self) -> dict:
+        self.descarregar()
+        with self._conectar() as con:
+            stats = dict(con.execute("SELECT chave, valor FROM estatisticas").fetchall())
+            stats["entradas"] = con.execute("SELECT COUNT(*) FROM vetores").fetchone()[0]
+        acertos, faltas = stats.setdefault("acertos", 0), stats.setdefault("faltas", 0)
+        stats["taxa_acerto"] = round(acertos / (acertos + faltas), 4) if acertos + faltas else 0.0
+        return stats
+
+
+class EmbeddingsComCache(Embeddings):
+    """
+    Envolve um modelo de embeddings: textos já vistos (mesmo modelo, mesmo texto
+    normalizado) vêm do cache; só os demais passam pelo modelo, num único lote.
+    """
+
+    def __init__(self, base: Embeddings, modelo: str, cache: CacheEmbeddings):
+        self.base = base
+        self.modelo = modelo
+        self.cache = cache
+        # contadores desta instância (o cache guarda os acumulados)
+        self.acertos = 0
+        self.faltas = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashes = [hash_texto(t) for t in texts]
+        try:
+            encontrados = self.cache.buscar(self.modelo, hashes)
+        except Exception as e:
+            print(f"⚠️ Cache de embeddings indisponível ({e}); calculando direto.")
+            return self.base.embed_documents(texts)
+
+        faltas = [(h, texto) for h, texto in zip(hashes, texts) if h not in encontrados]
+        self.acertos += len(texts) - len(faltas)
+        self.faltas += len(faltas)
+        faltando = dict(faltas)  # textos repetidos no lote são calculados uma vez
+
+        if faltando:
+            vetores = self.base.embed_documents(list(faltando.values()))
+            novos = dict(zip(faltando, vetores))
+            try:
+                self.cache.guardar(self.modelo, novos)
+            except Exception as e:
+                print(f"⚠️ Falha ao gravar no cache de embeddings: {e}")
+            encontrados.update(novos)
+        # float32 nos dois caminhos: o mesmo texto dá o mesmo vetor com ou sem cache
+        return [np.asarray(encontrados[h], dtype=np.float32).tolist() for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    @property
+    def taxa_acerto(self) -> float:
+        total = self.acertos + self.faltas
+        return self.acertos / total if total else 0.0
+
+    @property
+    def chunks_por_segundo(self) -> float:
+        return getattr(self.base, "chunks_por_segundo", 0.0)
+
+    def fechar(self):
+        if hasattr(self.base, "fechar"):
+            self.base.fechar()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def obter_cache_embeddings():
+    """Cache compartilhado pelo processo (None quando CACHE_EMBEDDINGS=0)."""
+    global _CACHE
+    if not CACHE_EMBEDDINGS_ATIVO:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = CacheEmbeddings()
+                atexit.register(_CACHE.descarregar)
+    return _CACHE
+
+
+def com_cache(embeddings: Embeddings, modelo: str) -> Embeddings:
+    """
+    `embeddings` com o cache persistente na frente (ou o próprio, se desativado).
+    A chave é `embeddings.chave_cache` quando existe (modelo + opções que mudam o vetor);
+    senão, `modelo`.
+    """
+    cache = obter_cache_embeddings()
+    chave = getattr(embeddings, "chave_cache", None) or modelo
+    return EmbeddingsComCache(embeddings, chave, cache) if cache is not None else embeddings
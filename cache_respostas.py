@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# cache_respostas.py
+# Cache semântico persistente: pergunta (embedding) + tema -> resposta já gerada.
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from registro import CAMINHO_DATA
+
+CACHE_ATIVO = os.getenv("CACHE_RESPOSTAS", "1") != "0"
+CAMINHO_CACHE = os.getenv("CACHE_RESPOSTAS_ARQUIVO", os.path.join(CAMINHO_DATA, "_cache", "respostas.sqlite3"))
+# similaridade de cosseno mínima para considerar duas perguntas "a mesma"
+CACHE_SIMILARIDADE_MIN = float(os.getenv("CACHE_SIMILARIDADE", "0.95"))
+CACHE_TTL_SEGUNDOS = float(os.getenv("CACHE_TTL_HORAS", "72")) * 3600
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "5000"))
+# acessos e contadores da busca vão ao SQLite a cada N segundos (e em toda gravação)
+CACHE_DESCARGA_S = float(os.getenv("CACHE_RESPOSTAS_DESCARGA_S", "30"))
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS respostas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tema TEXT NOT NULL,
+    versao TEXT,
+    pergunta TEXT NOT NULL,
+    vetor BLOB NOT NULL,
+    chunk_ids TEXT NOT NULL,
+    resposta TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    acessado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_respostas_tema ON respostas (tema);
+CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas (acessado_em);
+CREATE TABLE IF NOT EXISTS estatisticas (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS revisoes (
+    tema TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _normalizar(vetor):
+    v = np.asarray(vetor, dtype=np.float32)
+    n = np.linalg.norm(v)
+    return v / n if n else v
+
+
+class CacheSemantico:
+    """
+    Guarda respostas por tema com o embedding da pergunta.
+    - acerto: pergunta nova com cosseno >= `limiar` contra alguma pergunta do mesmo tema
+    - TTL: entradas com mais de `ttl` segundos são ignoradas na busca e apagadas na gravação
+    - LRU: acima de `max_entradas`, sai quem foi acessado há mais tempo
+    - invalidação: entradas gravadas com outra versão da base do tema são descartadas
+    A matriz de vetores de cada tema fica em memória e só é relida do SQLite quando a versão
+    da base ou a revisão do tema (gravações de qualquer processo) muda. A busca não escreve:
+    acessos e contadores são descarregados na próxima gravação ou a cada `descarga_s` segundos.
+    """
+
+    def __init__(
+        self,
+        caminho: str = CAMINHO_CACHE,
+        limiar: float = CACHE_SIMILARIDADE_MIN,
+        ttl: float = CACHE_TTL_SEGUNDOS,
+        max_entradas: int = CACHE_MAX_ENTRADAS,
+        descarga_s: float = CACHE_DESCARGA_S,
+    ):
+        self.caminho = caminho
+        self.limiar = limiar
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.descarga_s = descarga_s
+        self._lock = threading.Lock()
+        # tema -> {"versao", "revisao", "ids", "criado_em", "matriz"}
+        self._temas = {}
+        # pendentes de descarga: id -> último acesso e chave -> incremento
+        self._acessos = {}
+        self._pendentes = {}
+        self._ultima_descarga = time.monotonic()
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with self._conectar() as con:
+            con.executescript(_ESQUEMA)
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.caminho, timeout=10)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def _contar(con, chave: str, n: int = 1):
+        if n:
+            con.execute(
+                "INSERT INTO estatisticas (chave, valor) VALUES (?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET valor = valor + excluded.valor",
+                (chave, n),
+            )
+
+    def _acumular(self, chave: str, n: int = 1):
+        if n:
+            self._pendentes[chave] = self._pendentes.get(chave, 0) + n
+
+    def _descarregar(self, con):
+        """Grava acessos e contadores acumulados (chamar com self._lock)."""
+        if self._acessos:
+            con.executemany(
+                "UPDATE respostas SET acessado_em = ? WHERE id = ?",
+                [(quando, id_) for id_, quando in self._acessos.items()],
+            )
+        for chave, n in self._pendentes.items():
+            self._contar(con, chave, n)
+        self._acessos, self._pendentes = {}, {}
+        self._ultima_descarga = time.monotonic()
+
+    def descarregar(self):
+        """Grava já o que está acumulado (ex.: ao encerrar o processo)."""
+        with self._lock:
+            if self._acessos or self._pendentes:
+                with self._conectar() as con:
+                    self._descarregar(con)
+
+    # ---------- matriz em memória por tema ----------
+    @staticmethod
+    def _revisao(con, tema: str) -> int:
+        linha = con.execute("SELECT valor FROM revisoes WHERE tema = ?", (tema,)).fetchone()
+        return linha[0] if linha else 0
+
+    @staticmethod
+    def _avancar_revisao(con, tema: str):
+        con.execute(
+            "INSERT INTO revisoes (tema, valor) VALUES (?, 1) "
+            "ON CONFLICT(tema) DO UPDATE SET valor = valor + 1",
+            (tema,),
+        )
+
+    def _carregar_tema(self, con, tema: str, versao, revisao: int) -> dict:
+        linhas = con.execute(
+            "SELECT id, criado_em, vetor FROM respostas WHERE tema = ? AND versao IS ?", (tema, versao)
+        ).fetchall()
+        memoria = {
+            "versao": versao,
+            "revisao": revisao,
+            "ids": np.array([l[0] for l in linhas], dtype=np.int64),
+            "criado_em": np.array([l[1] for l in linhas], dtype=np.float64),
+            "matriz": np.vstack([np.frombuffer(l[2], dtype=np.float32) for l in linhas]) if linhas else None,
+        }
+        self._temas[tema] = memoria
+        return memoria
+
+    # ---------- consulta / gravação ----------
+    def buscar(self, tema: str, vetor, versao=None):
+        """Retorna {"pergunta", "resposta", "chunk_ids", "similaridade"} ou None."""
+        agora = time.time()
+        consulta = _normalizar(vetor)
+        with self._lock, self._conectar() as con:
+            revisao = self._revisao(con, tema)
+            memoria = self._temas.get(tema)
+            if memoria is None or memoria["versao"] != versao or memoria["revisao"] != revisao:
+                memoria = self._carregar_tema(con, tema, versao, revisao)
+
+            encontrado = None
+            if memoria["matriz"] is not None and len(memoria["matriz"]):
+                sims = memoria["matriz"] @ consulta
+                # expiradas continuam no disco até a próxima gravação, mas não acertam
+                sims[memoria["criado_em"] < agora - self.ttl] = -np.inf
+                i = int(np.argmax(sims))
+                if sims[i] >= self.limiar:
+                    id_ = int(memoria["ids"][i])
+                    linha = con.execute(
+                        "SELECT pergunta, chunk_ids, resposta FROM respostas WHERE id = ?", (id_,)
+                    ).fetchone()
+                    if linha:
+                        self._acessos[id_] = agora
+                        encontrado = {
+                            "pergunta": linha[0],
+                            "resposta": linha[2],
+                            "chunk_ids": json.loads(linha[1]),
+                            "similaridade": float(sims[i]),
+                        }
+
+            self._acumular("acertos" if encontrado else "faltas")
+            if time.monotonic() - self._ultima_descarga >= self.descarga_s:
+                self._descarregar(con)
+            return encontrado
+
+    def guardar(self, tema: str, versao, pergunta: str, vetor, chunk_ids, resposta: str):
+        if not (resposta or "").strip():
+            return
+        agora = time.time()
+        vetor = _normalizar(vetor)
+        with self._lock, self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            # acessos pendentes antes de escolher quem sai pelo LRU
+            self._descarregar(con)
+            revisoes = dict(con.execute("SELECT tema, valor FROM revisoes").fetchall())
+
+            # TTL, outra versão do tema e LRU: removidos aqui, nunca na busca
+            expiradas = con.execute(
+                "SELECT id, tema FROM respostas WHERE criado_em < ?", (agora - self.ttl,)
+            ).fetchall()
+            invalidadas = con.execute(
+                "SELECT id, tema FROM respostas WHERE tema = ? AND versao IS NOT ?", (tema, versao)
+            ).fetchall()
+            cursor = con.execute(
+                "INSERT INTO respostas (tema, versao, pergunta, vetor, chunk_ids, resposta, criado_em, acessado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    tema,
+                    versao,
+                    pergunta,
+                    vetor.tobytes(),
+                    json.dumps([c for c in chunk_ids if c]),
+                    resposta,
+                    agora,
+                    agora,
+                ),
+            )
+            novo_id = cursor.lastrowid
+            removidas = dict(expiradas + invalidadas)
+            lru = [
+                (id_, t) for id_, t in con.execute(
+                    "SELECT id, tema FROM respostas WHERE id NOT IN "
+                    "(SELECT id FROM respostas ORDER BY acessado_em DESC LIMIT ?)",
+                    (self.max_entradas,),
+                )
+                if id_ not in removidas
+            ]
+            removidas.update(lru)
+            con.executemany("DELETE FROM respostas WHERE id = ?", [(id_,) for id_ in removidas])
+            self._contar(con, "expiradas", len(expiradas))
+            self._contar(con, "invalidadas", len(invalidadas))
+            self._contar(con, "despejadas_lru", len(lru))
+
+            afetados = set(removidas.values()) | {tema}
+            for t in afetados:
+                self._avancar_revisao(con, t)
+                memoria = self._temas.get(t)
+                if memoria is None or memoria["revisao"] != revisoes.get(t, 0):
+                    # outro processo gravou antes: relê na próxima busca
+                    self._temas.pop(t, None)
+                    continue
+                # a matriz em memória acompanha a gravação sem reler o tema
+                manter = ~np.isin(memoria["ids"], [id_ for id_, t_ in removidas.items() if t_ == t])
+                memoria["ids"] = memoria["ids"][manter]
+                memoria["criado_em"] = memoria["criado_em"][manter]
+                memoria["matriz"] = memoria["matriz"][manter] if memoria["matriz"] is not None else None
+                memoria["revisao"] += 1
+                if t == tema and memoria["versao"] == versao:
+                    memoria["ids"] = np.append(memoria["ids"], novo_id)
+                    memoria["criado_em"] = np.append(memoria["criado_em"], agora)
+                    memoria["matriz"] = (
+                        vetor[None, :] if memoria["matriz"] is None or not len(memoria["matriz"])
+                        else np.vstack([memoria["matriz"], vetor])
+                    )
+
+    def invalidar_tema(self, tema: str) -> int:
+        with self._lock, self._conectar() as con:
+            n = con.execute("DELETE FROM respostas WHERE tema = ?", (tema,)).rowcount
+            self._contar(con, "invalidadas", n)
+            self._avancar_revisao(con, tema)
+            self._temas.pop(tema, None)
+            return n
+
+    def estatisticas(self) -> dict:
+        self.descarregar()
+        with self._conectar() as con:
+            stats = dict(con.execute("SELECT chave, valor FROM estatisticas").fetchall())
+            stats["entradas"] = con.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+        acertos, faltas = stats.get("acertos", 0), stats.get("faltas", 0)
+        stats.setdefault("acertos", acertos)
+        stats.setdefault("faltas", faltas)
+        stats["taxa_acerto"] = round(acertos / (acertos + faltas), 4) if acertos + faltas else 0.0
+        return stats
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def obter_cache():
+    """Cache compartilhado pelo processo (None quando CACHE_RESPOSTAS=0)."""
+    global _CACHE
+    if not CACHE_ATIVO:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = CacheSemantico()
+                atexit.register(_CACHE.descarregar)
+    return _CACHE
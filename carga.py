@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# carga.py
+# Teste de carga: N sessões de chat simultâneas, com conversas de vários turnos, contra o LLM falso.
+#
+# Uso:
+#   python carga.py                                  # rampa 1, 2, 4, 8, 16, 32 sessões
+#   python carga.py --niveis 8 16 32 64 --turnos 6 --pausa 1.5 --saida carga.json
+#   python carga.py --memoria buffer                 # compara o crescimento de memória por sessão
+#   LLM_FALSO_ATRASO_INICIAL=0.8 python carga.py     # latência do provedor simulada
+#
+# Cada sessão é uma thread, como o script do Streamlit: envia a pergunta ao serviço compartilhado
+# (servico.py), acompanha o streaming e guarda a memória da conversa até o fim do nível.
+# Por nível: vazão, p50/p95/p99 (total e primeiro token), espera na fila e RSS por sessão.
+# Saturação: primeiro nível em que a vazão deixa de crescer (ganho < --ganho-minimo) ou
+# o p95 passa de --slo-p95-ms; a capacidade é o nível anterior.
+#
+# O LLM é sempre o falso (nunca dispara a carga contra a API paga, mesmo com NATHALIA_LLM
+# exportado) e os caches ficam desligados para não misturar a carga aos caches de produção.
+import os
+
+os.environ["NATHALIA_LLM"] = "fake"
+os.environ["CACHE_RESPOSTAS"] = "0"
+os.environ["CACHE_EMBEDDINGS"] = "0"
+os.environ.setdefault("RASTRO_LOG", "0")
+os.environ.setdefault("LLM_FALSO_ATRASO_INICIAL", "0.3")
+os.environ.setdefault("LLM_FALSO_ATRASO_TOKEN", "0.005")
+
+import argparse  # noqa: E402
+import gc  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+
+import numpy as np  # noqa: E402
+import psutil  # noqa: E402
+
+from conversa import criar_memoria  # noqa: E402
+from registro import obter_registro  # noqa: E402
+from reranqueamento import obter_reranqueador  # noqa: E402
+from servico import obter_servico  # noqa: E402
+
+ARQUIVO_PERGUNTAS = "perguntas_benchmark.json"
+NIVEIS_PADRAO = [1, 2, 4, 8, 16, 32]
+# perguntas de continuação (dependem do histórico: passam pela reescrita)
+CONTINUACOES = [
+    "Pode dar um exemplo prático?",
+    "E quais são as limitações disso?",
+    "Como isso se aplica no dia a dia de uma empresa?",
+    "Resuma em três tópicos.",
+    "E o que devo evitar?",
+]
+
+
+def _rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def _latencias(segundos) -> dict:
+    if not len(segundos):
+        return {}
+    ms = np.asarray(segundos) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "max_ms": round(float(ms.max()), 1),
+    }
+
+
+def roteiros(caminho: str = ARQUIVO_PERGUNTAS) -> list:
+    """Uma conversa por tema: cada pergunta inicial seguida de uma continuação."""
+    with open(caminho, "r", encoding="utf-8") as f:
+        perguntas = json.load(f)
+    conversas = []
+    for itens in perguntas.values():
+        turnos = []
+        for i, item in enumerate(itens):
+            turnos += [item["pergunta"], CONTINUACOES[i % len(CONTINUACOES)]]
+        conversas.append(turnos)
+    return conversas
+
+
+# ================== SESSÃO SIMULADA ==================
+def simular_sessao(roteiro: list, turnos: int, pausa: float, modo_memoria: str, coleta: dict, semente: int):
+    """Conversa de `turnos` perguntas; a memória fica em `coleta` (como no session_state)."""
+    aleatorio = random.Random(semente)
+    servico = obter_servico()
+    memoria = criar_memoria(modo_memoria)
+    inicio_roteiro = aleatorio.randrange(len(roteiro))
+    for turno in range(turnos):
+        pergunta = roteiro[(inicio_roteiro + turno) % len(roteiro)]
+        t0 = time.perf_counter()
+        primeiro = None
+        try:
+            tarefa = servico.enviar(pergunta, memoria)
+            for _ in tarefa.acompanhar():
+                if primeiro is None:
+                    primeiro = time.perf_counter() - t0
+            resultado = tarefa.resultado()
+        except Exception as e:
+            with coleta["lock"]:
+                coleta["erros"].append(f"{type(e).__name__}: {e}")
+            continue
+        total = time.perf_counter() - t0
+        with coleta["lock"]:
+            coleta["totais"].append(total)
+            coleta["primeiro_token"].append(primeiro if primeiro is not None else total)
+            coleta["fila"].append(resultado.get("metricas", {}).get("fila_s", 0.0))
+        if pausa:
+            # tempo de leitura/digitação do usuário
+            time.sleep(aleatorio.uniform(0.5, 1.5) * pausa)
+    with coleta["lock"]:
+        coleta["memorias"].append(memoria)
+
+
+def executar_nivel(sessoes: int, conversas: list, turnos: int, pausa: float, modo_memoria: str) -> dict:
+    gc.collect()
+    rss_inicio = _rss_mb()
+    coleta = {"lock": threading.Lock(), "totais": [], "primeiro_token": [], "fila": [], "erros": [], "memorias": []}
+    threads = [
+        threading.Thread(
+            target=simular_sessao,
+            args=(conversas[i % len(conversas)], turnos, pausa, modo_memoria, coleta, i),
+            name=f"sessao-{i}",
+            daemon=True,
+        )
+        for i in range(sessoes)
+    ]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - t0
+    # memórias ainda vivas: o crescimento inclui o histórico guardado por sessão
+    rss_fim = _rss_mb()
+    coleta["memorias"].clear()
+    gc.collect()
+
+    respondidas = len(coleta["totais"])
+    return {
+        "sessoes": sessoes,
+        "perguntas": respondidas,
+        "erros": len(coleta["erros"]),
+        "duracao_s": round(duracao, 2),
+        "vazao_por_s": round(respondidas / duracao, 2) if duracao else 0.0,
+        "latencia": _latencias(coleta["totais"]),
+        "primeiro_token": _latencias(coleta["primeiro_token"]),
+        "fila_p95_ms": round(float(np.percentile(coleta["fila"], 95)) * 1000, 1) if coleta["fila"] else 0.0,
+        "rss_mb": round(rss_fim, 1),
+        "rss_por_sessao_mb": round((rss_fim - rss_inicio) / sessoes, 3),
+        "exemplos_erro": coleta["erros"][:3],
+    }
+
+
+def encontrar_saturacao(resultados: list, ganho_minimo: float, slo_p95_ms: float):
+    """Primeiro nível em que a vazão para de crescer, o p95 estoura o SLO ou surgem erros."""
+    for anterior, atual in zip(resultados, resultados[1:]):
+        ganho = atual["vazao_por_s"] / anterior["vazao_por_s"] - 1 if anterior["vazao_por_s"] else 0.0
+        motivo = None
+        if atual["erros"]:
+            motivo = f"{atual['erros']} erro(s)"
+        elif slo_p95_ms and atual["latencia"].get("p95_ms", 0) > slo_p95_ms:
+            motivo = f"p95 {atual['latencia']['p95_ms']:.0f} ms > SLO {slo_p95_ms:.0f} ms"
+        elif ganho < ganho_minimo:
+            motivo = f"vazão +{ganho:.0%} (< {ganho_minimo:.0%})"
+        if motivo:
+            return {"nivel": atual["sessoes"], "capacidade": anterior["sessoes"], "motivo": motivo}
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga com sessões de chat simultâneas (LLM falso)")
+    parser.add_argument("--niveis", type=int, nargs="*", default=NIVEIS_PADRAO, help="sessões simultâneas por nível")
+    parser.add_argument("--turnos", type=int, default=4, help="perguntas por sessão")
+    parser.add_argument("--pausa", type=float, default=0.0, help="pausa média entre turnos (s)")
+    parser.add_argument("--memoria", choices=["limitada", "buffer"], default=None, help="modo de memória das sessões")
+    parser.add_argument("--perguntas", default=ARQUIVO_PERGUNTAS)
+    parser.add_argument("--ganho-minimo", type=float, default=0.1, help="ganho de vazão abaixo do qual satura")
+    parser.add_argument("--slo-p95-ms", type=float, default=0.0, help="p95 máximo aceito (0 desliga)")
+    parser.add_argument("--parar-na-saturacao", action="store_true")
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    args = parser.parse_args()
+
+    conversas = roteiros(args.perguntas)
+    print("🔥 Aquecendo modelos e bases...")
+    obter_reranqueador()
+    obter_registro().aquecer()
+    servico = obter_servico()
+    servico.enviar(conversas[0][0], criar_memoria(args.memoria), streaming=False).resultado()
+    rss_base = _rss_mb()
+    print(f"💾 RSS após aquecimento: {rss_base:.0f} MB | serviço: {servico.max_concorrentes} concorrentes")
+
+    resultados = []
+    for sessoes in sorted(set(args.niveis)):
+        resultado = executar_nivel(sessoes, conversas, args.turnos, args.pausa, args.memoria)
+        resultados.append(resultado)
+        print(
+            f"👥 {sessoes:>4} sessões | {resultado['vazao_por_s']:>7.2f} perg/s | "
+            f"p50 {resultado['latencia'].get('p50_ms', 0):>8.0f} ms | p95 {resultado['latencia'].get('p95_ms', 0):>8.0f} ms | "
+            f"p99 {resultado['latencia'].get('p99_ms', 0):>8.0f} ms | fila p95 {resultado['fila_p95_ms']:>7.0f} ms | "
+            f"RSS {resultado['rss_mb']:.0f} MB ({resultado['rss_por_sessao_mb']:+.2f} MB/sessão) | "
+            f"erros {resultado['erros']}"
+        )
+        if args.parar_na_saturacao and encontrar_saturacao(resultados, args.ganho_minimo, args.slo_p95_ms):
+            break
+
+    saturacao = encontrar_saturacao(resultados, args.ganho_minimo, args.slo_p95_ms)
+    if saturacao:
+        print(f"🧱 Saturação em {saturacao['nivel']} sessões ({saturacao['motivo']}); "
+              f"capacidade ≈ {saturacao['capacidade']} sessões.")
+    else:
+        print("✅ Sem saturação nos níveis testados.")
+
+    relatorio = {
+        "config": {
+            "turnos": args.turnos,
+            "pausa_s": args.pausa,
+            "memoria": args.memoria or "padrão",
+            "max_concorrentes": servico.max_concorrentes,
+            "llm_atraso_inicial_s": float(os.environ["LLM_FALSO_ATRASO_INICIAL"]),
+            "llm_atraso_token_s": float(os.environ["LLM_FALSO_ATRASO_TOKEN"]),
+        },
+        "rss_base_mb": round(rss_base, 1),
+        "niveis": resultados,
+        "saturacao": saturacao,
+    }
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"💾 Relatório salvo em {args.saida}")
+    servico.fechar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# conversa.py
+# Histórico da conversa: memória com orçamento de tokens e perguntas de acompanhamento.
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.prompts import PromptTemplate
+from pydantic import PrivateAttr
+
+from modelos import MODELO_RESPOSTA, contar_tokens, criar_llm, truncar_tokens
+
+# "llm"    -> reescreve com o LLM de resposta (comportamento original, +1 chamada de rede)
+# "barato" -> reescreve com um modelo menor (MODELO_REESCRITA)
+# "local"  -> sem LLM: busca com as últimas N perguntas do usuário + a pergunta atual
+# "auto"   -> sem histórico ou pergunta autossuficiente: usa a própria pergunta; senão "local"
+ESTRATEGIA_ACOMPANHAMENTO = os.getenv("ACOMPANHAMENTO_ESTRATEGIA", "auto")
+MODELO_REESCRITA = os.getenv("MODELO_REESCRITA", "gpt-4.1-nano")
+TURNOS_LOCAIS = int(os.getenv("ACOMPANHAMENTO_TURNOS", "2"))
+
+# marcas de que a pergunta depende do que foi dito antes
+_MARCAS_DEPENDENCIA = re.compile(
+    r"\b(isso|isto|disso|nisso|esse|essa|esses|essas|desse|dessa|nesse|nessa|"
+    r"ele|ela|eles|elas|dele|dela|acima|anterior|mesmo|mesma|também|tambem|"
+    r"e se|e no caso|e quanto|e para|e pra|continue|continua|mais detalhes|explique melhor)\b",
+    re.IGNORECASE,
+)
+MIN_PALAVRAS_AUTOSSUFICIENTE = 6
+
+# "limitada" -> janela deslizante + resumo incremental com teto de tokens
+# "buffer"   -> ConversationBufferMemory (histórico inteiro no prompt)
+MODO_MEMORIA = os.getenv("MEMORIA_MODO", "limitada")
+MEMORIA_LIMITE_TOKENS = int(os.getenv("MEMORIA_LIMITE_TOKENS", "1500"))
+MEMORIA_LIMITE_RESUMO = int(os.getenv("MEMORIA_LIMITE_RESUMO", "400"))
+
+
+def formatar_historico(mensagens) -> str:
+    """Mesmo formato que o ConversationalRetrievalChain usava no {chat_history} do prompt."""
+    return _get_chat_history(mensagens)
+
+
+def pergunta_autossuficiente(pergunta: str) -> bool:
+    """Heurística barata: pergunta longa o bastante e sem referência ao que veio antes."""
+    pergunta = (pergunta or "").strip()
+    if len(pergunta.split()) < MIN_PALAVRAS_AUTOSSUFICIENTE:
+        return False
+    return not _MARCAS_DEPENDENCIA.search(pergunta)
+
+
+def consulta_local(pergunta: str, mensagens, turnos: int = TURNOS_LOCAIS) -> str:
+    """Concatena as últimas `turnos` perguntas do usuário com a atual (para embedding)."""
+    anteriores = [m.content for m in mensagens if isinstance(m, HumanMessage) and m.content][-turnos:]
+    return "\n".join(anteriores + [pergunta]) if turnos > 0 else pergunta
+
+
+def reescrever_com_llm(pergunta: str, mensagens, modelo: str = None) -> str:
+    llm = criar_llm(modelo=modelo or MODELO_RESPOSTA)
+    prompt = CONDENSE_QUESTION_PROMPT.format(
+        question=pergunta, chat_history=formatar_historico(mensagens)
+    )
+    return (llm.invoke(prompt).content or pergunta).strip()
+
+
+def preparar_consulta(pergunta: str, mensagens, estrategia: str = None) -> dict:
+    """
+    Decide o texto usado na busca e na pergunta enviada ao prompt final.
+    Retorna {"busca": str, "pergunta": str, "estrategia": str} — `estrategia` é a
+    efetivamente aplicada ("nenhuma" quando a própria pergunta serve).
+    """
+    estrategia = estrategia or ESTRATEGIA_ACOMPANHAMENTO
+
+    if not mensagens:
+        return {"busca": pergunta, "pergunta": pergunta, "estrategia": "nenhuma"}
+
+    if estrategia == "auto":
+        if pergunta_autossuficiente(pergunta):
+            return {"busca": pergunta, "pergunta": pergunta, "estrategia": "nenhuma"}
+        estrategia = "local"
+
+    if estrategia == "local":
+        # o histórico completo continua indo no prompt; só a busca é enriquecida
+        return {"busca": consulta_local(pergunta, mensagens), "pergunta": pergunta, "estrategia": "local"}
+
+    modelo = MODELO_REESCRITA if estrategia == "barato" else None
+    reescrita = reescrever_com_llm(pergunta, mensagens, modelo=modelo)
+    return {"busca": reescrita, "pergunta": reescrita, "estrategia": estrategia}
+
+
+# ================== MEMÓRIA COM ORÇAMENTO DE TOKENS ==================
+PROMPT_RESUMO = PromptTemplate.from_template(
+    """Atualize o resumo da conversa entre um usuário e a Nathal.IA incorporando as novas falas.
+Mantenha fatos, números, decisões e restrições citadas pelo usuário. Responda só com o resumo,
+em português, em no máximo {limite} palavras.
+
+Resumo atual:
+{resumo}
+
+Novas falas:
+{novas_falas}
+
+Novo resumo:"""
+)
+
+_EXECUTOR_RESUMO = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resumo-memoria")
+
+
+class MemoriaLimitada(BaseChatMemory):
+    """
+    Memória de chat com teto fixo de tokens no prompt:
+    - janela deslizante com as mensagens mais recentes que cabem no orçamento;
+    - resumo incremental do que saiu da janela, atualizado em segundo plano
+      (o turno atual nunca espera pelo LLM de resumo).
+    `chat_memory` guarda a conversa inteira (para exibir na tela); só o prompt é limitado.
+    """
+
+    memory_key: str = "chat_history"
+    limite_tokens: int = MEMORIA_LIMITE_TOKENS
+    limite_resumo: int = MEMORIA_LIMITE_RESUMO
+    modelo_resumo: str = MODELO_REESCRITA
+    resumo: str = ""
+    tokens_ultimo_turno: int = 0
+
+    _resumidas: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _futuro: Any = PrivateAttr(default=None)
+    _tokens_msg: Dict[int, int] = PrivateAttr(default_factory=dict)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def _tokens(self, i: int, mensagem) -> int:
+        if i not in self._tokens_msg:
+            self._tokens_msg[i] = contar_tokens(mensagem.content) + 4
+        return self._tokens_msg[i]
+
+    def _inicio_janela(self, mensagens) -> int:
+        """Índice da 1ª mensagem da janela (orçamento já descontado o espaço do resumo)."""
+        orcamento = self.limite_tokens - self.limite_resumo
+        usado = 0
+        inicio = len(mensagens)
+        for i in range(len(mensagens) - 1, -1, -1):
+            usado += self._tokens(i, mensagens[i])
+            if usado > orcamento:
+                break
+            inicio = i
+        return inicio
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        mensagens = list(self.chat_memory.messages)
+        inicio = self._inicio_janela(mensagens)
+        janela = mensagens[inicio:]
+        if self.resumo:
+            janela = [SystemMessage(content=f"Resumo da conversa até aqui: {self.resumo}")] + janela
+        self.tokens_ultimo_turno = sum(contar_tokens(m.content) + 4 for m in janela)
+        if self.return_messages:
+            return {self.memory_key: janela}
+        return {self.memory_key: formatar_historico(janela)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        with self._lock:
+            if self._futuro is None or self._futuro.done():
+                self._futuro = _EXECUTOR_RESUMO.submit(self._atualizar_resumo)
+
+    def _atualizar_resumo(self):
+        """Resume as mensagens que saíram da janela e ainda não entraram no resumo."""
+        while True:
+            mensagens = list(self.chat_memory.messages)
+            fim = self._inicio_janela(mensagens)
+            if fim <= self._resumidas:
+                return
+            novas = mensagens[self._resumidas:fim]
+            try:
+                prompt = PROMPT_RESUMO.format(
+                    limite=int(self.limite_resumo * 0.7),
+                    resumo=self.resumo or "(vazio)",
+                    novas_falas=formatar_historico(novas),
+                )
+                novo = criar_llm(modelo=self.modelo_resumo).invoke(prompt).content
+            except Exception as e:
+                print(f"⚠️ Falha ao atualizar o resumo da conversa: {e}")
+                return
+            self.resumo = truncar_tokens((novo or "").strip(), self.limite_resumo)
+            self._resumidas = fim
+
+    def aguardar_resumo(self, timeout: float = None):
+        """Espera o resumo em segundo plano terminar (útil em scripts e benchmarks)."""
+        futuro = self._futuro
+        if futuro is not None:
+            futuro.result(timeout=timeout)
+
+    def clear(self) -> None:
+        super().clear()
+        self.resumo = ""
+        self._resumidas = 0
+        self._tokens_msg.clear()
+
+
+def criar_memoria(modo: str = None):
+    """Memória usada pela sessão de chat (ver MEMORIA_MODO)."""
+    if (modo or MODO_MEMORIA) == "buffer":
+        return ConversationBufferMemory(
+            memory_key="chat_history",
+            input_key="question",
+            output_key="answer",
+            return_messages=True,
+        )
+    return MemoriaLimitada(input_key="question", output_key="answer", return_messages=True)
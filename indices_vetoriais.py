@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+# indices_vetoriais.py
+# Backends de busca vetorial por tema: Chroma (padrão), exato sobre matriz mapeada, IVF e HNSW.
+import os
+import sys
+import threading
+
+import numpy as np
+
+from registro import TEMAS_DISPONIVEIS, obter_registro
+from roteamento import LOTE_LEITURA, calcular_prototipos
+
+# "chroma" (busca do próprio Chroma), "exato", "ivf", "hnsw" ou "int8"
+INDICE_VETORIAL = os.getenv("INDICE_VETORIAL", "chroma")
+# IVF: listas (0 = ~4*sqrt(n)) e quantas listas visitar por consulta
+IVF_LISTAS = int(os.getenv("IVF_LISTAS", "0"))
+IVF_SONDAS = int(os.getenv("IVF_SONDAS", "8"))
+# HNSW (hnswlib, opcional): conexões por nó, ef de construção e ef de busca
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCAO = int(os.getenv("HNSW_EF_CONSTRUCAO", "200"))
+HNSW_EF = int(os.getenv("HNSW_EF", "64"))
+# int8: grava a cópia quantizada na exportação (por padrão só quando é o backend escolhido);
+# candidatos re-ranqueados em float32 (k * QUANTIZACAO_RERANK; 0 = só códigos) e listas IVF
+# visitadas (0 = varre tudo)
+QUANTIZACAO_INT8 = os.getenv("QUANTIZACAO_INT8", "1" if INDICE_VETORIAL == "int8" else "0") != "0"
+QUANTIZACAO_RERANK = int(os.getenv("QUANTIZACAO_RERANK", "4"))
+QUANTIZACAO_SONDAS = int(os.getenv("QUANTIZACAO_SONDAS", "8"))
+
+ARQUIVO_VETORES = "vetores.npy"
+ARQUIVO_IDS = "vetores_ids.npy"
+ARQUIVO_IVF = "ivf.npz"
+ARQUIVO_HNSW = "hnsw.bin"
+ARQUIVO_INT8 = "vetores_int8.npy"
+ARQUIVO_ESCALA = "vetores_escala.npy"
+MAX_AMOSTRA_IVF = 20000
+# linhas por bloco ao converter códigos int8 para float32 na busca
+BLOCO_INT8 = 8192
+
+
+# ================== EXPORTAÇÃO (ingestão) ==================
+def _ler_tudo(store):
+    """IDs e embeddings de todos os chunks da base, em lotes."""
+    total = store._collection.count()
+    ids, partes = [], []
+    for offset in range(0, total, LOTE_LEITURA):
+        lote = store._collection.get(limit=LOTE_LEITURA, offset=offset, include=["embeddings"])
+        if len(lote["ids"]):
+            ids += lote["ids"]
+            partes.append(np.asarray(lote["embeddings"], dtype=np.float32))
+    matriz = np.vstack(partes) if partes else np.zeros((0, 0), dtype=np.float32)
+    return ids, matriz
+
+
+def _listas_ivf(matriz, n_listas: int, semente: int = 0):
+    """Centroides (k-means esférico numa amostra) e a lista de cada vetor."""
+    rng = np.random.default_rng(semente)
+    amostra = matriz
+    if len(matriz) > MAX_AMOSTRA_IVF:
+        amostra = matriz[rng.choice(len(matriz), size=MAX_AMOSTRA_IVF, replace=False)]
+    centroides = calcular_prototipos(amostra, n_prototipos=n_listas, semente=semente)
+    listas = np.concatenate(
+        [np.argmax(matriz[i:i + LOTE_LEITURA] @ centroides.T, axis=1) for i in range(0, len(matriz), LOTE_LEITURA)]
+    )
+    return centroides, listas
+
+
+def quantizar_int8(matriz):
+    """Quantização escalar simétrica por dimensão: x ≈ codigo * escala, codigo em [-127, 127]."""
+    escala = np.abs(matriz).max(axis=0) / 127.0
+    escala[escala == 0] = 1.0
+    codigos = np.clip(np.rint(matriz / escala), -127, 127).astype(np.int8)
+    return codigos, escala.astype(np.float32)
+
+
+def _recall_int8(matriz, codigos, escala, k: int = 4, n: int = 100, semente: int = 0) -> float:
+    """Recall@k da busca só nos códigos contra a busca exata, com trechos da base (com ruído) como consulta."""
+    rng = np.random.default_rng(semente)
+    consultas = matriz[rng.choice(len(matriz), size=min(n, len(matriz)), replace=False)]
+    consultas = consultas + rng.normal(0, 0.03, consultas.shape).astype(np.float32)
+    normas = np.einsum("ij,ij->i", matriz, matriz)
+    reconstruida = codigos.astype(np.float32) * escala
+    normas_q = np.einsum("ij,ij->i", reconstruida, reconstruida)
+    acertos = 0
+    for q in consultas:
+        exato = set(_k_menores(normas - 2 * (matriz @ q), k))
+        aproximado = set(_k_menores(normas_q - 2 * (reconstruida @ q), k))
+        acertos += len(exato & aproximado)
+    return acertos / (k * len(consultas))
+
+
+def _tamanho_pasta(pasta: str) -> int:
+    """Bytes de todos os arquivos da pasta do tema (Chroma, vetores exportados, índices)."""
+    total = 0
+    for root, _, files in os.walk(pasta):
+        for arquivo in files:
+            try:
+                total += os.path.getsize(os.path.join(root, arquivo))
+            except OSError:
+                pass
+    return total
+
+
+def exportar_vetores(store, pasta_data_tema: str, n_listas: int = IVF_LISTAS, int8: bool = QUANTIZACAO_INT8):
+    """
+    Grava a matriz float32 do tema (`vetores.npy`, ordenada por lista IVF para cada lista
+    ser uma fatia contígua), os IDs na mesma ordem, os centroides IVF e, com `int8`,
+    a cópia quantizada (`vetores_int8.npy` + escala por dimensão).
+    `vetores.npy` é trocado por último: quem o vê novo já encontra os demais arquivos novos.
+    """
+    ids, matriz = _ler_tudo(store)
+    resumo_int8 = None
+    caminhos = {
+        a: os.path.join(pasta_data_tema, a)
+        for a in (ARQUIVO_VETORES, ARQUIVO_IDS, ARQUIVO_IVF, ARQUIVO_HNSW, ARQUIVO_INT8, ARQUIVO_ESCALA)
+    }
+    if not ids:
+        for caminho in caminhos.values():
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        return None
+
+    n_listas = n_listas or max(1, int(4 * np.sqrt(len(ids))))
+    centroides, listas = _listas_ivf(matriz, n_listas)
+    ordem = np.argsort(listas, kind="stable")
+    inicio = np.searchsorted(listas[ordem], np.arange(len(centroides) + 1))
+
+    matriz = matriz[ordem]
+
+    if int8:
+        codigos, escala = quantizar_int8(matriz)
+        np.save(os.path.join(pasta_data_tema, "vetores_escala.tmp.npy"), escala)
+        os.replace(os.path.join(pasta_data_tema, "vetores_escala.tmp.npy"), caminhos[ARQUIVO_ESCALA])
+        np.save(os.path.join(pasta_data_tema, "vetores_int8.tmp.npy"), codigos)
+        os.replace(os.path.join(pasta_data_tema, "vetores_int8.tmp.npy"), caminhos[ARQUIVO_INT8])
+        resumo_int8 = (
+            f"🗜️ int8: códigos {codigos.nbytes / 1e6:.1f} MB (matriz float32 {matriz.nbytes / 1e6:.1f} MB) | "
+            f"recall@4 só nos códigos: {_recall_int8(matriz, codigos, escala):.3f}"
+        )
+    else:
+        for arquivo in (ARQUIVO_INT8, ARQUIVO_ESCALA):
+            if os.path.exists(caminhos[arquivo]):
+                os.remove(caminhos[arquivo])
+
+    np.savez(os.path.join(pasta_data_tema, "ivf.tmp.npz"), centroides=centroides, inicio=inicio)
+    os.replace(os.path.join(pasta_data_tema, "ivf.tmp.npz"), caminhos[ARQUIVO_IVF])
+    np.save(os.path.join(pasta_data_tema, "vetores_ids.tmp.npy"), np.array(ids, dtype=str)[ordem])
+    os.replace(os.path.join(pasta_data_tema, "vetores_ids.tmp.npy"), caminhos[ARQUIVO_IDS])
+    np.save(os.path.join(pasta_data_tema, "vetores.tmp.npy"), matriz)
+    os.replace(os.path.join(pasta_data_tema, "vetores.tmp.npy"), caminhos[ARQUIVO_VETORES])
+    if os.path.exists(caminhos[ARQUIVO_HNSW]):
+        # grafo HNSW é refeito na próxima consulta
+        os.remove(caminhos[ARQUIVO_HNSW])
+    print(f"🧮 Vetores exportados: {len(ids)} x {matriz.shape[1]} ({len(centroides)} listas IVF) em {pasta_data_tema}")
+    if resumo_int8:
+        # os códigos são um arquivo a mais: o Chroma (texto) e vetores.npy (re-ranqueamento) continuam no disco
+        print(f"{resumo_int8} | tema no disco: {_tamanho_pasta(pasta_data_tema) / 1e6:.1f} MB no total")
+    return len(ids)
+
+
+# ================== BUSCA ==================
+def _k_menores(distancias, k: int):
+    k = min(k, len(distancias))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    melhores = np.argpartition(distancias, k - 1)[:k]
+    return melhores[np.argsort(distancias[melhores])]
+
+
+class IndiceVetorial:
+    """
+    Base dos backends sobre `vetores.npy` (mapeado em memória, não carregado na RAM).
+    Recarrega quando o arquivo muda. `buscar` devolve [(chunk_id, distancia L2²)],
+    a mesma métrica do Chroma.
+    """
+
+    nome = "exato"
+
+    def __init__(self, pasta_data_tema: str):
+        self.pasta = pasta_data_tema
+        self._mtime = None
+        self._dados = None
+        self._lock = threading.Lock()
+
+    def _caminho(self, arquivo):
+        return os.path.join(self.pasta, arquivo)
+
+    def _carregar(self) -> bool:
+        try:
+            mtime = os.stat(self._caminho(ARQUIVO_VETORES)).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return True
+        with self._lock:
+            if mtime != self._mtime:
+                # troca atômica: consultas em andamento seguem com os dados anteriores
+                self._dados = self._preparar()
+                self._mtime = mtime
+        return True
+
+    def _preparar(self) -> dict:
+        matriz = np.load(self._caminho(ARQUIVO_VETORES), mmap_mode="r")
+        ids = np.load(self._caminho(ARQUIVO_IDS))
+        normas = np.einsum("ij,ij->i", matriz, matriz).astype(np.float32)
+        return {"matriz": matriz, "ids": ids, "normas": normas}
+
+    @property
+    def disponivel(self) -> bool:
+        return self._carregar()
+
+    @staticmethod
+    def _distancias(dados, vetor, inicio=0, fim=None):
+        """||x||² - 2 x·q + ||q||² para as linhas [inicio, fim)."""
+        bloco = dados["matriz"][inicio:fim]
+        return dados["normas"][inicio:fim] - 2.0 * (bloco @ vetor) + float(vetor @ vetor)
+
+    def buscar(self, vetor, k: int = 4):
+        if not self._carregar():
+            return []
+        dados = self._dados
+        q = np.asarray(vetor, dtype=np.float32)
+        distancias = self._distancias(dados, q)
+        return [(str(dados["ids"][i]), float(distancias[i])) for i in _k_menores(distancias, k)]
+
+
+class IndiceIVF(IndiceVetorial):
+    """IVF-Flat: visita só as `sondas` listas de centroides mais próximos da consulta."""
+
+    nome = "ivf"
+
+    def __init__(self, pasta_data_tema: str, sondas: int = IVF_SONDAS):
+        super().__init__(pasta_data_tema)
+        self.sondas = sondas
+
+    def _preparar(self) -> dict:
+        dados = super()._preparar()
+        with np.load(self._caminho(ARQUIVO_IVF)) as ivf:
+            dados["centroides"], dados["inicio"] = ivf["centroides"], ivf["inicio"]
+        return dados
+
+    def _varrer_listas(self, dados, q, sondas: int):
+        """Posições e distâncias das linhas nas `sondas` listas mais próximas de q."""
+        inicio = dados["inicio"]
+        listas = np.argsort(-(dados["centroides"] @ q))[:sondas]
+        posicoes, distancias = [], []
+        for c in listas:
+            a, z = int(inicio[c]), int(inicio[c + 1])
+            if z > a:
+                posicoes.append(np.arange(a, z))
+                distancias.append(self._distancias(dados, q, a, z))
+        if not posicoes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(posicoes), np.concatenate(distancias)
+
+    def buscar(self, vetor, k: int = 4):
+        if not self._carregar():
+            return []
+        dados = self._dados
+        posicoes, distancias = self._varrer_listas(dados, np.asarray(vetor, dtype=np.float32), self.sondas)
+        return [(str(dados["ids"][posicoes[i]]), float(distancias[i])) for i in _k_menores(distancias, k)]
+
+
+class IndiceInt8(IndiceIVF):
+    """
+    Busca nos códigos int8 (1/4 da memória do float32). Os `k * rerank` melhores
+    candidatos são re-ranqueados com a distância exata lendo só essas linhas de
+    `vetores.npy` (mapeado, nunca carregado inteiro). Com `sondas` > 0 usa as listas IVF.
+    Com este backend o HNSW do Chroma não é carregado: recuperação e sondas do
+    roteamento buscam aqui, e o Chroma só devolve texto e metadados por ID.
+    """
+
+    nome = "int8"
+
+    def __init__(self, pasta_data_tema: str, rerank: int = QUANTIZACAO_RERANK, sondas: int = QUANTIZACAO_SONDAS):
+        super().__init__(pasta_data_tema, sondas=sondas)
+        self.rerank = rerank
+
+    def _carregar(self) -> bool:
+        if not os.path.exists(self._caminho(ARQUIVO_INT8)):
+            return False
+        return super()._carregar()
+
+    def _preparar(self) -> dict:
+        codigos = np.load(self._caminho(ARQUIVO_INT8), mmap_mode="r")
+        escala = np.load(self._caminho(ARQUIVO_ESCALA))
+        # normas dos vetores reconstruídos, em blocos (sem materializar a matriz float)
+        normas = np.concatenate([
+            np.einsum("ij,ij->i", b, b)
+            for b in (codigos[i:i + BLOCO_INT8].astype(np.float32) * escala for i in range(0, len(codigos), BLOCO_INT8))
+        ]) if len(codigos) else np.zeros(0, dtype=np.float32)
+        with np.load(self._caminho(ARQUIVO_IVF)) as ivf:
+            centroides, inicio = ivf["centroides"], ivf["inicio"]
+        return {
+            "codigos": codigos,
+            "escala": escala,
+            "normas": normas.astype(np.float32),
+            "matriz": np.load(self._caminho(ARQUIVO_VETORES), mmap_mode="r"),
+            "ids": np.load(self._caminho(ARQUIVO_IDS)),
+            "centroides": centroides,
+            "inicio": inicio,
+        }
+
+    @staticmethod
+    def _distancias(dados, vetor, inicio=0, fim=None):
+        """Distância aproximada: x·q ≈ codigo · (escala * q)."""
+        fim = len(dados["codigos"]) if fim is None else fim
+        q_escalado = dados["escala"] * vetor
+        produtos = np.concatenate([
+            dados["codigos"][i:min(i + BLOCO_INT8, fim)].astype(np.float32) @ q_escalado
+            for i in range(inicio, fim, BLOCO_INT8)
+        ]) if fim > inicio else np.zeros(0, dtype=np.float32)
+        return dados["normas"][inicio:fim] - 2.0 * produtos + float(vetor @ vetor)
+
+    def buscar(self, vetor, k: int = 4):
+        if not self._carregar():
+            return []
+        dados = self._dados
+        q = np.asarray(vetor, dtype=np.float32)
+        if self.sondas > 0:
+            posicoes, distancias = self._varrer_listas(dados, q, self.sondas)
+        else:
+            posicoes = np.arange(len(dados["codigos"]))
+            distancias = self._distancias(dados, q)
+
+        if self.rerank > 0:
+            candidatos = _k_menores(distancias, k * self.rerank)
+            linhas = np.sort(posicoes[candidatos])  # leitura em ordem no arquivo mapeado
+            bloco = np.asarray(dados["matriz"][linhas], dtype=np.float32)
+            exatas = np.einsum("ij,ij->i", bloco, bloco) - 2.0 * (bloco @ q) + float(q @ q)
+            return [(str(dados["ids"][linhas[i]]), float(exatas[i])) for i in _k_menores(exatas, k)]
+        return [(str(dados["ids"][posicoes[i]]), float(distancias[i])) for i in _k_menores(distancias, k)]
+
+
+class IndiceHNSW(IndiceVetorial):
+    """
+    Grafo HNSW (hnswlib, dependência opcional). O grafo é construído na primeira
+    consulta a partir de `vetores.npy` e salvo em `hnsw.bin` para as próximas.
+    """
+
+    nome = "hnsw"
+
+    def __init__(self, pasta_data_tema: str, m: int = HNSW_M, ef_construcao: int = HNSW_EF_CONSTRUCAO, ef: int = HNSW_EF):
+        super().__init__(pasta_data_tema)
+        self.m = m
+        self.ef_construcao = ef_construcao
+        self.ef = ef
+
+    def _preparar(self) -> dict:
+        import hnswlib
+
+        matriz = np.load(self._caminho(ARQUIVO_VETORES), mmap_mode="r")
+        ids = np.load(self._caminho(ARQUIVO_IDS))
+        caminho = self._caminho(ARQUIVO_HNSW)
+        grafo = hnswlib.Index(space="l2", dim=matriz.shape[1])
+        if os.path.exists(caminho) and os.stat(caminho).st_mtime_ns >= os.stat(self._caminho(ARQUIVO_VETORES)).st_mtime_ns:
+            grafo.load_index(caminho, max_elements=len(matriz))
+        else:
+            grafo.init_index(max_elements=len(matriz), M=self.m, ef_construction=self.ef_construcao)
+            grafo.add_items(np.asarray(matriz), np.arange(len(matriz)))
+            grafo.save_index(caminho)
+        grafo.set_ef(self.ef)
+        return {"ids": ids, "grafo": grafo}
+
+    def buscar(self, vetor, k: int = 4):
+        if not self._carregar():
+            return []
+        dados = self._dados
+        grafo = dados["grafo"]
+        k = min(k, grafo.get_current_count())
+        if k <= 0:
+            return []
+        rotulos, distancias = grafo.knn_query(np.asarray(vetor, dtype=np.float32), k=k)
+        return [(str(dados["ids"][r]), float(d)) for r, d in zip(rotulos[0], distancias[0])]
+
+
+_BACKENDS = {"exato": IndiceVetorial, "ivf": IndiceIVF, "hnsw": IndiceHNSW, "int8": IndiceInt8}
+_INDICES = {}
+_INDICES_LOCK = threading.Lock()
+_INDISPONIVEIS = set()
+
+
+def criar_indice_vetorial(pasta_data_tema: str, modo: str, **parametros):
+    """Instância nova de um backend (usada pelo benchmark para variar parâmetros)."""
+    return _BACKENDS[modo](pasta_data_tema, **parametros)
+
+
+def obter_indice_vetorial(pasta_data_tema: str, modo: str = None):
+    """
+    Backend configurado (INDICE_VETORIAL) para o tema, compartilhado pelo processo.
+    None quando o modo é "chroma" ou o tema ainda não tem `vetores.npy` exportado.
+    """
+    modo = modo or INDICE_VETORIAL
+    if modo not in _BACKENDS or modo in _INDISPONIVEIS:
+        return None
+    chave = (pasta_data_tema, modo)
+    indice = _INDICES.get(chave)
+    if indice is None:
+        with _INDICES_LOCK:
+            indice = _INDICES.setdefault(chave, criar_indice_vetorial(pasta_data_tema, modo))
+    try:
+        return indice if indice.disponivel else None
+    except ImportError as e:
+        print(f"⚠️ Backend vetorial '{modo}' indisponível ({e}); usando a busca do Chroma.")
+        _INDISPONIVEIS.add(modo)
+        return None
+
+
+# ================== CLI ==================
+def main():
+    """Exporta `vetores.npy`/IVF dos temas a partir das bases já existentes."""
+    registro = obter_registro()
+    for tema in sys.argv[1:] or TEMAS_DISPONIVEIS:
+        db = registro.obter_store(tema)
+        if db is None:
+            print(f"⚠️ Tema '{tema}' sem base em {registro.pasta_tema(tema)}. Pulando.")
+            continue
+        exportar_vetores(db, registro.pasta_tema(tema))
+    print("\n🏁 Finalizado.")
+
+
+if __name__ == "__main__":
+    main()
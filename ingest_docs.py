@@ -1,14 +1,35 @@
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from dotenv import load_dotenv
 from tqdm import tqdm
 
+# antes dos módulos do projeto, que leem a configuração ao serem importados
+load_dotenv()
+
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from cache_embeddings import com_cache
+from indices_vetoriais import ARQUIVO_VETORES, exportar_vetores
+from lexico import ARQUIVO_BM25, salvar_indice_lexico
+from motor_embeddings import EtapaEmbedding, MotorEmbeddings
+from registro import MODELO_EMBEDDINGS, marcar_ingestao
+from roteamento import ARQUIVO_PROTOTIPOS, salvar_prototipos
 
 CAMINHO_DOCS = "docs"
 CAMINHO_DATA = "data"
-BATCH_SIZE = 1000
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+ARQUIVO_MANIFESTO = "manifesto.json"
+# processos que leem e dividem PDFs em paralelo (<= 1: tudo no processo principal)
+INGESTAO_PROCESSOS = int(os.getenv("INGESTAO_PROCESSOS", str(os.cpu_count() or 1)))
+# PDFs já processados aguardando vetorização (limita o pico de memória)
+INGESTAO_FILA = int(os.getenv("INGESTAO_FILA", str(2 * max(1, INGESTAO_PROCESSOS))))
 
 def texto_valido(doc) -> bool:
     try:
@@ -22,89 +43,289 @@ def texto_valido(doc) -> bool:
     except Exception:
         return False
 
-def carregar_pdfs_da_pasta(pasta_docs: str):
-    documentos = []
-    total_arquivos = 0
-    erros = []
-
+def listar_pdfs(pasta_docs: str):
+    """Caminhos dos PDFs da pasta (recursivo), em ordem estável."""
+    caminhos = []
     for root, _, files in os.walk(pasta_docs):
         for arquivo in files:
-            if not arquivo.lower().endswith(".pdf"):
-                continue
-            total_arquivos += 1
-            caminho_arquivo = os.path.join(root, arquivo)
-            print(f"📄 Lendo: {caminho_arquivo}")
-            try:
-                loader = PyPDFLoader(caminho_arquivo, extract_images=False, extraction_mode="plain")
-                docs = loader.load()
-
-                # (Opcional, mas recomendado) guardar fonte
-                for d in docs:
-                    d.metadata["source"] = os.path.basename(caminho_arquivo)
-
-                documentos.extend(docs)
-                print(f"✅ OK: {caminho_arquivo}")
-            except Exception as e:
-                print(f"❌ Erro ao ler {caminho_arquivo}: {e}")
-                erros.append((caminho_arquivo, str(e)))
-
-    print(f"🔎 PDFs encontrados: {total_arquivos} | Erros: {len(erros)}")
-    return documentos
+            if arquivo.lower().endswith(".pdf"):
+                caminhos.append(os.path.join(root, arquivo))
+    return sorted(caminhos)
+
+def carregar_pdf(caminho_arquivo: str):
+    loader = PyPDFLoader(caminho_arquivo, extract_images=False, extraction_mode="plain")
+    docs = loader.load()
+
+    # (Opcional, mas recomendado) guardar fonte
+    for d in docs:
+        d.metadata["source"] = os.path.basename(caminho_arquivo)
+    return docs
+
+# ================== MANIFESTO (ingestão incremental) ==================
+def hash_arquivo(caminho: str) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def id_chunk(caminho_relativo: str, hash_pdf: str, indice: int) -> str:
+    """ID determinístico: re-ingerir o mesmo arquivo gera os mesmos IDs (upsert idempotente)."""
+    chave = f"{caminho_relativo}|{hash_pdf}|{indice}"
+    return hashlib.sha1(chave.encode("utf-8")).hexdigest()
+
+def carregar_manifesto(pasta_data_tema: str):
+    caminho = os.path.join(pasta_data_tema, ARQUIVO_MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Manifesto inválido ({e}); a base do tema será reconstruída.")
+        return None
+
+def salvar_manifesto(pasta_data_tema: str, manifesto: dict):
+    caminho = os.path.join(pasta_data_tema, ARQUIVO_MANIFESTO)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+def dividir_pdf(docs, caminho_relativo: str, hash_pdf: str, splitter):
+    """Chunks válidos de um PDF com IDs determinísticos."""
+    chunks = [d for d in splitter.split_documents(docs) if texto_valido(d)]
+    ids = [id_chunk(caminho_relativo, hash_pdf, i) for i in range(len(chunks))]
+    return chunks, ids
+
+def _processar_pdf(tarefa):
+    """
+    Etapa CPU (roda nos processos de trabalho): hash, leitura e divisão de um PDF.
+    Se o hash bate com o do manifesto, nem abre o PDF.
+    """
+    rel, caminho, hash_anterior = tarefa
+    resultado = {"rel": rel, "caminho": caminho, "erro": None, "inalterado": False,
+                 "chunks": [], "ids": [], "paginas": 0}
+    try:
+        info = os.stat(caminho)
+        resultado.update(mtime=info.st_mtime, tamanho=info.st_size)
+        resultado["hash"] = hash_arquivo(caminho)
+        if resultado["hash"] == hash_anterior:
+            resultado["inalterado"] = True
+            return resultado
+
+        docs = carregar_pdf(caminho)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        resultado["paginas"] = len(docs)
+        resultado["chunks"], resultado["ids"] = dividir_pdf(docs, rel, resultado["hash"], splitter)
+    except Exception as e:
+        resultado["erro"] = str(e)
+    return resultado
+
+def processar_pdfs(tarefas, processos: int = INGESTAO_PROCESSOS, max_pendentes: int = INGESTAO_FILA):
+    """
+    Gera os resultados de `_processar_pdf` conforme ficam prontos.
+    No máximo `max_pendentes` PDFs ficam em processamento/espera ao mesmo tempo,
+    então a memória não cresce com o tamanho do acervo.
+    """
+    if processos <= 1 or len(tarefas) <= 1:
+        for tarefa in tarefas:
+            yield _processar_pdf(tarefa)
+        return
+
+    fila = iter(tarefas)
+    with ProcessPoolExecutor(max_workers=processos) as pool:
+        pendentes = {pool.submit(_processar_pdf, t) for t in islice(fila, max(1, max_pendentes))}
+        while pendentes:
+            prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                for tarefa in islice(fila, 1):
+                    pendentes.add(pool.submit(_processar_pdf, tarefa))
+                yield futuro.result()
+
+def _concluir_gravacao(etapa, manifesto: dict, pasta_data_tema: str, pendente) -> bool:
+    """Espera a gravação de um PDF terminar e só então o registra no manifesto."""
+    rel, caminho, entrada, futuros = pendente
+    try:
+        for futuro in futuros:
+            futuro.result()
+    except Exception as e:
+        # falhou no meio: tira do manifesto para ser refeito na próxima execução
+        print(f"❌ Erro ao gravar {caminho}: {e}")
+        for futuro in etapa.apagar(entrada["chunk_ids"]):
+            futuro.result()
+        manifesto.pop(rel, None)
+        salvar_manifesto(pasta_data_tema, manifesto)
+        return False
+
+    manifesto[rel] = entrada
+    salvar_manifesto(pasta_data_tema, manifesto)
+    print(f"✅ OK: {caminho} ({len(entrada['chunk_ids'])} chunks)")
+    return True
 
 def vetorizar_tema(nome_tema: str, pasta_docs_tema: str, pasta_data_tema: str, embeddings):
+    """
+    Ingestão incremental: só PDFs novos ou alterados são lidos e vetorizados;
+    vetores de PDFs removidos ou alterados são apagados da base.
+    Retorna {pdfs, paginas, chunks, segundos, paginas_por_s, chunks_por_s, erros}.
+    """
     print(f"\n==============================")
     print(f"🚀 Tema: {nome_tema}")
     print(f"📁 Docs: {pasta_docs_tema}")
     print(f"🧠 Data: {pasta_data_tema}")
     print(f"==============================")
 
-    docs = carregar_pdfs_da_pasta(pasta_docs_tema)
-    print(f"📚 Documentos carregados: {len(docs)}")
+    os.makedirs(pasta_data_tema, exist_ok=True)
+    chroma_db = Chroma(persist_directory=pasta_data_tema, embedding_function=embeddings)
 
-    if not docs:
-        print("⚠️ Nada para vetorizar neste tema. Pulando.")
-        return
+    manifesto = carregar_manifesto(pasta_data_tema)
+    if manifesto is None:
+        if chroma_db._collection.count():
+            # base antiga (IDs aleatórios, possivelmente duplicados): recomeça do zero
+            print("♻️ Base sem manifesto: recriando coleção para ingestão incremental.")
+            chroma_db.delete_collection()
+            chroma_db = Chroma(persist_directory=pasta_data_tema, embedding_function=embeddings)
+        manifesto = {}
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    docs_split = splitter.split_documents(docs)
-    docs_filtrados = [d for d in docs_split if texto_valido(d)]
+    # embeddings em lote; gravação no Chroma sobreposta ao próximo lote
+    etapa = EtapaEmbedding(embeddings, chroma_db)
 
-    print(f"✂️ Chunks criados: {len(docs_split)} | ✅ Válidos: {len(docs_filtrados)}")
-    if not docs_filtrados:
-        print("⚠️ Nenhum chunk válido. Pulando.")
-        return
+    arquivos = {os.path.relpath(c, pasta_docs_tema).replace(os.sep, "/"): c for c in listar_pdfs(pasta_docs_tema)}
+    alterou = False
+    novos = alterados = removidos = inalterados = erros = 0
+    paginas = total_chunks = 0
+    inicio = time.perf_counter()
 
-    os.makedirs(pasta_data_tema, exist_ok=True)
+    # PDFs que sumiram da pasta
+    for rel in sorted(set(manifesto) - set(arquivos)):
+        etapa.apagar(manifesto[rel].get("chunk_ids", []))
+        del manifesto[rel]
+        removidos += 1
+        alterou = True
+        print(f"🗑️ Removido: {rel}")
+    salvar_manifesto(pasta_data_tema, manifesto)
+
+    # mtime/tamanho iguais ao manifesto: nem passa pelos processos de trabalho
+    tarefas = []
+    for rel, caminho in arquivos.items():
+        info = os.stat(caminho)
+        anterior = manifesto.get(rel)
+        if anterior and anterior["mtime"] == info.st_mtime and anterior["tamanho"] == info.st_size:
+            inalterados += 1
+            continue
+        tarefas.append((rel, caminho, anterior["hash"] if anterior else None))
+
+    # leitura/divisão em paralelo; vetorização e gravação no processo principal
+    pendente = None  # PDF cuja gravação ainda está em andamento
+    for resultado in tqdm(processar_pdfs(tarefas), total=len(tarefas), desc=f"🧠 Vetorizando {nome_tema}"):
+        rel, caminho = resultado["rel"], resultado["caminho"]
+        anterior = manifesto.get(rel)
 
-    chroma_db = None
-    for i in tqdm(range(0, len(docs_filtrados), BATCH_SIZE), desc=f"🧠 Vetorizando {nome_tema}"):
-        batch_docs = docs_filtrados[i:i + BATCH_SIZE]
-        batch_docs = [d for d in batch_docs if texto_valido(d)]
-        if not batch_docs:
+        if resultado["erro"]:
+            print(f"❌ Erro ao ler {caminho}: {resultado['erro']}")
+            erros += 1
             continue
 
+        if resultado["inalterado"]:
+            # só o mtime mudou (cópia, touch): nada a re-vetorizar
+            anterior["mtime"] = resultado["mtime"]
+            anterior["tamanho"] = resultado["tamanho"]
+            inalterados += 1
+            salvar_manifesto(pasta_data_tema, manifesto)
+            continue
+
+        chunks, ids = resultado["chunks"], resultado["ids"]
+        paginas += resultado["paginas"]
+        if anterior:
+            etapa.apagar(anterior.get("chunk_ids", []))
+            alterados += 1
+        else:
+            novos += 1
+        alterou = True
+
+        entrada = {
+            "hash": resultado["hash"],
+            "mtime": resultado["mtime"],
+            "tamanho": resultado["tamanho"],
+            "chunk_ids": ids,
+        }
         try:
-            if chroma_db is None:
-                chroma_db = Chroma.from_documents(
-                    documents=batch_docs,
-                    embedding=embeddings,
-                    persist_directory=pasta_data_tema
-                )
-            else:
-                chroma_db.add_documents(batch_docs)
+            # vetoriza este PDF enquanto o anterior ainda está sendo gravado
+            futuros = etapa.gravar_documentos(chunks, ids)
         except Exception as e:
-            print(f"❌ Erro batch {i}-{i + BATCH_SIZE}: {e}")
+            print(f"❌ Erro ao vetorizar {caminho}: {e}")
+            manifesto.pop(rel, None)
+            erros += 1
+            continue
 
-    if chroma_db:
-        chroma_db.persist()
+        if pendente:
+            if _concluir_gravacao(etapa, manifesto, pasta_data_tema, pendente):
+                total_chunks += len(pendente[2]["chunk_ids"])
+            else:
+                erros += 1
+        pendente = (rel, caminho, entrada, futuros)
+
+    if pendente:
+        if _concluir_gravacao(etapa, manifesto, pasta_data_tema, pendente):
+            total_chunks += len(pendente[2]["chunk_ids"])
+        else:
+            erros += 1
+    etapa.aguardar()
+    etapa.fechar()
+
+    duracao = time.perf_counter() - inicio
+    estatisticas = {
+        "pdfs": novos + alterados,
+        "paginas": paginas,
+        "chunks": total_chunks,
+        "segundos": round(duracao, 3),
+        "paginas_por_s": round(paginas / duracao, 2) if duracao else 0.0,
+        "chunks_por_s": round(total_chunks / duracao, 2) if duracao else 0.0,
+        "erros": erros,
+    }
+    if paginas:
+        print(
+            f"📈 {paginas} páginas e {total_chunks} chunks em {duracao:.1f}s "
+            f"({paginas / duracao:.1f} páginas/s, {total_chunks / duracao:.1f} chunks/s)"
+        )
+        print(etapa.relatorio())
+    print(
+        f"🔎 PDFs: {len(arquivos)} | Novos: {novos} | Alterados: {alterados} | "
+        f"Removidos: {removidos} | Inalterados: {inalterados} | Erros: {erros}"
+    )
+
+    if not alterou:
+        if chroma_db._collection.count():
+            # bases de antes dos índices BM25/vetorial: gera só o que falta
+            if not os.path.exists(os.path.join(pasta_data_tema, ARQUIVO_BM25)):
+                salvar_indice_lexico(chroma_db, pasta_data_tema)
+            if not os.path.exists(os.path.join(pasta_data_tema, ARQUIVO_VETORES)):
+                exportar_vetores(chroma_db, pasta_data_tema)
+        print(f"✅ Tema '{nome_tema}' já está atualizado.")
+        return estatisticas
+
+    # índice BM25 da busca híbrida e matriz/IVF dos backends vetoriais
+    # (ambos removidos se a base ficou vazia)
+    salvar_indice_lexico(chroma_db, pasta_data_tema)
+    exportar_vetores(chroma_db, pasta_data_tema)
+    if chroma_db._collection.count():
         print(f"✅ Base vetorial do tema '{nome_tema}' persistida com sucesso!")
+        # índice de roteamento (centroides do tema) usado por identificar_tema
+        salvar_prototipos(chroma_db, pasta_data_tema)
     else:
         print(f"⚠️ Nada foi persistido para o tema '{nome_tema}'.")
+        arquivo_prototipos = os.path.join(pasta_data_tema, ARQUIVO_PROTOTIPOS)
+        if os.path.exists(arquivo_prototipos):
+            os.remove(arquivo_prototipos)
+    marcar_ingestao(pasta_data_tema)
+    return estatisticas
 
 def main():
     print("🚀 Iniciando ingestão por tema...")
 
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    # lote, threads e processos de encode configuráveis (ver motor_embeddings.py);
+    # chunks já vetorizados antes (mesmo texto) saem do cache de embeddings
+    embeddings = com_cache(MotorEmbeddings(), MODELO_EMBEDDINGS)
 
     # Cada subpasta dentro de /docs vira um tema
     subpastas = [
@@ -121,11 +342,8 @@ def main():
         pasta_data_tema = os.path.join(CAMINHO_DATA, tema)
         vetorizar_tema(tema, pasta_docs_tema, pasta_data_tema, embeddings)
 
+    embeddings.fechar()
     print("\n🏁 Finalizado.")
 
 if __name__ == "__main__":
     main()
-
-
-
-
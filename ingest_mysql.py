@@ -1,28 +1,45 @@
 # ingest_mysql.py
+import argparse
+import json
 import os
+import time
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, text
 from dotenv import load_dotenv
-from langchain.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 
-# Carregar variáveis do .env
+# Carregar variáveis do .env (antes dos módulos do projeto, que leem a configuração ao serem importados)
 load_dotenv()
 
+from langchain.vectorstores import Chroma
+
+from analitico import ARQUIVO_AGREGADOS, atualizar_agregados, exportar_copia
+from cache_embeddings import com_cache
+from indices_vetoriais import exportar_vetores
+from lexico import salvar_indice_lexico
+from motor_embeddings import EtapaEmbedding, MotorEmbeddings
+from registro import MODELO_EMBEDDINGS, marcar_ingestao
+from roteamento import salvar_prototipos
+
 host = os.getenv("MYSQL_HOST")
 port = os.getenv("MYSQL_PORT")
 user = os.getenv("MYSQL_USER")
 password = os.getenv("MYSQL_PASSWORD")
 database = os.getenv("MYSQL_DATABASE")
 table = os.getenv("MYSQL_TABLE")
+# chave primária da tabela: vira o ID do vetor no Chroma
+chave = os.getenv("MYSQL_PK", "id")
+# linhas lidas, formatadas e vetorizadas por vez
+LOTE_LINHAS = int(os.getenv("MYSQL_LOTE", "2000"))
+# coluna de marca d'água da sincronização incremental (ex.: updated_at); vazio = chave primária
+coluna_marca = os.getenv("MYSQL_WATERMARK", "") or chave
+# no modo incremental, procura linhas apagadas a cada N ciclos (0 = nunca; a sincronização completa sempre procura)
+REMOCOES_A_CADA = int(os.getenv("MYSQL_REMOCOES_A_CADA", "0"))
+# IDs conferidos por consulta na detecção de linhas apagadas
+LOTE_REMOCAO = int(os.getenv("MYSQL_LOTE_REMOCAO", "5000"))
+# intervalo mínimo (s) entre reconstruções dos derivados (agregados, protótipos, BM25, vetores exportados)
+DERIVADOS_A_CADA = float(os.getenv("MYSQL_DERIVADOS_A_CADA", "3600"))
+ARQUIVO_SYNC = "sync_mysql.json"
 
-# Construir URI de conexão
-uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
-engine = create_engine(uri)
-
-# Ler dados do MySQL
-query = f"SELECT * FROM {table}"
-df = pd.read_sql(query, engine)
 
 # Transformar cada linha em texto descritivo
 def formatar_linha(linha):
@@ -35,16 +52,301 @@ def formatar_linha(linha):
         f"Tem renda familiar: {linha['renda_familiar']}. Evadiu: {linha['evadiu']}."
     )
 
-documentos_texto = [formatar_linha(row) for _, row in df.iterrows()]
 
-# Vetorização
-print("🔍 Carregando embeddings...")
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+def formatar_lote(df: pd.DataFrame) -> list:
+    """Mesmo texto de `formatar_linha`, montado por coluna (sem iterrows)."""
+    c = {col: df[col].astype(str) for col in df.columns}
+    textos = (
+        "O aluno " + c["nome"] + ", de gênero " + c["genero"] + ", "
+        + "estuda o curso de " + c["curso"] + " na modalidade " + c["modalidade"] + ". "
+        + "Sua média final é " + c["media_final"] + " com " + c["reprovacoes"] + " reprovações. "
+        + "Frequência: " + c["faltas_pct"] + "% de faltas. "
+        + "Recebe bolsa: " + c["bolsa"] + ". Trabalha: " + c["trabalha"] + ". "
+        + "Tem renda familiar: " + c["renda_familiar"] + ". Evadiu: " + c["evadiu"] + "."
+    )
+    return textos.tolist()
+
+
+def id_linha(tabela: str, pk) -> str:
+    """ID estável do vetor de uma linha: re-ingerir a mesma linha sobrescreve o vetor."""
+    return f"{tabela}:{pk}"
+
+
+def ler_em_lotes(engine, tabela: str, tamanho: int = LOTE_LINHAS, filtro: str = "", params=None):
+    """Lê a tabela em DataFrames de até `tamanho` linhas com cursor no servidor."""
+    with engine.connect().execution_options(stream_results=True) as conexao:
+        for lote in pd.read_sql(text(f"SELECT * FROM {tabela} {filtro}"), conexao, params=params, chunksize=tamanho):
+            yield lote
+
+
+# ================== SINCRONIZAÇÃO INCREMENTAL ==================
+def carregar_estado(persist_path: str) -> dict:
+    caminho = os.path.join(persist_path, ARQUIVO_SYNC)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salvar_estado(persist_path: str, estado: dict):
+    caminho = os.path.join(persist_path, ARQUIVO_SYNC)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def _valor_marca(valor):
+    """Valor da marca d'água em formato JSON e comparável no SQL (datas viram texto ISO)."""
+    if isinstance(valor, pd.Timestamp):
+        return str(valor.to_pydatetime())
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+def _acompanhar_marca(lotes, coluna: str, estado: dict):
+    """Repassa os lotes guardando em `estado["marca"]` o maior valor visto de `coluna`."""
+    for lote in lotes:
+        if len(lote):
+            maior = _valor_marca(lote[coluna].max())
+            if estado.get("marca") is None or maior > estado["marca"]:
+                estado["marca"] = maior
+        yield lote
+
+
+def remover_ausentes(engine, etapa: EtapaEmbedding, tabela: str, pk: str, lote: int = LOTE_REMOCAO) -> int:
+    """
+    Apaga da base os vetores de linhas que não existem mais na tabela.
+    Percorre os IDs da base em lotes e confere cada lote com um `WHERE pk IN (...)`:
+    nem a tabela nem a base inteira são carregadas na memória.
+    """
+    prefixo = f"{tabela}:"
+    consulta = text(f"SELECT {pk} FROM {tabela} WHERE {pk} IN :pks").bindparams(bindparam("pks", expanding=True))
+    colecao = etapa.chroma_db._collection
+    ausentes = []
+    with engine.connect() as conexao:
+        for offset in range(0, colecao.count(), lote):
+            ids = [i for i in colecao.get(limit=lote, offset=offset, include=[])["ids"] if i.startswith(prefixo)]
+            if not ids:
+                continue
+            pks = [i[len(prefixo):] for i in ids]
+            existentes = {str(v) for (v,) in conexao.execute(consulta, {"pks": pks})}
+            ausentes += [i for i, v in zip(ids, pks) if v not in existentes]
+    # apaga só depois de percorrer: apagar durante a leitura deslocaria os offsets
+    for futuro in etapa.apagar(ausentes):
+        futuro.result()
+    return len(ausentes)
+
+
+def colunas_da_tabela(engine, tabela: str) -> list:
+    with engine.connect() as conexao:
+        return list(pd.read_sql(text(f"SELECT * FROM {tabela} WHERE 1 = 0"), conexao).columns)
+
+
+def sincronizar(engine, etapa: EtapaEmbedding, persist_path: str, tabela: str, pk: str,
+                coluna: str, incremental: bool = True, detectar_remocoes: bool = None,
+                somente_insercoes: bool = False) -> dict:
+    """
+    Sincroniza a base com a tabela. No modo incremental só lê linhas com `coluna`
+    acima da última marca d'água gravada em `sync_mysql.json`. Linhas apagadas são
+    procuradas sempre na sincronização completa e, na incremental, só com `detectar_remocoes`.
+    A marca só avança depois que as gravações terminam. Mudanças deixam os derivados
+    pendentes (`derivados_pendentes`) até `marcar_derivados`.
+    """
+    colunas = colunas_da_tabela(engine, tabela)
+    if pk not in colunas:
+        # IDs por posição colidiriam entre sincronizações
+        raise ValueError(f"Coluna de chave primária '{pk}' não existe em {tabela} (defina MYSQL_PK).")
+    if coluna not in colunas:
+        raise ValueError(f"Coluna de marca d'água '{coluna}' não existe em {tabela} (defina MYSQL_WATERMARK).")
+    if incremental and coluna == pk and not somente_insercoes:
+        raise ValueError(
+            "Sincronização incremental pela chave primária só enxerga linhas novas, nunca alterações: "
+            "defina MYSQL_WATERMARK (ex.: updated_at) ou use --somente-insercoes."
+        )
+    if detectar_remocoes is None:
+        detectar_remocoes = not incremental
+
+    estado = carregar_estado(persist_path)
+    if estado.get("tabela") != tabela or estado.get("coluna") != coluna:
+        estado = {"tabela": tabela, "coluna": coluna, "marca": None}
+
+    filtro, params = f"ORDER BY {coluna}", None
+    if incremental and estado.get("marca") is not None:
+        # coluna de data: ">=" relê as linhas do mesmo instante da última marca
+        # (podem ter sido gravadas depois da leitura); a chave primária só cresce
+        operador = ">" if coluna == pk else ">="
+        filtro, params = f"WHERE {coluna} {operador} :marca ORDER BY {coluna}", {"marca": estado["marca"]}
+
+    lotes = _acompanhar_marca(ler_em_lotes(engine, tabela, filtro=filtro, params=params), coluna, estado)
+    upserts = ingerir_lotes(etapa, lotes, tabela, pk, somente_alteradas=incremental)
+    removidas = remover_ausentes(engine, etapa, tabela, pk) if detectar_remocoes else 0
+    etapa.aguardar()
+
+    estado["sincronizado_em"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    estado["derivados_pendentes"] = bool(estado.get("derivados_pendentes") or upserts or removidas)
+    salvar_estado(persist_path, estado)
+    return {
+        "upserts": upserts,
+        "removidas": removidas,
+        "marca": estado["marca"],
+        "derivados_pendentes": estado["derivados_pendentes"],
+        "derivados_em": estado.get("derivados_em"),
+    }
+
+
+def derivados_vencidos(resultado: dict, persist_path: str, intervalo: float = DERIVADOS_A_CADA) -> bool:
+    """Reconstruir os derivados agora? Só com mudanças pendentes e `intervalo` s depois da última vez."""
+    if not os.path.exists(os.path.join(persist_path, ARQUIVO_AGREGADOS)):
+        return True
+    if not resultado["derivados_pendentes"]:
+        return False
+    return time.time() - (resultado.get("derivados_em") or 0) >= intervalo
+
+
+def marcar_derivados(persist_path: str):
+    estado = carregar_estado(persist_path)
+    estado["derivados_pendentes"] = False
+    estado["derivados_em"] = time.time()
+    salvar_estado(persist_path, estado)
+
+
+def abrir_base(persist_path: str, embeddings, tabela: str):
+    """Abre a base; descarta bases antigas com IDs aleatórios (não dá para atualizar por linha)."""
+    db = Chroma(persist_directory=persist_path, embedding_function=embeddings)
+    amostra = db._collection.get(limit=1, include=[])["ids"]
+    if amostra and not amostra[0].startswith(f"{tabela}:"):
+        print("♻️ Base sem IDs por linha: recriando coleção.")
+        db.delete_collection()
+        db = Chroma(persist_directory=persist_path, embedding_function=embeddings)
+    return db
+
+
+def _sem_alteracao(etapa: EtapaEmbedding, ids, textos):
+    """Posições das linhas cujo texto já está igual na base."""
+    atuais = etapa.chroma_db._collection.get(ids=ids, include=["documents"])
+    gravados = dict(zip(atuais["ids"], atuais["documents"]))
+    return {i for i, (id_, texto) in enumerate(zip(ids, textos)) if gravados.get(id_) == texto}
+
+
+def ingerir_lotes(etapa: EtapaEmbedding, lotes, tabela: str, pk: str, somente_alteradas: bool = False) -> int:
+    """
+    Formata, vetoriza e grava lote a lote. A gravação de um lote acontece enquanto o
+    próximo é lido e vetorizado; nunca há mais de um lote pendente na memória.
+    Com `somente_alteradas`, linhas com o mesmo texto já gravado são puladas.
+    Retorna quantas linhas foram gravadas.
+    """
+    total = gravadas = 0
+    pendentes = []
+    for lote in lotes:
+        if pk not in lote.columns:
+            raise ValueError(f"Coluna de chave primária '{pk}' não existe em {tabela} (defina MYSQL_PK).")
+        pks = lote[pk].tolist()
+        ids = [id_linha(tabela, v) for v in pks]
+        textos = formatar_lote(lote)
+        metadatas = [{"tabela": tabela, "pk": str(v)} for v in pks]
+        total += len(lote)
+        if somente_alteradas:
+            iguais = _sem_alteracao(etapa, ids, textos)
+            manter = [i for i in range(len(ids)) if i not in iguais]
+            ids, textos, metadatas = [ids[i] for i in manter], [textos[i] for i in manter], [metadatas[i] for i in manter]
+            if not ids:
+                continue
+        futuros = etapa.gravar(ids, textos, metadatas)
+        for futuro in pendentes:
+            futuro.result()
+        pendentes = futuros
+        gravadas += len(ids)
+        print(f"📦 {gravadas} linhas vetorizadas ({total} lidas)")
+    for futuro in pendentes:
+        futuro.result()
+    return gravadas
+
+
+def atualizar_analitico(engine, tabela: str, persist_path: str):
+    """Cópia colunar (Parquet) da tabela e agregados usados pelo caminho estruturado do tema."""
+    inicio = time.perf_counter()
+    linhas = exportar_copia(ler_em_lotes(engine, tabela), persist_path)
+    atualizar_agregados(persist_path)
+    print(f"📊 Cópia analítica: {linhas} linhas em {time.perf_counter() - inicio:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vetoriza a tabela MySQL de alunos no Chroma.")
+    parser.add_argument("--incremental", action="store_true", help="só linhas novas/alteradas desde a última marca d'água")
+    parser.add_argument("--intervalo", type=float, default=0, help="repete a sincronização a cada N segundos")
+    parser.add_argument("--uri", default=None, help="URI SQLAlchemy (ex.: sqlite:///escola.db como substituto local)")
+    parser.add_argument("--tabela", default=table)
+    parser.add_argument("--destino", default=None, help="pasta da base vetorial (padrão: data/mysql_<database>)")
+    parser.add_argument("--somente-analitico", action="store_true",
+                        help="só atualiza a cópia colunar e os agregados (sem embeddings)")
+    parser.add_argument("--somente-insercoes", action="store_true",
+                        help="incremental pela chave primária (a tabela só recebe linhas novas)")
+    parser.add_argument("--remocoes-a-cada", type=int, default=REMOCOES_A_CADA,
+                        help="no modo incremental, procura linhas apagadas a cada N ciclos (0 = nunca)")
+    parser.add_argument("--derivados-a-cada", type=float, default=DERIVADOS_A_CADA,
+                        help="com --intervalo, reconstrói agregados/protótipos/BM25/vetores no máximo a cada N segundos")
+    args = parser.parse_args()
+
+    # Construir URI de conexão
+    uri = args.uri or f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+    engine = create_engine(uri)
+    persist_path = args.destino or f"data/mysql_{(database or 'local').lower()}"
+    os.makedirs(persist_path, exist_ok=True)
+
+    if args.somente_analitico:
+        atualizar_analitico(engine, args.tabela, persist_path)
+        marcar_ingestao(persist_path)
+        return
+
+    # Vetorização
+    print("🔍 Carregando embeddings...")
+    embeddings = com_cache(MotorEmbeddings(), MODELO_EMBEDDINGS)
+
+    print("💾 Armazenando vetores em:", persist_path)
+    db = abrir_base(persist_path, embeddings, args.tabela)
+    ciclo = 0
+    while True:
+        etapa = EtapaEmbedding(embeddings, db)
+        inicio = time.perf_counter()
+        # busca de linhas apagadas: sempre na completa; na incremental no 1º ciclo e a cada N
+        detectar_remocoes = not args.incremental or (args.remocoes_a_cada > 0 and ciclo % args.remocoes_a_cada == 0)
+        ciclo += 1
+        resultado = sincronizar(
+            engine, etapa, persist_path, args.tabela, chave, coluna_marca, args.incremental,
+            detectar_remocoes=detectar_remocoes, somente_insercoes=args.somente_insercoes,
+        )
+        duracao = time.perf_counter() - inicio
+        total = resultado["upserts"]
+        print(f"📈 {total} linhas em {duracao:.1f}s ({total / duracao if duracao else 0:.1f} linhas/s)")
+        print(f"🔎 Atualizadas: {total} | Removidas: {resultado['removidas']} | Marca: {resultado['marca']}")
+        print(etapa.relatorio())
+        etapa.fechar()
+
+        if total or resultado["removidas"]:
+            # nova versão da base: invalida o cache de respostas do tema
+            marcar_ingestao(persist_path)
+        # derivados releem a tabela/base inteira: numa execução avulsa sempre que houve mudança,
+        # no modo agendado no máximo a cada --derivados-a-cada segundos
+        intervalo_derivados = args.derivados_a_cada if args.intervalo > 0 else 0
+        if derivados_vencidos(resultado, persist_path, intervalo_derivados):
+            atualizar_analitico(engine, args.tabela, persist_path)
+            salvar_prototipos(db, persist_path)
+            salvar_indice_lexico(db, persist_path)
+            exportar_vetores(db, persist_path)
+            marcar_derivados(persist_path)
+            marcar_ingestao(persist_path)
+            print("✅ Vetorização finalizada com sucesso!")
+        elif resultado["derivados_pendentes"]:
+            print("🕒 Base atualizada; derivados serão reconstruídos no próximo ciclo após o intervalo.")
+        else:
+            print("✅ Base já está atualizada.")
+
+        if args.intervalo <= 0:
+            break
+        time.sleep(args.intervalo)
 
-persist_path = f"data/mysql_{database.lower()}"
-os.makedirs(persist_path, exist_ok=True)
+    embeddings.fechar()
 
-print("💾 Armazenando vetores em:", persist_path)
-Chroma.from_texts(documentos_texto, embedding=embeddings, persist_directory=persist_path)
 
-print("✅ Vetorização finalizada com sucesso!")
+if __name__ == "__main__":
+    main()
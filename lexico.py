@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# lexico.py
+# Índice invertido BM25 por tema (termos exatos: palavras-chave SQL, funções, autores).
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+ARQUIVO_BM25 = "bm25.npz"
+LOTE_LEITURA = 5000
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# palavras frequentes demais para ajudar a separar trechos
+_STOPWORDS = set(
+    """a o as os um uma uns umas de do da dos das em no na nos nas por para pra com sem sob
+    e ou que se nao mais menos como qual quais quando onde porque ser estar ter ha foi sao
+    esta este isso isto essa esse ao aos sua seu suas seus me te lhe ja tambem muito entre
+    the of and or to in on for with is are be by as at an it this that from""".split()
+)
+_TOKEN = re.compile(r"[a-z0-9_]+")
+
+
+def tokenizar(texto: str):
+    """Minúsculas, sem acento, [a-z0-9_]+ (mantém nomes como group_by e read_csv), sem stopwords."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in _TOKEN.findall(texto) if t not in _STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+# ================== CONSTRUÇÃO (ingestão) ==================
+def construir_indice(ids, textos) -> dict:
+    """Postings em formato CSR: termo i -> docs[inicio[i]:inicio[i+1]] com frequências tf."""
+    postings = {}
+    comprimentos = np.zeros(len(textos), dtype=np.int32)
+    for d, texto in enumerate(textos):
+        contagem = Counter(tokenizar(texto))
+        comprimentos[d] = sum(contagem.values())
+        for termo, tf in contagem.items():
+            postings.setdefault(termo, []).append((d, tf))
+
+    termos = sorted(postings)
+    inicio = np.zeros(len(termos) + 1, dtype=np.int64)
+    for i, termo in enumerate(termos):
+        inicio[i + 1] = inicio[i] + len(postings[termo])
+    docs = np.empty(inicio[-1], dtype=np.int32)
+    tf = np.empty(inicio[-1], dtype=np.uint16)
+    for i, termo in enumerate(termos):
+        lista = postings[termo]
+        docs[inicio[i]:inicio[i + 1]] = [d for d, _ in lista]
+        tf[inicio[i]:inicio[i + 1]] = [min(f, 65535) for _, f in lista]
+    return {
+        "termos": np.array(termos, dtype=str),
+        "inicio": inicio,
+        "docs": docs,
+        "tf": tf,
+        "comprimentos": comprimentos,
+        "ids": np.array(list(ids), dtype=str),
+    }
+
+
+def salvar_indice_lexico(store, pasta_data_tema: str):
+    """Lê todos os chunks da base e grava `bm25.npz` do tema (chamado ao final da ingestão)."""
+    total = store._collection.count()
+    ids, textos = [], []
+    for offset in range(0, total, LOTE_LEITURA):
+        lote = store._collection.get(limit=LOTE_LEITURA, offset=offset, include=["documents"])
+        ids += lote["ids"]
+        textos += [t or "" for t in lote["documents"]]
+    caminho = os.path.join(pasta_data_tema, ARQUIVO_BM25)
+    if not ids:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        return None
+    indice = construir_indice(ids, textos)
+    temporario = os.path.join(pasta_data_tema, "bm25.tmp.npz")
+    np.savez(temporario, **indice)
+    os.replace(temporario, caminho)
+    print(f"🔤 Índice BM25 salvo: {len(ids)} chunks, {len(indice['termos'])} termos em {pasta_data_tema}")
+    return indice
+
+
+# ================== CONSULTA ==================
+class IndiceLexico:
+    """BM25 sobre o `bm25.npz` de um tema, carregado uma vez e recarregado quando o arquivo muda."""
+
+    def __init__(self, pasta_data_tema: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.caminho = os.path.join(pasta_data_tema, ARQUIVO_BM25)
+        self.k1 = k1
+        self.b = b
+        self._mtime = None
+        self._dados = None
+        self._lock = threading.Lock()
+
+    def _carregar(self) -> bool:
+        try:
+            mtime = os.stat(self.caminho).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime = None
+            return False
+        if mtime == self._mtime:
+            return True
+        with self._lock:
+            if mtime == self._mtime:
+                return True
+            with np.load(self.caminho) as arquivo:
+                termos = arquivo["termos"]
+                inicio = arquivo["inicio"]
+                docs = arquivo["docs"]
+                tf = arquivo["tf"].astype(np.float32)
+                ids = arquivo["ids"]
+                comprimentos = arquivo["comprimentos"].astype(np.float32)
+            n = len(ids)
+            df = np.diff(inicio).astype(np.float32)
+            idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+            media = comprimentos.mean() if n else 1.0
+            # parte do denominador do BM25 que só depende do documento
+            norma = (self.k1 * (1 - self.b + self.b * comprimentos / (media or 1.0))).astype(np.float32)
+            posicao = {t: i for i, t in enumerate(termos.tolist())}
+            # troca atômica: consultas em andamento continuam com o índice anterior
+            self._dados = (posicao, inicio, docs, tf, ids, idf, norma)
+            self._mtime = mtime
+        return True
+
+    @property
+    def disponivel(self) -> bool:
+        return self._carregar()
+
+    def buscar(self, consulta: str, k: int = 20):
+        """[(chunk_id, score)] dos k trechos com maior BM25 (vazio sem índice ou sem termo conhecido)."""
+        if not self._carregar():
+            return []
+        posicao, inicio, docs, tf, ids, idf, norma = self._dados
+        termos = [posicao[t] for t in set(tokenizar(consulta)) if t in posicao]
+        if not termos:
+            return []
+        scores = np.zeros(len(ids), dtype=np.float32)
+        for i in termos:
+            a, z = inicio[i], inicio[i + 1]
+            d, f = docs[a:z], tf[a:z]
+            # cada doc aparece uma vez por termo: soma direta, sem np.add.at
+            scores[d] += idf[i] * f * (self.k1 + 1) / (f + norma[d])
+        candidatos = np.flatnonzero(scores)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-scores[candidatos], k)[:k]]
+        candidatos = candidatos[np.argsort(-scores[candidatos])]
+        return [(str(ids[d]), float(scores[d])) for d in candidatos]
+
+
+_INDICES = {}
+_INDICES_LOCK = threading.Lock()
+
+
+def obter_indice_lexico(pasta_data_tema: str) -> IndiceLexico:
+    """Índice BM25 do tema, compartilhado pelo processo."""
+    indice = _INDICES.get(pasta_data_tema)
+    if indice is None:
+        with _INDICES_LOCK:
+            indice = _INDICES.setdefault(pasta_data_tema, IndiceLexico(pasta_data_tema))
+    return indice
+
+
+def fundir_rrf(*listas, k: int = 60):
+    """Reciprocal rank fusion: soma de 1/(k + posição) de cada lista de ids. Retorna [(id, pontos)]."""
+    pontos = {}
+    for lista in listas:
+        for posicao, id_ in enumerate(lista):
+            pontos[id_] = pontos.get(id_, 0.0) + 1.0 / (k + posicao + 1)
+    return sorted(pontos.items(), key=lambda item: item[1], reverse=True)
+
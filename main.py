@@ -8,20 +8,23 @@ import bcrypt
 import streamlit as st
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain.schema import HumanMessage, AIMessage
-
-# ================== AUTH (login/senha) ==================
-# Carrega .env APENAS local (no Streamlit Cloud normalmente não existe)
+# Carrega .env APENAS local (no Streamlit Cloud normalmente não existe).
+# Antes dos módulos do projeto: eles leem a configuração (os.getenv) ao serem importados.
 _ENV_PATH = Path(__file__).with_name(".env")
 if _ENV_PATH.exists():
     load_dotenv(dotenv_path=_ENV_PATH)
 
+from langchain.schema import HumanMessage, AIMessage  # noqa: E402
+
+from cache_embeddings import obter_cache_embeddings  # noqa: E402
+from cache_respostas import obter_cache  # noqa: E402
+from conversa import criar_memoria  # noqa: E402
+from servico import obter_servico  # noqa: E402
+from rastreamento import iniciar_servidor_metricas, obter_metricas  # noqa: E402
+from registro import obter_registro  # noqa: E402
+from reranqueamento import obter_reranqueador  # noqa: E402
+
+# ================== AUTH (login/senha) ==================
 
 def _safe_secrets_dict() -> dict:
     """Retorna secrets como dict, sem quebrar quando não existe secrets.toml/local."""
@@ -141,50 +144,23 @@ def botao_logout():
             st.rerun()
 
 
-# ================== SELEÇÃO DE TEMA ==================
-def identificar_tema(pergunta):
-    TEMAS_DISPONIVEIS = [
-        "machine_learning",
-        "estatistica_basica",
-        "inteligencia_artificial",
-        "SQL",
-        "programacao_python",
-        "financas_credito",
-        "negocios_geral",
-        "mysql_escola",
-        "global",
-    ]
+# ================== RECURSOS (1x por processo) ==================
+# resposta renderizada token a token na bolha do bot
+STREAMING_RESPOSTA = os.getenv("RESPOSTA_STREAMING", "1") != "0"
+# painel com o rastro da última pergunta (também pode ser ligado pela barra lateral)
+PAINEL_DEPURACAO = os.getenv("DEBUG_PAINEL", "0") == "1"
 
-    pergunta = (pergunta or "").strip()
-    if not pergunta:
-        return "global"
 
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-    melhor_tema = "global"
-    melhor_score = float("inf")
-
-    for tema in TEMAS_DISPONIVEIS:
-        pasta = os.path.join("data", tema)
-        if not os.path.exists(pasta):
-            continue
-
-        try:
-            db = Chroma(persist_directory=pasta, embedding_function=embeddings)
-            resultados = db.similarity_search_with_score(pergunta, k=1)
+@st.cache_resource(show_spinner="🔄 Carregando modelo de embeddings e bases vetoriais...")
+def carregar_registro():
+    # cross-encoder carregado junto (None sem RERANK=1 ou indisponível)
+    obter_reranqueador()
+    # p50/p95/p99 por etapa em http://127.0.0.1:METRICAS_PORTA/metricas
+    iniciar_servidor_metricas()
+    return obter_registro().aquecer()
 
-            if not resultados:
-                continue
 
-            _, score = resultados[0]
-            if score < melhor_score:
-                melhor_score = score
-                melhor_tema = tema
-
-        except Exception:
-            continue
-
-    return melhor_tema
+carregar_registro()
 
 
 # ================== UI ==================
@@ -214,14 +190,60 @@ with st.sidebar:
     st.write(f"👤 Usuário: **{st.session_state.get('usuario', '')}**")
     botao_logout()
 
+    cache = obter_cache()
+    if cache:
+        stats = cache.estatisticas()
+        st.caption(
+            f"⚡ Cache de respostas: {stats['acertos']} acertos / {stats['faltas']} faltas "
+            f"({stats['taxa_acerto']:.0%}) · {stats['entradas']} entradas"
+        )
+    cache_embeddings = obter_cache_embeddings()
+    if cache_embeddings:
+        stats = cache_embeddings.estatisticas()
+        st.caption(
+            f"🧮 Cache de embeddings: {stats['taxa_acerto']:.0%} de acerto · {stats['entradas']} vetores"
+        )
+
+    servico = obter_servico().estatisticas()
+    st.caption(
+        f"🧵 Serviço: {servico['em_andamento']} perguntas em andamento · {servico['na_fila']} na fila "
+        f"(máx. {servico['max_concorrentes']} simultâneas)"
+    )
+
+    metricas = st.session_state.get("ultimas_metricas") or {}
+    if metricas.get("ttft_s") is not None:
+        st.caption(
+            f"⏱️ Última resposta: 1º token em {metricas['ttft_s']:.2f}s · "
+            f"total {metricas.get('total_s', 0):.2f}s"
+        )
+    if metricas.get("tokens_historico") is not None:
+        st.caption(f"🧾 Histórico no prompt: {metricas['tokens_historico']} tokens")
+    if metricas.get("tokens_prompt") is not None:
+        st.caption(
+            f"✂️ Prompt: {metricas['tokens_prompt_antes']} → {metricas['tokens_prompt']} tokens de entrada"
+        )
+    if metricas.get("rerank"):
+        rerank = metricas["rerank"]
+        st.caption(
+            f"🎯 Re-ranqueamento: {rerank['pontuados']}/{rerank['candidatos']} trechos em {rerank['ms']:.0f} ms"
+        )
+
+    rastro = metricas.get("rastro")
+    if rastro and st.checkbox("🔎 Depuração da última pergunta", value=PAINEL_DEPURACAO):
+        st.dataframe(
+            [
+                {"etapa": s["etapa"], "início (ms)": s["inicio_ms"], "duração (ms)": s["duracao_ms"]}
+                for s in rastro["etapas"]
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.json({k: v for k, v in rastro.items() if k != "etapas"}, expanded=False)
+
 # memória do chat
 if "memory" not in st.session_state:
-    st.session_state.memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        input_key="question",
-        output_key="answer",
-        return_messages=True,
-    )
+    # janela + resumo com teto de tokens (MEMORIA_MODO=buffer volta ao histórico inteiro)
+    st.session_state.memory = criar_memoria()
 
 def mostrar_historico():
     st.markdown('<div class="chat-container">', unsafe_allow_html=True)
@@ -238,152 +260,47 @@ def mostrar_historico():
             )
     st.markdown("</div>", unsafe_allow_html=True)
 
+inicio_renderizacao = time.perf_counter()
 mostrar_historico()
+obter_metricas().observar("ui.renderizacao", time.perf_counter() - inicio_renderizacao)
 
 with st.form("pergunta_form", clear_on_submit=True):
     nova_pergunta = st.text_input("Digite sua pergunta...", placeholder="O que você quer saber?")
     enviar = st.form_submit_button("Enviar")
 
 if enviar and nova_pergunta:
-    with st.spinner("🤖 Nathal.IA está pensando..."):
-        try:
-            # Identificar o tema
-            tema = identificar_tema(nova_pergunta)
-
-            # Caminho da base vetorial do tema
-            pasta_vetorial = os.path.join("data", tema)
-            if not os.path.exists(pasta_vetorial):
-                # fallback seguro
-                pasta_vetorial = os.path.join("data", "global")
-
-            embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            vetores = Chroma(persist_directory=pasta_vetorial, embedding_function=embeddings)
-
-            # Retriever (k=4)
-            retriever = vetores.as_retriever(search_kwargs={"k": 4})
-
-            # LLM (GPT-4.1-mini)
-            llm = ChatOpenAI(
-                model="gpt-4.1-mini",
-                temperature=0.15,
-                max_tokens=900,
-                api_key=os.getenv("OPENAI_API_KEY"),
-            )
+    # pergunta + bolha da resposta preenchida token a token (streaming)
+    st.markdown(
+        f'<div class="bubble user-msg">🧠 Você: {nova_pergunta}</div>',
+        unsafe_allow_html=True,
+    )
+    bolha_resposta = st.empty()
 
-            # Prompt
-            prompt = PromptTemplate(
-                input_variables=["chat_history", "context", "question"],
-                template="""
-Você é a Nathal.IA — uma assistente estratégica de dados criada por Nathália Lima.
-
-Seu papel é apoiar decisões reais de negócio usando dados, estatística e machine learning.
-Você responde como uma cientista de dados experiente, segura e prática, com visão de negócio.
-
-Princípios obrigatórios:
-- Responda sempre em português.
-- Priorize clareza, direcionamento e impacto no negócio.
-- Demonstre domínio técnico, explicando conceitos quando isso ajudar a tomar uma decisão melhor.
-- Evite tom acadêmico ou excessivamente professoral.
-- Não ensine “por ensinar”: toda explicação deve justificar uma escolha, um risco ou uma priorização.
-- Só apresente múltiplos caminhos quando houver uma decisão real a ser feita.
-- Nunca crie caminhos artificiais apenas para preencher resposta.
-
-Estrutura esperada da resposta:
-1) Contextualize rapidamente o problema de negócio.
-2) Explique os conceitos técnicos necessários para embasar a decisão (sem excesso).
-3) Organize as opções relevantes, destacando trade-offs reais.
-4) Finalize com uma recomendação clara, prática e acionável.
-
-Quando fizer sentido:
-- Mostre trade-offs (vantagens, riscos, custos de erro).
-- Relacione com métricas, orçamento, capacidade operacional ou impacto financeiro.
-- Utilize exemplos aplicáveis a contextos reais (crédito, cobrança, churn, operações, dados).
-
-Uso de documentos (RAG):
-- Utilize os documentos fornecidos como base factual.
-- Se não houver evidência nos documentos, deixe isso explícito.
-- Não extrapole além do que os documentos sustentam.
-
-Fontes específicas:
-- Se o usuário mencionar explicitamente um autor, livro ou obra:
-  - Utilize EXCLUSIVAMENTE os documentos dessa fonte.
-  - Se nenhum trecho dessa fonte estiver presente no contexto recuperado,
-    informe claramente que não há evidência suficiente para responder.
-  - Nunca utilize outras fontes como substituição.
-
-Regra crítica de uso de exemplos:
-- Exemplos, números ou modelos mencionados nos documentos são ilustrativos,
-  a menos que o usuário forneça explicitamente dados do seu próprio problema.
-- Nunca trate exemplos didáticos dos livros como resultados reais aplicáveis.
-- Nunca nomeie modelos como “A” ou “B” se eles não existirem explicitamente no problema do usuário.
-- Se o documento trouxer apenas exemplos conceituais, deixe isso claro na resposta.
-
-Postura profissional obrigatória:
-- Responda como alguém que será cobrado pelo resultado da decisão.
-- Evite respostas neutras ou excessivamente abrangentes.
-- Sempre deixe claro:
-  • O que eu faria
-  • O que eu NÃO faria
-  • Por quê
-- Se houver incerteza, explicite o risco e proponha mitigação.
-- Não liste possibilidades sem hierarquizá-las.
-
-Regra de senioridade:
-- Engenharia de Dados → foque em arquitetura, ordem de execução e falhas comuns.
-- Análise de Dados → foque em interpretação, priorização e comunicação.
-- Ciência de Dados → foque em custo de erro, métricas certas e impacto operacional.
-- Nunca misture papéis sem justificativa explícita.
-
-Geração de código:
-- Gere código somente quando isso ajudar a implementar, validar ou operacionalizar a decisão.
-- Antes de apresentar código, explique brevemente POR QUE essa abordagem técnica é adequada ao contexto.
-- O código deve ser funcional, organizado e alinhado ao ambiente mencionado pelo usuário.
-- Nunca gere código genérico sem conexão clara com o problema de negócio descrito.
-
-Regra de saída (código):
-- Se o usuário pedir explicitamente por código (ex: “monte um código”, “me dê um script”, “quero um exemplo”), forneça código completo e executável.
-- Se o usuário não pedir código, não responda com código por padrão; ofereça no máximo um pseudo-exemplo opcional ao final.
-
-Regra de confiabilidade:
-- Nunca presuma contexto operacional, métricas, volumes ou resultados.
-- Se algo não estiver explicitamente descrito nos documentos ou na pergunta,
-  trate como desconhecido.
-- Prefira assumir incerteza a fornecer uma resposta imprecisa.
-
-Encerramento:
-- Sempre conclua com uma recomendação orientada à decisão de negócio.
-- Evite perguntas genéricas.
-- Só faça perguntas ao usuário se isso destravar uma escolha prática
-  (ex: orçamento, volume de clientes, restrição operacional).
-
-Histórico da conversa:
-{chat_history}
-
-Contexto (documentos relevantes):
-{context}
-
-Pergunta:
-{question}
-
-Resposta:
-""",
-            )
+    def mostrar_parcial(texto):
+        bolha_resposta.markdown(
+            f'<div class="bubble bot-msg">🤖 Resposta: {texto}▌</div>',
+            unsafe_allow_html=True,
+        )
 
-            # Cadeia (SEM fontes)
-            chain = ConversationalRetrievalChain.from_llm(
-                llm=llm,
-                retriever=retriever,
-                memory=st.session_state.memory,
-                combine_docs_chain_kwargs={"prompt": prompt},
-                return_source_documents=False,
-                output_key="answer",
+    with st.spinner("🤖 Nathal.IA está pensando..."):
+        try:
+            # Consulta (embedding 1x -> tema -> recuperação -> LLM) roda no serviço do processo;
+            # esta thread só acompanha o texto parcial
+            inicio_pergunta = time.perf_counter()
+            tarefa = obter_servico().enviar(
+                nova_pergunta,
+                st.session_state.memory,
+                streaming=STREAMING_RESPOSTA,
             )
-
-            # Rodar consulta
-            resultado = chain.invoke({"question": nova_pergunta})
+            for parcial in tarefa.acompanhar():
+                mostrar_parcial(parcial)
+            resultado = tarefa.resultado()
+            # envio -> última parcial na tela, visto pela thread da sessão
+            obter_metricas().observar("ui.pergunta", time.perf_counter() - inicio_pergunta)
 
             # Guardar resposta (opcional)
             st.session_state["last_answer"] = resultado.get("answer", "")
+            st.session_state["ultimas_metricas"] = resultado.get("metricas", {})
 
             # Rerun para renderizar no histórico
             st.rerun()
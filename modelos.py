@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# modelos.py
+# Criação do LLM (OpenAI ou falso/local) e captura de tokens em streaming.
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, BaseCallbackHandler, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import (
+    BaseChatModel,
+    agenerate_from_stream,
+    generate_from_stream,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+# "openai" (padrão) ou "fake" (LLM local determinístico para testes e benchmarks)
+PROVEDOR_LLM = os.getenv("NATHALIA_LLM", "openai")
+MODELO_RESPOSTA = "gpt-4.1-mini"
+# pool de conexões HTTP com o provedor, compartilhado por todas as chamadas do processo
+LLM_MAX_CONEXOES = int(os.getenv("LLM_MAX_CONEXOES", "32"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+
+# ================== LLM FALSO ==================
+class LLMFalso(BaseChatModel):
+    """
+    Chat model local e determinístico. Devolve sempre `resposta`, token a token,
+    com atrasos configuráveis para simular a latência do provedor.
+    """
+
+    resposta: str = (
+        "Resposta simulada da Nathal.IA. Contexto do negócio, conceitos necessários, "
+        "opções com trade-offs e uma recomendação clara e acionável."
+    )
+    atraso_primeiro_token: float = 0.0
+    atraso_token: float = 0.0
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "nathalia-falso"
+
+    def _tokens(self) -> List[str]:
+        return re.findall(r"\S+\s*", self.resposta)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+        time.sleep(self.atraso_primeiro_token + self.atraso_token * len(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.resposta))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.atraso_primeiro_token)
+        for token in self._tokens():
+            time.sleep(self.atraso_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+        await asyncio.sleep(self.atraso_primeiro_token + self.atraso_token * len(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.resposta))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # espera sem prender thread, como a espera de rede do provedor real
+        await asyncio.sleep(self.atraso_primeiro_token)
+        for token in self._tokens():
+            await asyncio.sleep(self.atraso_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+# ================== CONEXÕES ==================
+_CLIENTES = {}
+_CLIENTES_LOCK = threading.Lock()
+
+
+def cliente_http(assincrono: bool = False):
+    """
+    Cliente httpx compartilhado (keep-alive, até LLM_MAX_CONEXOES conexões).
+    O assíncrono é um por event loop: o pool do httpx não pode trocar de loop.
+    """
+    chave = "sincrono"
+    if assincrono:
+        chave = asyncio.get_running_loop()
+    cliente = _CLIENTES.get(chave)
+    if cliente is None:
+        with _CLIENTES_LOCK:
+            cliente = _CLIENTES.get(chave)
+            if cliente is None:
+                limites = httpx.Limits(max_connections=LLM_MAX_CONEXOES, max_keepalive_connections=LLM_MAX_CONEXOES)
+                tipo = httpx.AsyncClient if assincrono else httpx.Client
+                cliente = _CLIENTES[chave] = tipo(limits=limites, timeout=LLM_TIMEOUT)
+    return cliente
+
+
+def criar_llm(streaming: bool = False, callbacks=None, modelo: str = MODELO_RESPOSTA):
+    """LLM de resposta. Com NATHALIA_LLM=fake usa o LLMFalso (sem rede)."""
+    if PROVEDOR_LLM == "fake":
+        return LLMFalso(
+            atraso_primeiro_token=float(os.getenv("LLM_FALSO_ATRASO_INICIAL", "0")),
+            atraso_token=float(os.getenv("LLM_FALSO_ATRASO_TOKEN", "0")),
+            streaming=streaming,
+            callbacks=callbacks,
+        )
+    try:
+        # criado dentro de um event loop: pode ser usado com ainvoke/astream nesse loop
+        cliente_async = cliente_http(assincrono=True)
+    except RuntimeError:
+        cliente_async = None
+    return ChatOpenAI(
+        model=modelo,
+        temperature=0.15,
+        max_tokens=900,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        streaming=streaming,
+        callbacks=callbacks,
+        http_client=cliente_http(),
+        http_async_client=cliente_async,
+    )
+
+
+# ================== STREAMING ==================
+class ColetorStreaming(BaseCallbackHandler):
+    """
+    Acumula os tokens do LLM de resposta e chama `ao_token(texto_parcial)` a cada token.
+    Mede o tempo até o primeiro token desde o envio da pergunta (`ttft`) e desde o
+    início da chamada ao LLM (`ttft_llm`).
+    """
+
+    # chamado direto no loop (sem executor) nas chamadas assíncronas: mantém a ordem dos tokens
+    run_inline = True
+
+    def __init__(self, ao_token: Optional[Callable[[str], Any]] = None, inicio: Optional[float] = None):
+        self.ao_token = ao_token
+        self.inicio = inicio or time.perf_counter()
+        self.inicio_llm = None
+        self.primeiro_token = None
+        self.fim = None
+        self.texto = ""
+        self.n_tokens = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.inicio_llm = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.inicio_llm = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self.primeiro_token is None:
+            self.primeiro_token = time.perf_counter()
+        self.texto += token
+        self.n_tokens += 1
+        if self.ao_token:
+            self.ao_token(self.texto)
+
+    def on_llm_end(self, response, **kwargs):
+        self.fim = time.perf_counter()
+
+    @property
+    def ttft(self):
+        return None if self.primeiro_token is None else self.primeiro_token - self.inicio
+
+    @property
+    def ttft_llm(self):
+        if self.primeiro_token is None or self.inicio_llm is None:
+            return None
+        return self.primeiro_token - self.inicio_llm
+
+    def metricas(self) -> dict:
+        return {
+            "ttft_s": self.ttft,
+            "ttft_llm_s": self.ttft_llm,
+            "tokens": self.n_tokens,
+            "total_llm_s": (self.fim - self.inicio_llm) if self.fim and self.inicio_llm else None,
+        }
+
+
+# ================== TOKENS ==================
+_CODIFICADOR = None
+_CODIFICADOR_INDISPONIVEL = False
+
+
+def _codificador():
+    """Tokenizer do gpt-4.1 (o200k_base). Sem rede para baixar o BPE, usa estimativa."""
+    global _CODIFICADOR, _CODIFICADOR_INDISPONIVEL
+    if _CODIFICADOR is None and not _CODIFICADOR_INDISPONIVEL:
+        try:
+            import tiktoken
+
+            _CODIFICADOR = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"⚠️ tiktoken indisponível ({e}); contando tokens por estimativa.")
+            _CODIFICADOR_INDISPONIVEL = True
+    return _CODIFICADOR
+
+
+def contar_tokens(texto: str) -> int:
+    if not texto:
+        return 0
+    codificador = _codificador()
+    if codificador is None:
+        # ~4 caracteres por token em português
+        return max(1, len(texto) // 4)
+    return len(codificador.encode(texto, disallowed_special=()))
+
+
+def truncar_tokens(texto: str, limite: int, manter_fim: bool = False) -> str:
+    """Corta `texto` para caber em `limite` tokens (mantém o início, ou o fim com `manter_fim`)."""
+    if contar_tokens(texto) <= limite:
+        return texto
+    if limite <= 0:
+        return ""
+    codificador = _codificador()
+    if codificador is None:
+        return texto[-limite * 4:] if manter_fim else texto[: limite * 4]
+    tokens = codificador.encode(texto, disallowed_special=())
+    return codificador.decode(tokens[-limite:] if manter_fim else tokens[:limite])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# montagem_prompt.py
+# Montagem do prompt de resposta: instruções fixas primeiro, contexto comprimido e orçamento de tokens.
+import math
+import os
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from lexico import tokenizar
+from modelos import contar_tokens, truncar_tokens
+
+COMPRESSAO_ATIVA = os.getenv("COMPRESSAO_CONTEXTO", "1") != "0"
+# teto de tokens de entrada por chamada (instruções + histórico + contexto + pergunta)
+ORCAMENTO_PROMPT = int(os.getenv("PROMPT_ORCAMENTO_TOKENS", "3500"))
+# o histórico é cortado (mantendo o fim) se deixar menos que isto para o contexto
+MIN_TOKENS_CONTEXTO = int(os.getenv("PROMPT_MIN_TOKENS_CONTEXTO", "400"))
+# prefixo comparado entre palavras (radical grosseiro: "inadimplência" ~ "inadimplente")
+TAMANHO_RADICAL = 6
+# frases curtas demais são juntadas à seguinte
+MIN_CARACTERES_FRASE = 25
+
+MENSAGEM_USUARIO = """Histórico da conversa:
+{chat_history}
+
+Contexto (documentos relevantes):
+{context}
+
+Pergunta:
+{question}
+
+Resposta:
+"""
+
+_FIM_FRASE = re.compile(r"(?<=[.!?;])\s+|\n\s*\n|\n(?=\s*(?:[-•*]|\d+[.)])\s)")
+
+
+# ================== COMPRESSÃO ==================
+def _radicais(texto: str) -> set:
+    return {t[:TAMANHO_RADICAL] for t in tokenizar(texto)}
+
+
+def dividir_frases(texto: str) -> list:
+    """Frases do trecho (pontuação, parágrafos e itens de lista), com quebras de linha do PDF desfeitas."""
+    frases, pendente = [], ""
+    for parte in _FIM_FRASE.split(texto or ""):
+        parte = " ".join(parte.split())
+        if not parte:
+            continue
+        pendente = f"{pendente} {parte}".strip()
+        if len(pendente) >= MIN_CARACTERES_FRASE:
+            frases.append(pendente)
+            pendente = ""
+    if pendente:
+        frases.append(pendente)
+    return frases
+
+
+def comprimir_contexto(pergunta: str, trechos, limite_tokens: int) -> str:
+    """
+    Mantém só as frases dos trechos que compartilham termos com a pergunta (peso idf entre
+    as frases candidatas, com leve preferência pelos trechos mais bem ranqueados), até
+    `limite_tokens`. As frases escolhidas voltam na ordem original, agrupadas por trecho.
+    Sem nenhuma frase relevante, devolve os trechos inteiros cortados no limite.
+    """
+    consulta = _radicais(pergunta)
+    frases = [
+        (t, i, frase, _radicais(frase))
+        for t, trecho in enumerate(trechos)
+        for i, frase in enumerate(dividir_frases(trecho))
+    ]
+    if not frases or not consulta:
+        return truncar_tokens("\n\n".join(trechos), limite_tokens)
+
+    df = {r: sum(r in radicais for *_, radicais in frases) for r in consulta}
+    idf = {r: math.log(1 + len(frases) / n) for r, n in df.items() if n}
+    pontuadas = []
+    for t, i, frase, radicais in frases:
+        pontos = sum(idf.get(r, 0.0) for r in consulta & radicais)
+        if pontos > 0:
+            pontuadas.append((pontos * (1 - 0.05 * t), t, i, frase))
+    if not pontuadas:
+        return truncar_tokens("\n\n".join(trechos), limite_tokens)
+
+    escolhidas, usados = [], 0
+    for _, t, i, frase in sorted(pontuadas, reverse=True):
+        custo = contar_tokens(frase) + 1
+        if usados + custo > limite_tokens:
+            continue
+        escolhidas.append((t, i, frase))
+        usados += custo
+
+    blocos = {}
+    for t, _, frase in sorted(escolhidas):
+        blocos.setdefault(t, []).append(frase)
+    return "\n\n".join(" ".join(frases_trecho) for _, frases_trecho in sorted(blocos.items()))
+
+
+# ================== MONTAGEM ==================
+def montar_prompt(instrucoes: str, historico: str, pergunta: str, trechos=None, contexto: str = None,
+                  busca: str = None, orcamento: int = ORCAMENTO_PROMPT):
+    """
+    Mensagens para o LLM de resposta e o relatório de tokens.
+    As instruções fixas vão sozinhas na mensagem de sistema, sempre idênticas e no início:
+    o provedor reaproveita esse prefixo entre chamadas (prompt caching).
+    `trechos` (documentos recuperados) são comprimidos por frase; `contexto` pronto
+    (ex.: agregados) vai antes deles e só é cortado, reservando até MIN_TOKENS_CONTEXTO
+    para os trechos. O total fica dentro de `orcamento` tokens.
+    `busca` é a consulta usada para escolher as frases (padrão: a própria pergunta).
+    """
+    texto_trechos = "\n\n".join(trechos or [])
+    bruto = "\n\n".join(p for p in (contexto, texto_trechos) if p)
+    fixos = contar_tokens(instrucoes) + contar_tokens(MENSAGEM_USUARIO) + contar_tokens(pergunta)
+    antes = fixos + contar_tokens(historico) + contar_tokens(bruto)
+
+    # histórico recente tem prioridade, mas nunca espreme o contexto abaixo do mínimo
+    limite_historico = max(0, orcamento - fixos - MIN_TOKENS_CONTEXTO)
+    historico = truncar_tokens(historico, limite_historico, manter_fim=True)
+    limite_contexto = max(0, orcamento - fixos - contar_tokens(historico))
+
+    partes = []
+    if contexto:
+        reserva = min(MIN_TOKENS_CONTEXTO, limite_contexto // 2) if trechos else 0
+        partes.append(truncar_tokens(contexto, limite_contexto - reserva))
+        limite_contexto -= contar_tokens(partes[-1])
+    if trechos:
+        if COMPRESSAO_ATIVA:
+            partes.append(comprimir_contexto(busca or pergunta, trechos, limite_contexto))
+        else:
+            partes.append(truncar_tokens(texto_trechos, limite_contexto))
+    contexto = "\n\n".join(p for p in partes if p)
+
+    mensagens = [
+        SystemMessage(content=instrucoes),
+        HumanMessage(content=MENSAGEM_USUARIO.format(chat_history=historico, context=contexto, question=pergunta)),
+    ]
+    # sem print por pergunta: o pipeline grava antes/depois nos atributos da etapa "prompt" do rastro
+    depois = fixos + contar_tokens(historico) + contar_tokens(contexto)
+    return mensagens, {"tokens_prompt_antes": antes, "tokens_prompt": depois}
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# motor_embeddings.py
+# Etapa de embeddings da ingestão: lotes configuráveis, threads/processos e gravação sobreposta.
+# Também agrupa perguntas simultâneas (serviço/API) num só forward pass.
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from registro import MODELO_EMBEDDINGS
+
+# tamanho do lote passado ao SentenceTransformer.encode
+EMBEDDING_LOTE = int(os.getenv("EMBEDDING_LOTE", "64"))
+# threads do torch no processo principal (0 = padrão do torch)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# processos de encode (> 1 usa o pool multi-processo do sentence-transformers)
+EMBEDDING_PROCESSOS = int(os.getenv("EMBEDDING_PROCESSOS", "1"))
+EMBEDDING_NORMALIZAR = os.getenv("EMBEDDING_NORMALIZAR", "0") == "1"
+# chunks por gravação no Chroma
+LOTE_GRAVACAO = int(os.getenv("EMBEDDING_LOTE_GRAVACAO", "1000"))
+# espera para juntar perguntas que chegam juntas num só lote (0 = uma a uma)
+EMBEDDING_AGRUPAR_MS = float(os.getenv("EMBEDDING_AGRUPAR_MS", "2"))
+
+
+class MotorEmbeddings(Embeddings):
+    """
+    Embeddings do MiniLM direto no SentenceTransformer, com controle de lote,
+    normalização, threads do torch e (opcional) vários processos de encode.
+    Conta chunks e tempo de encode para reportar chunks/s.
+    """
+
+    def __init__(
+        self,
+        modelo: str = MODELO_EMBEDDINGS,
+        tamanho_lote: int = EMBEDDING_LOTE,
+        threads: int = EMBEDDING_THREADS,
+        processos: int = EMBEDDING_PROCESSOS,
+        normalizar: bool = EMBEDDING_NORMALIZAR,
+    ):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.modelo = modelo
+        self.tamanho_lote = tamanho_lote
+        self.normalizar = normalizar
+        self._st = SentenceTransformer(modelo, device="cpu")
+        self._pool = None
+        if processos > 1:
+            self._pool = self._st.start_multi_process_pool(target_devices=["cpu"] * processos)
+        self.total_textos = 0
+        self.tempo_encode = 0.0
+
+    @property
+    def chave_cache(self) -> str:
+        """Chave no cache de embeddings: modelo e normalização (vetores normalizados são outros)."""
+        return f"{self.modelo}|normalizado" if self.normalizar else self.modelo
+
+    def _encode(self, textos: List[str]):
+        t0 = time.perf_counter()
+        if self._pool is not None and len(textos) > self.tamanho_lote:
+            vetores = self._st.encode_multi_process(
+                textos, self._pool, batch_size=self.tamanho_lote, normalize_embeddings=self.normalizar
+            )
+        else:
+            vetores = self._st.encode(
+                textos,
+                batch_size=self.tamanho_lote,
+                normalize_embeddings=self.normalizar,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        self.tempo_encode += time.perf_counter() - t0
+        self.total_textos += len(textos)
+        return vetores
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._encode([t.replace("\n", " ") for t in texts]).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    @property
+    def chunks_por_segundo(self) -> float:
+        return self.total_textos / self.tempo_encode if self.tempo_encode else 0.0
+
+    def fechar(self):
+        if self._pool is not None:
+            self._st.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+def _upsert(colecao, ids, textos, metadatas, vetores):
+    """Upsert direto na coleção Chroma (o Chroma recusa metadados vazios: vão separados)."""
+    com_meta = [i for i, m in enumerate(metadatas) if m]
+    sem_meta = [i for i, m in enumerate(metadatas) if not m]
+    if com_meta:
+        colecao.upsert(
+            ids=[ids[i] for i in com_meta],
+            embeddings=[vetores[i] for i in com_meta],
+            documents=[textos[i] for i in com_meta],
+            metadatas=[metadatas[i] for i in com_meta],
+        )
+    if sem_meta:
+        colecao.upsert(
+            ids=[ids[i] for i in sem_meta],
+            embeddings=[vetores[i] for i in sem_meta],
+            documents=[textos[i] for i in sem_meta],
+        )
+
+
+class EtapaEmbedding:
+    """
+    Vetoriza em lotes e grava no Chroma numa thread separada, de modo que a
+    gravação de um lote acontece enquanto o próximo está sendo vetorizado.
+    Todas as operações na base (upsert/delete) passam pela mesma thread, em ordem.
+    """
+
+    def __init__(self, motor, chroma_db, lote_gravacao: int = LOTE_GRAVACAO):
+        self.motor = motor
+        self.chroma_db = chroma_db
+        self.lote_gravacao = lote_gravacao
+        self._gravador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gravador-chroma")
+        self.inicio = time.perf_counter()
+        self.chunks = 0
+
+    def apagar(self, ids):
+        """Agenda a remoção de IDs (na ordem, depois das gravações já enviadas)."""
+        ids = list(ids)
+        return [
+            self._gravador.submit(self.chroma_db._collection.delete, ids=ids[i:i + self.lote_gravacao])
+            for i in range(0, len(ids), self.lote_gravacao)
+        ]
+
+    def gravar(self, ids, textos, metadatas=None):
+        """
+        Vetoriza e agenda a gravação. Retorna as futures das gravações; a próxima
+        chamada já pode vetorizar enquanto estas gravam.
+        """
+        metadatas = metadatas or [{} for _ in textos]
+        futuros = []
+        for i in range(0, len(textos), self.lote_gravacao):
+            lote_textos = textos[i:i + self.lote_gravacao]
+            vetores = self.motor.embed_documents(lote_textos)
+            futuros.append(
+                self._gravador.submit(
+                    _upsert,
+                    self.chroma_db._collection,
+                    ids[i:i + self.lote_gravacao],
+                    lote_textos,
+                    metadatas[i:i + self.lote_gravacao],
+                    vetores,
+                )
+            )
+            self.chunks += len(lote_textos)
+        return futuros
+
+    def gravar_documentos(self, documentos, ids):
+        return self.gravar(ids, [d.page_content for d in documentos], [d.metadata for d in documentos])
+
+    def aguardar(self):
+        """Bloqueia até todas as gravações agendadas terminarem."""
+        self._gravador.submit(lambda: None).result()
+
+    def relatorio(self) -> str:
+        duracao = time.perf_counter() - self.inicio
+        encode = getattr(self.motor, "chunks_por_segundo", 0.0)
+        texto = (
+            f"⚡ Embeddings: {self.chunks} chunks | encode {encode:.1f} chunks/s | "
+            f"ponta a ponta {self.chunks / duracao if duracao else 0:.1f} chunks/s"
+        )
+        if hasattr(self.motor, "taxa_acerto"):
+            texto += f" | cache {self.motor.taxa_acerto:.0%} de acerto"
+        return texto
+
+    def fechar(self):
+        self._gravador.shutdown(wait=True)
+
+
+# ================== PERGUNTAS SIMULTÂNEAS ==================
+class AgrupadorConsultas:
+    """
+    `embed_query` de várias threads vira um `embed_documents` por lote.
+    Uma thread por vez é a líder: leva ao modelo um lote (até `max_lote`, a própria
+    consulta incluída), entrega cada vetor à thread que o pediu e passa a liderança
+    à primeira consulta que chegou durante o encode. Assim ninguém processa mais de
+    um lote alheio. A líder só espera `espera_ms` por outras consultas quando já há
+    mais alguém na fila; sozinha, vai direto ao modelo.
+    """
+
+    def __init__(self, base: Embeddings, espera_ms: float = EMBEDDING_AGRUPAR_MS, max_lote: int = EMBEDDING_LOTE):
+        self.base = base
+        self.espera = espera_ms / 1000
+        self.max_lote = max_lote
+        self._pendentes = []  # [(texto, Future, Event)]: o evento acorda com o resultado ou a liderança
+        self._lider_ativo = False
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.consultas = 0
+
+    def embed_query(self, texto: str) -> List[float]:
+        if self.espera <= 0:
+            return self.base.embed_query(texto)
+        futuro, acordar = Future(), threading.Event()
+        with self._lock:
+            self._pendentes.append((texto, futuro, acordar))
+            if not self._lider_ativo:
+                self._lider_ativo = True
+                acordar.set()
+        acordar.wait()
+        if not futuro.done():
+            self._processar_lote()
+        return futuro.result()
+
+    def _processar_lote(self):
+        """Um lote (a consulta da líder vem primeiro na fila) e a passagem da liderança."""
+        with self._lock:
+            esperar = 1 < len(self._pendentes) < self.max_lote
+        if esperar:
+            time.sleep(self.espera)
+        with self._lock:
+            lote = self._pendentes[: self.max_lote]
+            del self._pendentes[: self.max_lote]
+        try:
+            vetores = self.base.embed_documents([texto for texto, _, _ in lote])
+        except Exception as e:
+            for _, futuro, acordar in lote:
+                futuro.set_exception(e)
+                acordar.set()
+        else:
+            self.lotes += 1
+            self.consultas += len(lote)
+            for (_, futuro, acordar), vetor in zip(lote, vetores):
+                futuro.set_result(vetor)
+                acordar.set()
+        finally:
+            with self._lock:
+                if self._pendentes:
+                    self._pendentes[0][2].set()
+                else:
+                    self._lider_ativo = False
+
+    @property
+    def media_por_lote(self) -> float:
+        return self.consultas / self.lotes if self.lotes else 0.0
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# pipeline.py
+# Fluxo de resposta: consulta de busca -> embedding (1x) -> tema -> recuperação -> LLM.
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from analitico import ANALITICO_ATIVO, TEMA_ANALITICO, contexto_analitico
+from cache_respostas import obter_cache
+from conversa import formatar_historico, preparar_consulta
+from indices_vetoriais import obter_indice_vetorial
+from lexico import obter_indice_lexico
+from modelos import ColetorStreaming, contar_tokens, criar_llm
+from montagem_prompt import montar_prompt
+from motor_embeddings import AgrupadorConsultas
+from rastreamento import Rastro, obter_metricas, registrar_falha
+from recuperacao import RetrieverPorVetor
+from registro import obter_registro
+from reranqueamento import obter_reranqueador
+from roteamento import identificar_tema
+
+K_DOCUMENTOS = 4
+# vetorial + BM25 (reciprocal rank fusion) quando o tema tem bm25.npz
+BUSCA_HIBRIDA = os.getenv("BUSCA_HIBRIDA", "1") != "0"
+
+# ================== PROMPT ==================
+# Bloco fixo (mensagem de sistema): idêntico em toda chamada para o cache de prompt do provedor.
+# Histórico, contexto e pergunta vão na mensagem do usuário (montagem_prompt.py).
+INSTRUCOES_RESPOSTA = """Você é a Nathal.IA — uma assistente estratégica de dados criada por Nathália Lima.
+
+Seu papel é apoiar decisões reais de negócio usando dados, estatística e machine learning.
+Você responde como uma cientista de dados experiente, segura e prática, com visão de negócio.
+
+Princípios obrigatórios:
+- Responda sempre em português.
+- Priorize clareza, direcionamento e impacto no negócio.
+- Demonstre domínio técnico, explicando conceitos quando isso ajudar a tomar uma decisão melhor.
+- Evite tom acadêmico ou excessivamente professoral.
+- Não ensine “por ensinar”: toda explicação deve justificar uma escolha, um risco ou uma priorização.
+- Só apresente múltiplos caminhos quando houver uma decisão real a ser feita.
+- Nunca crie caminhos artificiais apenas para preencher resposta.
+
+Estrutura esperada da resposta:
+1) Contextualize rapidamente o problema de negócio.
+2) Explique os conceitos técnicos necessários para embasar a decisão (sem excesso).
+3) Organize as opções relevantes, destacando trade-offs reais.
+4) Finalize com uma recomendação clara, prática e acionável.
+
+Quando fizer sentido:
+- Mostre trade-offs (vantagens, riscos, custos de erro).
+- Relacione com métricas, orçamento, capacidade operacional ou impacto financeiro.
+- Utilize exemplos aplicáveis a contextos reais (crédito, cobrança, churn, operações, dados).
+
+Uso de documentos (RAG):
+- Utilize os documentos fornecidos como base factual.
+- Se não houver evidência nos documentos, deixe isso explícito.
+- Não extrapole além do que os documentos sustentam.
+
+Fontes específicas:
+- Se o usuário mencionar explicitamente um autor, livro ou obra:
+  - Utilize EXCLUSIVAMENTE os documentos dessa fonte.
+  - Se nenhum trecho dessa fonte estiver presente no contexto recuperado,
+    informe claramente que não há evidência suficiente para responder.
+  - Nunca utilize outras fontes como substituição.
+
+Regra crítica de uso de exemplos:
+- Exemplos, números ou modelos mencionados nos documentos são ilustrativos,
+  a menos que o usuário forneça explicitamente dados do seu próprio problema.
+- Nunca trate exemplos didáticos dos livros como resultados reais aplicáveis.
+- Nunca nomeie modelos como “A” ou “B” se eles não existirem explicitamente no problema do usuário.
+- Se o documento trouxer apenas exemplos conceituais, deixe isso claro na resposta.
+
+Postura profissional obrigatória:
+- Responda como alguém que será cobrado pelo resultado da decisão.
+- Evite respostas neutras ou excessivamente abrangentes.
+- Sempre deixe claro:
+  • O que eu faria
+  • O que eu NÃO faria
+  • Por quê
+- Se houver incerteza, explicite o risco e proponha mitigação.
+- Não liste possibilidades sem hierarquizá-las.
+
+Regra de senioridade:
+- Engenharia de Dados → foque em arquitetura, ordem de execução e falhas comuns.
+- Análise de Dados → foque em interpretação, priorização e comunicação.
+- Ciência de Dados → foque em custo de erro, métricas certas e impacto operacional.
+- Nunca misture papéis sem justificativa explícita.
+
+Geração de código:
+- Gere código somente quando isso ajudar a implementar, validar ou operacionalizar a decisão.
+- Antes de apresentar código, explique brevemente POR QUE essa abordagem técnica é adequada ao contexto.
+- O código deve ser funcional, organizado e alinhado ao ambiente mencionado pelo usuário.
+- Nunca gere código genérico sem conexão clara com o problema de negócio descrito.
+
+Regra de saída (código):
+- Se o usuário pedir explicitamente por código (ex: “monte um código”, “me dê um script”, “quero um exemplo”), forneça código completo e executável.
+- Se o usuário não pedir código, não responda com código por padrão; ofereça no máximo um pseudo-exemplo opcional ao final.
+
+Regra de confiabilidade:
+- Nunca presuma contexto operacional, métricas, volumes ou resultados.
+- Se algo não estiver explicitamente descrito nos documentos ou na pergunta,
+  trate como desconhecido.
+- Prefira assumir incerteza a fornecer uma resposta imprecisa.
+
+Encerramento:
+- Sempre conclua com uma recomendação orientada à decisão de negócio.
+- Evite perguntas genéricas.
+- Só faça perguntas ao usuário se isso destravar uma escolha prática
+  (ex: orçamento, volume de clientes, restrição operacional).
+"""
+
+
+# ================== PIPELINE ==================
+_AGRUPADOR = None
+_AGRUPADOR_LOCK = threading.Lock()
+
+
+def obter_agrupador() -> AgrupadorConsultas:
+    """Agrupador das perguntas simultâneas sobre o modelo de embeddings do registro."""
+    global _AGRUPADOR
+    embeddings = obter_registro().embeddings
+    if _AGRUPADOR is None or _AGRUPADOR.base is not embeddings:
+        with _AGRUPADOR_LOCK:
+            if _AGRUPADOR is None or _AGRUPADOR.base is not embeddings:
+                _AGRUPADOR = AgrupadorConsultas(embeddings)
+    return _AGRUPADOR
+
+
+def vetorizar_pergunta(pergunta: str):
+    """Único forward pass do MiniLM por pergunta (em lote com as que chegarem junto)."""
+    return obter_agrupador().embed_query(pergunta)
+
+
+def criar_retriever(tema: str, busca: str, vetor, store=None, k: int = K_DOCUMENTOS) -> RetrieverPorVetor:
+    """Retriever do tema como o pipeline usa: híbrido se há BM25, backend INDICE_VETORIAL, re-ranqueamento."""
+    registro = obter_registro()
+    pasta = registro.pasta_tema(tema)
+    indice_lexico = obter_indice_lexico(pasta) if BUSCA_HIBRIDA else None
+    return RetrieverPorVetor(
+        store=store if store is not None else registro.obter_store(tema),
+        pergunta=busca,
+        vetor=vetor,
+        k=k,
+        indice_lexico=indice_lexico if indice_lexico and indice_lexico.disponivel else None,
+        # backend configurado por INDICE_VETORIAL (None = busca do Chroma)
+        indice_vetorial=obter_indice_vetorial(pasta),
+        # over-fetch + cross-encoder (só com RERANK=1)
+        reranqueador=obter_reranqueador(),
+    )
+
+
+def _metricas(estado: dict, extra=None) -> dict:
+    """Métricas da resposta; fecha o rastro da pergunta (logs JSON e histogramas)."""
+    rastro = estado["rastro"]
+    metricas = dict(extra or {})
+    metricas["total_s"] = time.perf_counter() - estado["inicio"]
+    metricas["estrategia"] = estado["consulta"]["estrategia"]
+    metricas["tokens_historico"] = contar_tokens(estado["historico_formatado"])
+    metricas["etapas"] = {k: round(v, 4) for k, v in rastro.etapas.items()}
+    if estado.get("rerank"):
+        metricas["rerank"] = estado["rerank"]
+    metricas["rastro"] = rastro.finalizar(
+        tema=estado["tema"],
+        estrategia=metricas["estrategia"],
+        cache_resposta=bool(estado.get("resultado_cache")),
+        falha=False,
+        tokens_historico=metricas["tokens_historico"],
+        tokens_prompt=metricas.get("tokens_prompt"),
+        tokens_prompt_antes=metricas.get("tokens_prompt_antes"),
+        tokens_resposta=metricas.get("tokens_resposta"),
+        ttft_ms=round(metricas["ttft_s"] * 1000, 1) if metricas.get("ttft_s") is not None else None,
+    )
+    if metricas.get("ttft_s") is not None:
+        obter_metricas().observar("pergunta.ttft", metricas["ttft_s"])
+    return metricas
+
+
+def preparar_resposta(pergunta: str, memoria, estrategia: str = None, inicio: float = None,
+                      rastro: Rastro = None) -> dict:
+    """
+    Tudo o que vem antes do LLM de resposta (CPU e disco): reescrita, embedding, tema,
+    cache semântico, recuperação e montagem do prompt.
+    Retorna o estado da pergunta; com acerto no cache, `estado["resultado"]` já é a resposta final.
+    """
+    inicio = inicio or time.perf_counter()
+    rastro = rastro or Rastro("pergunta")
+    rastro.inicio = inicio
+    registro = obter_registro()
+    historico = memoria.load_memory_variables({}).get(memoria.memory_key, [])
+    historico_formatado = formatar_historico(historico)
+
+    # Pergunta de acompanhamento -> consulta de busca (sem LLM nas estratégias local/auto)
+    with rastro.etapa("reescrita") as atributos:
+        consulta = preparar_consulta(pergunta, historico, estrategia=estrategia)
+        atributos["estrategia"] = consulta["estrategia"]
+
+    # Embedding calculado uma única vez e reaproveitado no roteamento e na busca
+    with rastro.etapa("embedding"):
+        vetor = vetorizar_pergunta(consulta["busca"])
+
+    # Identificar o tema
+    with rastro.etapa("roteamento") as atributos:
+        tema = identificar_tema(consulta["busca"], vetor=vetor)
+        atributos["tema"] = tema
+
+    # Base vetorial do tema (reaproveitada do registro do processo)
+    with rastro.etapa("abrir_base"):
+        vetores = registro.obter_store(tema)
+        if vetores is None:
+            # fallback seguro
+            tema = "global"
+            vetores = registro.obter_store(tema)
+
+    estado = {
+        "pergunta": pergunta,
+        "memoria": memoria,
+        "inicio": inicio,
+        "rastro": rastro,
+        "consulta": consulta,
+        "historico_formatado": historico_formatado,
+        "tema": tema,
+        "vetor": vetor,
+        "rerank": {},
+        "documentos": None,
+    }
+
+    # Cache semântico: só para perguntas sem histórico (a resposta não depende da conversa)
+    cache = obter_cache() if not historico else None
+    versao = registro.versao_tema(tema) if cache else None
+    estado["cache"], estado["versao"] = cache, versao
+    if cache:
+        with rastro.etapa("cache") as atributos:
+            em_cache = cache.buscar(tema, vetor, versao)
+            atributos["acerto"] = bool(em_cache)
+        if em_cache:
+            memoria.save_context({"question": pergunta}, {"answer": em_cache["resposta"]})
+            estado["resultado_cache"] = True
+            metricas = _metricas(estado, {"ttft_s": time.perf_counter() - inicio})
+            estado["resultado"] = {"answer": em_cache["resposta"], "tema": tema, "cache": True, "metricas": metricas}
+            return estado
+
+    # Base de alunos: perguntas agregadas são respondidas pelos agregados da tabela inteira
+    contexto = None
+    if ANALITICO_ATIVO and tema == TEMA_ANALITICO:
+        with rastro.etapa("analitico") as atributos:
+            contexto = contexto_analitico(consulta["busca"], registro.pasta_tema(tema))
+            atributos["agregada"] = contexto is not None
+
+    if contexto is not None:
+        # sem busca nas linhas nem re-ranqueamento: os agregados já cobrem a tabela inteira
+        estado["documentos"] = []
+    else:
+        # Recuperação (k=4, re-ranqueados entre até RERANK_CANDIDATOS) sobre o vetor já calculado
+        with rastro.etapa("recuperacao") as atributos:
+            retriever = criar_retriever(tema, consulta["busca"], vetor, store=vetores)
+            estado["documentos"] = retriever.invoke(consulta["busca"])
+            atributos["hibrida"] = retriever.indice_lexico is not None
+            atributos["backend"] = retriever.indice_vetorial.nome if retriever.indice_vetorial is not None else "chroma"
+            atributos["documentos"] = len(estado["documentos"])
+        if retriever.ultimo_rerank:
+            estado["rerank"] = dict(retriever.ultimo_rerank)
+            # etapa própria: sai do tempo da recuperação
+            segundos = estado["rerank"]["ms"] / 1000
+            rastro.registrar(
+                "rerank", segundos, pontuados=estado["rerank"]["pontuados"], candidatos=estado["rerank"]["candidatos"],
+                duplicatas=estado["rerank"]["duplicatas"],
+            )
+            rastro.descontar("recuperacao", segundos)
+
+    # Instruções fixas primeiro; só as frases relevantes dos trechos, dentro do orçamento
+    with rastro.etapa("prompt") as atributos:
+        documentos = estado["documentos"]
+        estado["prompt"], estado["tokens_prompt"] = montar_prompt(
+            INSTRUCOES_RESPOSTA,
+            historico_formatado,
+            consulta["pergunta"],
+            trechos=[d.page_content for d in documentos] if documentos is not None else None,
+            contexto=contexto,
+            busca=consulta["busca"],
+        )
+        atributos.update(estado["tokens_prompt"])
+    return estado
+
+
+def concluir_resposta(estado: dict, resposta: str, coletor=None) -> dict:
+    """Grava a troca na memória e no cache semântico e monta o resultado."""
+    with estado["rastro"].etapa("gravacao"):
+        estado["memoria"].save_context({"question": estado["pergunta"]}, {"answer": resposta})
+
+        if estado["cache"]:
+            chunk_ids = [d.id for d in estado["documentos"] or []]
+            estado["cache"].guardar(
+                estado["tema"], estado["versao"], estado["pergunta"], estado["vetor"], chunk_ids, resposta
+            )
+
+    extra = {**estado["tokens_prompt"], **(coletor.metricas() if coletor else {})}
+    extra["tokens_resposta"] = extra.pop("tokens", None) or contar_tokens(resposta)
+    return {
+        "answer": resposta,
+        "tema": estado["tema"],
+        "cache": False,
+        "metricas": _metricas(estado, extra),
+    }
+
+
+def _preparar_llm(estado: dict, ao_token=None):
+    """LLM de resposta (streaming quando há quem consuma os tokens) e o coletor de tokens."""
+    coletor = ColetorStreaming(ao_token, inicio=estado["inicio"]) if ao_token else None
+    with estado["rastro"].etapa("criar_llm"):
+        llm = criar_llm(streaming=coletor is not None, callbacks=[coletor] if coletor else None)
+    return llm, coletor
+
+
+def responder_pergunta(pergunta: str, memoria, ao_token=None, estrategia: str = None) -> dict:
+    """
+    Roda o pipeline completo para uma pergunta, gravando a troca em `memoria`.
+    Com `ao_token`, a resposta é gerada em streaming e `ao_token(texto_parcial)`
+    é chamado a cada token recebido do LLM. `estrategia` define como perguntas de
+    acompanhamento viram consulta de busca (ver conversa.py).
+    Retorna {"answer": ..., "tema": ..., "cache": bool, "metricas": {..., "etapas": {...}, "rastro": {...}}}.
+    """
+    inicio = time.perf_counter()
+    rastro = Rastro("pergunta")
+    try:
+        estado = preparar_resposta(pergunta, memoria, estrategia=estrategia, inicio=inicio, rastro=rastro)
+        if "resultado" in estado:
+            if ao_token:
+                ao_token(estado["resultado"]["answer"])
+            return estado["resultado"]
+
+        llm, coletor = _preparar_llm(estado, ao_token)
+        with rastro.etapa("llm"):
+            resposta = llm.invoke(estado["prompt"]).content
+        return concluir_resposta(estado, resposta, coletor)
+    except Exception as e:
+        # perguntas que falham também entram nos rastros e nas métricas
+        registrar_falha(rastro, e)
+        raise
+
+
+async def responder_pergunta_async(pergunta: str, memoria, ao_token=None, estrategia: str = None,
+                                   executor=None) -> dict:
+    """
+    Versão assíncrona de `responder_pergunta` (usada pelo servico.py): as etapas de CPU
+    e disco rodam em `executor` e a chamada ao LLM é aguardada sem prender uma thread.
+    """
+    loop = asyncio.get_running_loop()
+    inicio = time.perf_counter()
+    rastro = Rastro("pergunta")
+    try:
+        estado = await loop.run_in_executor(
+            executor,
+            functools.partial(preparar_resposta, pergunta, memoria, estrategia=estrategia, inicio=inicio, rastro=rastro),
+        )
+        if "resultado" in estado:
+            if ao_token:
+                ao_token(estado["resultado"]["answer"])
+            return estado["resultado"]
+
+        llm, coletor = _preparar_llm(estado, ao_token)
+        with rastro.etapa("llm"):
+            resposta = (await llm.ainvoke(estado["prompt"])).content
+        return await loop.run_in_executor(executor, concluir_resposta, estado, resposta, coletor)
+    except Exception as e:
+        registrar_falha(rastro, e)
+        raise
@@ -1,17 +1,25 @@
 # ================== IMPORTS ==================
 import os
 import json
+import time
 import requests
 import streamlit as st
 from dotenv import load_dotenv
 
+# antes dos módulos do projeto, que leem a configuração ao serem importados
+load_dotenv()
+
 from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQAWithSourcesChain
+from langchain_core.prompts import PromptTemplate
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
+from indices_vetoriais import obter_indice_vetorial
+from rastreamento import Rastro, iniciar_servidor_metricas, obter_metricas, registrar_falha
+from recuperacao import RetrieverPorVetor
+from reranqueamento import obter_reranqueador
+
 # ================== CONFIG ==================
-load_dotenv()
 os.environ["STREAMLIT_WATCHER_TYPE"] = "none"
 
 st.set_page_config(
@@ -26,19 +34,28 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # ================== VETORES ==================
 @st.cache_resource
 def carregar_vetores():
+    iniciar_servidor_metricas()
+    t0 = time.perf_counter()
     embeddings = HuggingFaceEmbeddings(
         model_name="sentence-transformers/all-MiniLM-L6-v2"
     )
-    return Chroma(
+    obter_metricas().observar("processador.carregar_modelo", time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    vetores = Chroma(
         persist_directory=CAMINHO_VETORIAL,
         embedding_function=embeddings
     )
+    obter_metricas().observar("processador.abrir_base", time.perf_counter() - t0)
+    return vetores
 
 try:
     vetores = carregar_vetores()
-    retriever = vetores.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 4}
+    # backend vetorial configurável (INDICE_VETORIAL); sem vetores exportados usa o Chroma
+    retriever = RetrieverPorVetor(
+        store=vetores,
+        k=4,
+        indice_vetorial=obter_indice_vetorial(CAMINHO_VETORIAL),
+        reranqueador=obter_reranqueador()
     )
 except Exception as e:
     st.error(f"Erro ao carregar base vetorial: {e}")
@@ -56,13 +73,24 @@ except Exception as e:
     st.error(f"Erro ao iniciar modelo OpenAI: {e}")
     st.stop()
 
-# ================== QA CHAIN ==================
-qa_chain = RetrievalQAWithSourcesChain.from_chain_type(
-    llm=llm,
-    retriever=retriever,
-    chain_type_kwargs={"prompt": prompt_pt}
+# ================== PROMPT ==================
+prompt_pt = PromptTemplate.from_template(
+    "Você é a Nathal.IA, uma assistente de dados. Responda em português, "
+    "usando apenas os trechos abaixo. Se eles não bastarem, diga que não encontrou a resposta.\n\n"
+    "Trechos:\n{summaries}\n\n"
+    "Pergunta: {question}\n"
+    "Resposta:"
 )
 
+def responder(pergunta, rastro):
+    """Recuperação e LLM em etapas separadas do rastro (cada uma com sua latência)."""
+    with rastro.etapa("recuperacao"):
+        documentos = retriever.invoke(pergunta)
+    trechos = "\n\n".join(f"[{i+1}] {doc.page_content}" for i, doc in enumerate(documentos))
+    with rastro.etapa("llm"):
+        resposta = llm.invoke(prompt_pt.format(summaries=trechos, question=pergunta)).content
+    return {"answer": resposta, "source_documents": documentos}
+
 # ================== FUNÇÃO HF ==================
 def busca_semantica_mcp(consulta, tipo="spaces"):
     if not HF_TOKEN:
@@ -116,8 +144,9 @@ with st.form("pergunta_form", clear_on_submit=True):
 # ================== PROCESSAMENTO ==================
 if enviar and pergunta:
     with st.spinner("🤖 Nathal.IA está pensando..."):
+        rastro = Rastro("processador")
         try:
-            resposta = qa_chain.invoke({"question": pergunta})
+            resposta = responder(pergunta, rastro)
             texto = resposta.get("answer", "").strip().lower()
 
             resposta_generica = any(p in texto for p in [
@@ -128,13 +157,20 @@ if enviar and pergunta:
             ])
 
             if not texto or resposta_generica:
-                sugestoes = busca_semantica_mcp(pergunta)
+                with rastro.etapa("busca_externa"):
+                    sugestoes = busca_semantica_mcp(pergunta)
                 resposta_final = "🔍 Referências externas encontradas:\n\n"
                 for item in sugestoes:
                     resposta_final += f"• {item.get('title')} — {item.get('url')}\n"
             else:
                 resposta_final = resposta["answer"]
 
+            rastro.finalizar(
+                busca_externa=not texto or resposta_generica,
+                documentos=len(retriever.ultimos_documentos),
+                falha=False,
+            )
+
             st.session_state.chat_history.append({
                 "pergunta": pergunta,
                 "resposta": resposta_final,
@@ -144,6 +180,7 @@ if enviar and pergunta:
             st.rerun()
 
         except Exception as e:
+            registrar_falha(rastro, e)
             st.error(f"Erro ao gerar resposta: {e}")
 
 # ================== RODAPÉ ==================
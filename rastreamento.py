@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# rastreamento.py
+# Rastros por pergunta (uma etapa cronometrada por fase do pipeline), logs JSON e métricas p50/p95/p99.
+#
+# Métricas locais (processo do Streamlit):  http://127.0.0.1:9464/metricas
+#                                           http://127.0.0.1:9464/metricas/prometheus
+# Na API (api.py) as mesmas métricas ficam em GET /metricas.
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+RASTRO_ATIVO = os.getenv("RASTRO", "1") != "0"
+# uma linha JSON por pergunta no logger "nathalia.rastros" (stderr)
+RASTRO_LOG = os.getenv("RASTRO_LOG", "1") != "0"
+# também acrescenta as linhas num arquivo .jsonl
+RASTRO_ARQUIVO = os.getenv("RASTRO_ARQUIVO", "")
+# amostras mais recentes mantidas por métrica para os percentis
+METRICAS_JANELA = int(os.getenv("METRICAS_JANELA", "5000"))
+# 0 desliga o servidor local de métricas
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", "9464"))
+# limites dos baldes do histograma (ms)
+BALDES_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+_logger = logging.getLogger("nathalia.rastros")
+if RASTRO_LOG and not _logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+_ARQUIVO_LOCK = threading.Lock()
+
+
+# ================== MÉTRICAS ==================
+class RegistroMetricas:
+    """Histogramas (janela de amostras + baldes acumulados) e contadores do processo."""
+
+    def __init__(self, janela: int = METRICAS_JANELA):
+        self.janela = janela
+        self._amostras = {}  # nome -> deque de ms
+        self._baldes = {}  # nome -> [contagem por balde..., +Inf]
+        self._somas = {}  # nome -> (n, soma_ms)
+        self._contadores = {}
+        self._lock = threading.Lock()
+
+    def observar(self, nome: str, segundos: float):
+        ms = segundos * 1000
+        with self._lock:
+            if nome not in self._amostras:
+                self._amostras[nome] = deque(maxlen=self.janela)
+                self._baldes[nome] = [0] * (len(BALDES_MS) + 1)
+                self._somas[nome] = (0, 0.0)
+            self._amostras[nome].append(ms)
+            self._baldes[nome][int(np.searchsorted(BALDES_MS, ms))] += 1
+            n, soma = self._somas[nome]
+            self._somas[nome] = (n + 1, soma + ms)
+
+    def contar(self, nome: str, valor: float = 1):
+        with self._lock:
+            self._contadores[nome] = self._contadores.get(nome, 0) + valor
+
+    def resumo(self) -> dict:
+        """{"latencias": {nome: {n, media_ms, p50_ms, p95_ms, p99_ms, baldes}}, "contadores": {...}}."""
+        with self._lock:
+            amostras = {nome: np.fromiter(d, dtype=np.float64) for nome, d in self._amostras.items()}
+            baldes = {nome: list(b) for nome, b in self._baldes.items()}
+            somas = dict(self._somas)
+            contadores = dict(self._contadores)
+        latencias = {}
+        for nome, ms in sorted(amostras.items()):
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            n, soma = somas[nome]
+            latencias[nome] = {
+                "n": n,
+                "media_ms": round(soma / n, 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "baldes": dict(zip([str(b) for b in BALDES_MS] + ["+Inf"], np.cumsum(baldes[nome]).tolist())),
+            }
+        return {"latencias": latencias, "contadores": contadores}
+
+    def prometheus(self) -> str:
+        """Formato de exposição do Prometheus (histogramas em segundos + contadores)."""
+        resumo = self.resumo()
+        linhas = []
+        for nome, dados in resumo["latencias"].items():
+            metrica = "nathalia_" + nome.replace(".", "_") + "_segundos"
+            linhas.append(f"# TYPE {metrica} histogram")
+            for limite, acumulado in dados["baldes"].items():
+                le = limite if limite == "+Inf" else f"{int(limite) / 1000:g}"
+                linhas.append(f'{metrica}_bucket{{le="{le}"}} {acumulado}')
+            linhas.append(f"{metrica}_sum {dados['media_ms'] * dados['n'] / 1000:.6f}")
+            linhas.append(f"{metrica}_count {dados['n']}")
+        for nome, valor in sorted(resumo["contadores"].items()):
+            metrica = "nathalia_" + nome.replace(".", "_") + "_total"
+            linhas += [f"# TYPE {metrica} counter", f"{metrica} {valor:g}"]
+        return "\n".join(linhas) + "\n"
+
+
+_METRICAS = RegistroMetricas()
+
+
+def obter_metricas() -> RegistroMetricas:
+    return _METRICAS
+
+
+# ================== RASTROS ==================
+class Rastro:
+    """
+    Rastro de uma pergunta: etapas cronometradas (com atributos) + atributos gerais
+    (tema, cache, tokens...). Passado explicitamente entre threads (vai no estado do pipeline).
+    """
+
+    def __init__(self, nome: str, **atributos):
+        self.id = uuid.uuid4().hex[:16]
+        self.nome = nome
+        self.criado_em = time.time()
+        self.inicio = time.perf_counter()
+        self.atributos = dict(atributos)
+        self.etapas = {}  # nome -> segundos (somados se a etapa se repete)
+        self.spans = []
+        self.finalizado = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def etapa(self, nome: str, **atributos):
+        """Cronometra o bloco; atributos podem ser acrescentados no dict devolvido."""
+        t0 = time.perf_counter()
+        try:
+            yield atributos
+        except Exception as e:
+            atributos["erro"] = type(e).__name__
+            raise
+        finally:
+            self.registrar(nome, time.perf_counter() - t0, inicio=t0, **atributos)
+
+    def registrar(self, nome: str, segundos: float, inicio: float = None, **atributos):
+        """Etapa medida por fora (ex.: re-ranqueamento dentro da recuperação)."""
+        inicio = time.perf_counter() - segundos if inicio is None else inicio
+        with self._lock:
+            self.etapas[nome] = self.etapas.get(nome, 0.0) + segundos
+            self.spans.append({
+                "etapa": nome,
+                "inicio_ms": round((inicio - self.inicio) * 1000, 2),
+                "duracao_ms": round(segundos * 1000, 2),
+                **atributos,
+            })
+
+    def descontar(self, nome: str, segundos: float):
+        """Tira de `nome` o tempo de uma etapa aninhada que foi registrada à parte."""
+        with self._lock:
+            if nome in self.etapas:
+                self.etapas[nome] -= segundos
+
+    def finalizar(self, **atributos) -> dict:
+        """Fecha o rastro: alimenta as métricas, escreve o log JSON e devolve o rastro como dict."""
+        self.finalizado = True
+        self.atributos.update(atributos)
+        total = time.perf_counter() - self.inicio
+        dados = {
+            "rastro": self.id,
+            "nome": self.nome,
+            "em": round(self.criado_em, 3),
+            "total_ms": round(total * 1000, 2),
+            **self.atributos,
+            "etapas": sorted(self.spans, key=lambda s: s["inicio_ms"]),
+        }
+        if not RASTRO_ATIVO:
+            return dados
+
+        metricas = obter_metricas()
+        metricas.observar(f"{self.nome}.total", total)
+        for nome, segundos in self.etapas.items():
+            metricas.observar(f"{self.nome}.{nome}", segundos)
+        metricas.contar(f"{self.nome}.quantidade")
+        for chave, valor in self.atributos.items():
+            if isinstance(valor, bool):
+                metricas.contar(f"{self.nome}.{chave}", int(valor))
+            elif chave.startswith("tokens") and isinstance(valor, (int, float)):
+                metricas.contar(f"{self.nome}.{chave}", valor)
+
+        linha = json.dumps(dados, ensure_ascii=False, default=str)
+        if RASTRO_LOG:
+            _logger.info(linha)
+        if RASTRO_ARQUIVO:
+            with _ARQUIVO_LOCK, open(RASTRO_ARQUIVO, "a", encoding="utf-8") as f:
+                f.write(linha + "\n")
+        return dados
+
+
+def registrar_falha(rastro: Rastro, erro: Exception) -> dict:
+    """Fecha o rastro de uma pergunta que falhou (conta em `<nome>.falha`), se ainda aberto."""
+    if rastro.finalizado:
+        return None
+    return rastro.finalizar(falha=True, erro=type(erro).__name__, detalhe_erro=str(erro)[:300])
+
+
+# ================== SERVIDOR LOCAL ==================
+class _Manipulador(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metricas":
+            corpo, tipo = json.dumps(obter_metricas().resumo(), ensure_ascii=False), "application/json"
+        elif self.path.rstrip("/") == "/metricas/prometheus":
+            corpo, tipo = obter_metricas().prometheus(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        dados = corpo.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, *args):
+        pass
+
+
+_SERVIDOR = None
+_SERVIDOR_LOCK = threading.Lock()
+
+
+def iniciar_servidor_metricas(porta: int = METRICAS_PORTA, host: str = "127.0.0.1"):
+    """Sobe (uma vez por processo) o endpoint local de métricas numa thread. None se desligado ou porta ocupada."""
+    global _SERVIDOR
+    if porta <= 0:
+        return None
+    with _SERVIDOR_LOCK:
+        if _SERVIDOR is None:
+            try:
+                _SERVIDOR = ThreadingHTTPServer((host, porta), _Manipulador)
+            except OSError as e:
+                print(f"⚠️ Servidor de métricas não iniciado em {host}:{porta} ({e}).")
+                return None
+            threading.Thread(target=_SERVIDOR.serve_forever, name="metricas", daemon=True).start()
+            print(f"📈 Métricas em http://{host}:{porta}/metricas")
+    return _SERVIDOR
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# recuperacao.py
+# Busca nas bases Chroma a partir de um vetor já calculado (sem re-embeddar a pergunta).
+import os
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from lexico import fundir_rrf
+from reranqueamento import RERANK_CANDIDATOS
+
+# candidatos de cada lado (vetorial e BM25) antes da fusão
+CANDIDATOS_HIBRIDO = int(os.getenv("BUSCA_HIBRIDA_CANDIDATOS", "20"))
+
+
+def buscar_por_vetor(store, vetor, k: int = 4, filtro: Optional[dict] = None):
+    """
+    Busca os k vizinhos mais próximos de `vetor` na base.
+    Retorna [(Document, distancia)] — menor distância = mais parecido.
+    Os documentos voltam com `id` preenchido (id do chunk no Chroma).
+    """
+    resultados = store._collection.query(
+        query_embeddings=[[float(x) for x in vetor]],
+        n_results=k,
+        where=filtro,
+        include=["documents", "metadatas", "distances"],
+    )
+    saida = []
+    for doc_id, texto, meta, dist in zip(
+        resultados["ids"][0],
+        resultados["documents"][0],
+        resultados["metadatas"][0],
+        resultados["distances"][0],
+    ):
+        saida.append((Document(id=doc_id, page_content=texto or "", metadata=meta or {}), dist))
+    return saida
+
+
+def documentos_por_id(store, ids) -> dict:
+    """{id: Document} com texto e metadados lidos do Chroma."""
+    if not ids:
+        return {}
+    lidos = store._collection.get(ids=list(ids), include=["documents", "metadatas"])
+    return {
+        doc_id: Document(id=doc_id, page_content=texto or "", metadata=meta or {})
+        for doc_id, texto, meta in zip(lidos["ids"], lidos["documents"], lidos["metadatas"])
+    }
+
+
+def buscar_vizinhos(store, vetor, k: int = 4, indice_vetorial=None):
+    """
+    Como `buscar_por_vetor`, mas com um backend de indices_vetoriais.py quando informado
+    (a busca roda no backend; o Chroma só devolve o texto dos k IDs).
+    """
+    if indice_vetorial is None:
+        return buscar_por_vetor(store, vetor, k=k)
+    vizinhos = indice_vetorial.buscar(vetor, k=k)
+    documentos = documentos_por_id(store, [id_ for id_, _ in vizinhos])
+    return [(documentos[id_], dist) for id_, dist in vizinhos if id_ in documentos]
+
+
+def buscar_hibrido(store, vetor, consulta: str, indice_lexico, k: int = 4, candidatos: int = CANDIDATOS_HIBRIDO,
+                   indice_vetorial=None):
+    """
+    Vetorial + BM25 fundidos por reciprocal rank fusion.
+    Retorna [(Document, pontuacao_rrf)] — maior = mais relevante.
+    """
+    densos = buscar_vizinhos(store, vetor, k=candidatos, indice_vetorial=indice_vetorial)
+    lexicos = indice_lexico.buscar(consulta, k=candidatos)
+    ordem = fundir_rrf([doc.id for doc, _ in densos], [id_ for id_, _ in lexicos])[:k]
+    documentos = {doc.id: doc for doc, _ in densos}
+    # trechos achados só pelo BM25: busca texto e metadados no Chroma
+    documentos.update(documentos_por_id(store, [id_ for id_, _ in ordem if id_ not in documentos]))
+    return [(documentos[id_], pontos) for id_, pontos in ordem if id_ in documentos]
+
+
+class RetrieverPorVetor(BaseRetriever):
+    """
+    Retriever que reaproveita o vetor da pergunta original.
+    Só calcula um novo embedding quando a cadeia pede outra consulta
+    (ex.: pergunta reescrita a partir do histórico).
+    Com `indice_lexico`, a busca é híbrida (vetorial + BM25); com `indice_vetorial`,
+    os vizinhos vêm de um backend de indices_vetoriais.py em vez do Chroma.
+    Com `reranqueador`, busca `candidatos` trechos e o cross-encoder escolhe os k.
+    Sem `vetor`, toda consulta é vetorizada aqui (uso como retriever comum).
+    """
+
+    store: Any
+    pergunta: str = ""
+    vetor: Optional[List[float]] = None
+    k: int = 4
+    indice_lexico: Any = None
+    indice_vetorial: Any = None
+    reranqueador: Any = None
+    candidatos: int = RERANK_CANDIDATOS
+    # últimos chunks devolvidos (usados pelo cache de respostas)
+    ultimos_documentos: List[Document] = []
+    # relatório do último re-ranqueamento (latência, candidatos, duplicatas)
+    ultimo_rerank: dict = {}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.vetor is not None and (query or "").strip() == self.pergunta.strip():
+            vetor = self.vetor
+        else:
+            vetor = self.store.embeddings.embed_query(query)
+        n = max(self.k, self.candidatos) if self.reranqueador is not None else self.k
+        if self.indice_lexico is not None:
+            resultados = buscar_hibrido(
+                self.store, vetor, query, self.indice_lexico, k=n,
+                candidatos=max(CANDIDATOS_HIBRIDO, n), indice_vetorial=self.indice_vetorial,
+            )
+        else:
+            resultados = buscar_vizinhos(self.store, vetor, k=n, indice_vetorial=self.indice_vetorial)
+        documentos = [doc for doc, _ in resultados]
+        if self.reranqueador is not None:
+            documentos, self.ultimo_rerank = self.reranqueador.reranquear(query, documentos, k=self.k)
+        self.ultimos_documentos = documentos
+        return self.ultimos_documentos
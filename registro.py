@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# registro.py
+# Registro único (por processo) do modelo de embeddings e das bases Chroma de cada tema.
+import hashlib
+import os
+import threading
+import time
+
+from langchain_community.vectorstores import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from cache_embeddings import com_cache
+
+CAMINHO_DATA = "data"
+ARQUIVO_INGESTAO = ".ingestao"
+MODELO_EMBEDDINGS = "sentence-transformers/all-MiniLM-L6-v2"
+
+TEMAS_DISPONIVEIS = [
+    "machine_learning",
+    "estatistica_basica",
+    "inteligencia_artificial",
+    "SQL",
+    "programacao_python",
+    "financas_credito",
+    "negocios_geral",
+    "mysql_escola",
+    "global",
+]
+
+
+def assinatura_pasta(pasta: str):
+    """
+    Assinatura barata do conteúdo de uma pasta vetorial: (nome, mtime, tamanho)
+    das entradas do primeiro nível. Muda quando a base é recriada ou re-ingerida.
+    """
+    try:
+        with os.scandir(pasta) as entradas:
+            itens = []
+            for e in entradas:
+                st_ = e.stat()
+                itens.append((e.name, st_.st_mtime_ns, st_.st_size if e.is_file() else 0))
+    except FileNotFoundError:
+        return None
+    return tuple(sorted(itens))
+
+
+def marcar_ingestao(pasta: str) -> str:
+    """Grava a versão (timestamp) da última ingestão do tema. Chamado pelos scripts de ingestão."""
+    versao = str(time.time_ns())
+    with open(os.path.join(pasta, ARQUIVO_INGESTAO), "w", encoding="utf-8") as f:
+        f.write(versao)
+    return versao
+
+
+def versao_pasta(pasta: str):
+    """
+    Versão dos dados de uma pasta vetorial. Usa a marca gravada na ingestão; para bases
+    antigas cai para (nome, tamanho) dos arquivos — o Chroma toca o mtime só de abrir.
+    """
+    try:
+        with open(os.path.join(pasta, ARQUIVO_INGESTAO), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    assinatura = assinatura_pasta(pasta)
+    if assinatura is None:
+        return None
+    return hashlib.sha1(repr([(nome, tam) for nome, _, tam in assinatura]).encode()).hexdigest()
+
+
+class RegistroVetorial:
+    """
+    Mantém UM modelo de embeddings e UMA conexão Chroma por pasta `data/<tema>`.
+    A base de um tema só é reaberta quando a assinatura da pasta muda no disco.
+    """
+
+    def __init__(self, caminho_data: str = CAMINHO_DATA, modelo: str = MODELO_EMBEDDINGS):
+        self.caminho_data = caminho_data
+        self.modelo = modelo
+        self._embeddings = None
+        self._stores = {}  # tema -> (assinatura, Chroma)
+        self._lock = threading.RLock()
+        # abertura de base por tema: um tema lento não trava os demais
+        self._locks_tema = {}
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    # perguntas repetidas não passam de novo pelo modelo
+                    self._embeddings = com_cache(HuggingFaceEmbeddings(model_name=self.modelo), self.modelo)
+        return self._embeddings
+
+    def pasta_tema(self, tema: str) -> str:
+        return os.path.join(self.caminho_data, tema)
+
+    def versao_tema(self, tema: str):
+        return versao_pasta(self.pasta_tema(tema))
+
+    def obter_store(self, tema: str):
+        """Retorna a base Chroma do tema (ou None se a pasta não existe)."""
+        pasta = self.pasta_tema(tema)
+        assinatura = assinatura_pasta(pasta)
+        if assinatura is None:
+            with self._lock:
+                self._stores.pop(tema, None)
+            return None
+
+        atual = self._stores.get(tema)
+        if atual and atual[0] == assinatura:
+            return atual[1]
+
+        with self._lock:
+            lock_tema = self._locks_tema.setdefault(tema, threading.Lock())
+        with lock_tema:
+            atual = self._stores.get(tema)
+            if atual and atual[0] == assinatura:
+                return atual[1]
+            db = Chroma(persist_directory=pasta, embedding_function=self.embeddings)
+            # a abertura pode criar/tocar arquivos: registra a assinatura pós-abertura
+            self._stores[tema] = (assinatura_pasta(pasta), db)
+            return db
+
+    def aquecer(self, temas=None):
+        """Carrega o modelo e abre todas as bases existentes (chamar na inicialização)."""
+        self.embeddings.embed_query("aquecimento")
+        for tema in temas or TEMAS_DISPONIVEIS:
+            try:
+                self.obter_store(tema)
+            except Exception as e:
+                print(f"⚠️ Não foi possível abrir a base do tema '{tema}': {e}")
+        return self
+
+
+_REGISTRO = None
+_REGISTRO_LOCK = threading.Lock()
+
+
+def obter_registro() -> RegistroVetorial:
+    """Registro compartilhado pelo processo inteiro (roteamento e recuperação)."""
+    global _REGISTRO
+    if _REGISTRO is None:
+        with _REGISTRO_LOCK:
+            if _REGISTRO is None:
+                _REGISTRO = RegistroVetorial()
+    return _REGISTRO
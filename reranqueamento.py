@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# reranqueamento.py
+# Re-ranqueamento dos candidatos da busca com um cross-encoder local (pergunta, trecho) -> relevância.
+import os
+import threading
+import time
+
+from lexico import tokenizar
+from rastreamento import obter_metricas
+
+# desligado por padrão: é um segundo modelo na memória e ~RERANK_LIMITE_MS de CPU por pergunta
+RERANK_ATIVO = os.getenv("RERANK", "0") != "0"
+# multilíngue (perguntas em português, livros em português e inglês)
+MODELO_RERANK = os.getenv("RERANK_MODELO", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# candidatos buscados antes do re-ranqueamento (o prompt continua recebendo só k)
+RERANK_CANDIDATOS = int(os.getenv("RERANK_CANDIDATOS", "30"))
+# orçamento por consulta: acima dele, menos candidatos são pontuados
+RERANK_LIMITE_MS = float(os.getenv("RERANK_LIMITE_MS", "300"))
+RERANK_MAX_TOKENS = int(os.getenv("RERANK_MAX_TOKENS", "256"))
+RERANK_LOTE = 32
+# fração dos 5-gramas de um trecho já presentes em outro mantido -> quase duplicata
+RERANK_DUPLICATA = float(os.getenv("RERANK_DUPLICATA", "0.6"))
+TAMANHO_SHINGLE = 5
+
+
+# ================== QUASE DUPLICATAS ==================
+def _shingles(texto: str) -> set:
+    tokens = tokenizar(texto)
+    if len(tokens) < TAMANHO_SHINGLE:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + TAMANHO_SHINGLE]) for i in range(len(tokens) - TAMANHO_SHINGLE + 1)}
+
+
+def remover_quase_duplicatas(documentos, limiar: float = RERANK_DUPLICATA):
+    """
+    Mantém a ordem e descarta o trecho cujo conjunto de 5-gramas está contido (>= `limiar`)
+    em outro já mantido ou o contém — mesmo texto em PDFs diferentes, páginas repetidas,
+    trechos quase inteiros dentro do vizinho. Retorna (mantidos, n_removidos).
+    """
+    mantidos, vistos = [], []
+    for doc in documentos:
+        atual = _shingles(doc.page_content)
+        duplicado = any(
+            len(atual & outro) >= limiar * min(len(atual), len(outro))
+            for outro in vistos
+            if atual and outro
+        )
+        if not duplicado:
+            mantidos.append(doc)
+            vistos.append(atual)
+    return mantidos, len(documentos) - len(mantidos)
+
+
+# ================== CROSS-ENCODER ==================
+class Reranqueador:
+    """
+    Pontua (pergunta, trecho) num único lote e devolve os k melhores.
+    A latência é limitada por `limite_ms`: com a média móvel do custo por par, só os
+    primeiros candidatos (na ordem da busca) que cabem no orçamento são pontuados;
+    os demais ficam depois deles, na ordem original.
+    """
+
+    def __init__(self, modelo: str = MODELO_RERANK, limite_ms: float = RERANK_LIMITE_MS,
+                 max_tokens: int = RERANK_MAX_TOKENS):
+        self.nome_modelo = modelo
+        self.limite_ms = limite_ms
+        self.max_tokens = max_tokens
+        self._modelo = None
+        self._ms_por_par = None
+        self._lock = threading.Lock()
+
+    @property
+    def modelo(self):
+        if self._modelo is None:
+            with self._lock:
+                if self._modelo is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._modelo = CrossEncoder(self.nome_modelo, max_length=self.max_tokens, device="cpu")
+        return self._modelo
+
+    def aquecer(self):
+        """Carrega o modelo e mede o custo por par (trechos longos), limitando já a 1ª consulta."""
+        modelo = self.modelo
+        modelo.predict([("aquecimento", "aquecimento")], show_progress_bar=False)
+        pares = [("pergunta de aquecimento " * 4, "trecho de aquecimento " * 120)] * 8
+        t0 = time.perf_counter()
+        modelo.predict(pares, batch_size=RERANK_LOTE, show_progress_bar=False)
+        self._ms_por_par = (time.perf_counter() - t0) * 1000 / len(pares)
+        return self
+
+    def _quantos_cabem(self, n: int, k: int) -> int:
+        if self._ms_por_par is None or self.limite_ms <= 0:
+            return n
+        return min(n, max(k, int(self.limite_ms / self._ms_por_par)))
+
+    def reranquear(self, pergunta: str, documentos, k: int = 4):
+        """(k melhores documentos, relatório {candidatos, duplicatas, pontuados, ms})."""
+        modelo = self.modelo
+        t0 = time.perf_counter()
+        unicos, duplicatas = remover_quase_duplicatas(documentos)
+        n = self._quantos_cabem(len(unicos), k)
+        pontuados, restantes = unicos[:n], unicos[n:]
+        if pontuados:
+            scores = modelo.predict(
+                [(pergunta, d.page_content) for d in pontuados], batch_size=RERANK_LOTE, show_progress_bar=False
+            )
+            ordem = sorted(range(len(pontuados)), key=lambda i: float(scores[i]), reverse=True)
+            pontuados = [pontuados[i] for i in ordem]
+        ms = (time.perf_counter() - t0) * 1000
+        if pontuados:
+            por_par = ms / len(pontuados)
+            self._ms_por_par = por_par if self._ms_por_par is None else 0.8 * self._ms_por_par + 0.2 * por_par
+        relatorio = {
+            "candidatos": len(documentos),
+            "duplicatas": duplicatas,
+            "pontuados": len(pontuados),
+            "ms": round(ms, 1),
+            "limite_ms": self.limite_ms,
+        }
+        # sem print por consulta: o relatório vai para o rastro (etapa "rerank") e as métricas
+        obter_metricas().observar("rerank.consulta", ms / 1000)
+        if duplicatas:
+            obter_metricas().contar("rerank.duplicatas", duplicatas)
+        return (pontuados + restantes)[:k], relatorio
+
+
+_RERANQUEADOR = None
+_RERANQUEADOR_LOCK = threading.Lock()
+_INDISPONIVEL = False
+
+
+def obter_reranqueador():
+    """Cross-encoder compartilhado pelo processo, ou None (RERANK desligado ou sentence-transformers ausente)."""
+    global _RERANQUEADOR, _INDISPONIVEL
+    if not RERANK_ATIVO or _INDISPONIVEL:
+        return None
+    if _RERANQUEADOR is None:
+        with _RERANQUEADOR_LOCK:
+            if _RERANQUEADOR is None:
+                try:
+                    _RERANQUEADOR = Reranqueador().aquecer()
+                except Exception as e:
+                    print(f"⚠️ Re-ranqueamento indisponível ({e}); usando a ordem da busca.")
+                    _INDISPONIVEL = True
+                    return None
+    return _RERANQUEADOR
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# roteamento.py
+# Escolha do tema (base vetorial) mais adequado para a pergunta.
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from rastreamento import obter_metricas
+from recuperacao import buscar_por_vetor
+from registro import TEMAS_DISPONIVEIS, obter_registro
+
+# "centroides": produto matriz-vetor contra protótipos pré-calculados (com fallback)
+# "exaustivo": busca k=1 em todas as bases (comportamento original)
+MODO_ROTEAMENTO = os.getenv("ROTEAMENTO_MODO", "centroides")
+# diferença mínima de similaridade entre 1º e 2º tema para confiar nos centroides
+MARGEM_ROTEAMENTO = float(os.getenv("ROTEAMENTO_MARGEM", "0.05"))
+# sondas da busca exaustiva em paralelo, cada tema com seu tempo limite (segundos)
+ROTEAMENTO_PARALELO = os.getenv("ROTEAMENTO_PARALELO", "1") != "0"
+TIMEOUT_SONDA = float(os.getenv("ROTEAMENTO_TIMEOUT", "2.0"))
+
+ARQUIVO_PROTOTIPOS = "prototipos.npy"
+N_PROTOTIPOS = 8
+MAX_VETORES_PROTOTIPOS = 20000
+LOTE_LEITURA = 5000
+
+
+# ================== PROTÓTIPOS (ingestão) ==================
+def _normalizar(matriz):
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def calcular_prototipos(vetores, n_prototipos: int = N_PROTOTIPOS, iteracoes: int = 20, semente: int = 0):
+    """
+    K-means esférico (similaridade de cosseno) sobre os embeddings de um tema.
+    Retorna uma matriz float32 (n_prototipos x dim) com linhas normalizadas.
+    """
+    x = _normalizar(vetores)
+    if len(x) == 0:
+        return x
+    n = min(n_prototipos, len(x))
+    rng = np.random.default_rng(semente)
+    centros = x[rng.choice(len(x), size=n, replace=False)]
+
+    for _ in range(iteracoes):
+        grupos = np.argmax(x @ centros.T, axis=1)
+        novos = centros.copy()
+        for c in range(n):
+            membros = x[grupos == c]
+            if len(membros):
+                novos[c] = membros.mean(axis=0)
+        novos = _normalizar(novos)
+        if np.allclose(novos, centros, atol=1e-5):
+            centros = novos
+            break
+        centros = novos
+
+    return centros.astype(np.float32)
+
+
+def ler_embeddings(store, limite: int = MAX_VETORES_PROTOTIPOS, semente: int = 0):
+    """Lê (em lotes) os embeddings de uma base Chroma, amostrando até `limite` vetores."""
+    total = store._collection.count()
+    if total == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    offsets = range(0, total, LOTE_LEITURA)
+    if total > limite:
+        # amostra lotes inteiros para não varrer a base toda
+        rng = np.random.default_rng(semente)
+        n_lotes = max(1, limite // LOTE_LEITURA)
+        offsets = sorted(rng.choice(list(offsets), size=min(n_lotes, len(offsets)), replace=False))
+
+    partes = []
+    for offset in offsets:
+        lote = store.get(limit=LOTE_LEITURA, offset=int(offset), include=["embeddings"])
+        if len(lote["embeddings"]):
+            partes.append(np.asarray(lote["embeddings"], dtype=np.float32))
+    return np.vstack(partes) if partes else np.zeros((0, 0), dtype=np.float32)
+
+
+def salvar_prototipos(store, pasta_data_tema: str, n_prototipos: int = N_PROTOTIPOS):
+    """Calcula e grava `prototipos.npy` do tema (chamado ao final da ingestão)."""
+    vetores = ler_embeddings(store)
+    if len(vetores) == 0:
+        print(f"⚠️ Sem embeddings em {pasta_data_tema}; protótipos não gerados.")
+        return None
+    prototipos = calcular_prototipos(vetores, n_prototipos=n_prototipos)
+    np.save(os.path.join(pasta_data_tema, ARQUIVO_PROTOTIPOS), prototipos)
+    print(f"🧭 Protótipos de roteamento salvos: {prototipos.shape[0]} em {pasta_data_tema}")
+    return prototipos
+
+
+# ================== ÍNDICE DE ROTEAMENTO ==================
+class IndiceRoteamento:
+    """
+    Junta os protótipos de todos os temas numa única matriz.
+    Recarrega sozinho quando algum `prototipos.npy` muda no disco.
+    """
+
+    def __init__(self, registro=None, temas=None):
+        self.registro = registro or obter_registro()
+        self.temas = list(temas or TEMAS_DISPONIVEIS)
+        self._assinatura = None
+        self._matriz = np.zeros((0, 0), dtype=np.float32)
+        self._rotulos = np.zeros(0, dtype=np.int64)
+        self._temas_indexados = []
+        self._lock = threading.Lock()
+
+    def _arquivo(self, tema):
+        return os.path.join(self.registro.pasta_tema(tema), ARQUIVO_PROTOTIPOS)
+
+    def _assinatura_atual(self):
+        assinatura = []
+        for tema in self.temas:
+            try:
+                assinatura.append((tema, os.stat(self._arquivo(tema)).st_mtime_ns))
+            except FileNotFoundError:
+                continue
+        return tuple(assinatura)
+
+    def _carregar(self):
+        assinatura = self._assinatura_atual()
+        if assinatura == self._assinatura:
+            return
+        with self._lock:
+            if assinatura == self._assinatura:
+                return
+            blocos, rotulos, temas = [], [], []
+            for tema, _ in assinatura:
+                try:
+                    p = np.load(self._arquivo(tema))
+                except Exception as e:
+                    print(f"⚠️ Protótipos inválidos para '{tema}': {e}")
+                    continue
+                if p.ndim != 2 or not len(p):
+                    continue
+                blocos.append(p.astype(np.float32))
+                rotulos.append(np.full(len(p), len(temas)))
+                temas.append(tema)
+            if blocos:
+                self._matriz = _normalizar(np.vstack(blocos))
+                self._rotulos = np.concatenate(rotulos)
+            else:
+                self._matriz = np.zeros((0, 0), dtype=np.float32)
+                self._rotulos = np.zeros(0, dtype=np.int64)
+            self._temas_indexados = temas
+            self._assinatura = assinatura
+
+    @property
+    def temas_indexados(self):
+        self._carregar()
+        return list(self._temas_indexados)
+
+    def pontuar(self, vetor) -> dict:
+        """Similaridade (cosseno) do vetor com o melhor protótipo de cada tema indexado."""
+        self._carregar()
+        if not len(self._matriz):
+            return {}
+        sims = self._matriz @ _normalizar(vetor)
+        melhores = np.full(len(self._temas_indexados), -np.inf, dtype=np.float32)
+        np.maximum.at(melhores, self._rotulos, sims)
+        return {tema: float(s) for tema, s in zip(self._temas_indexados, melhores)}
+
+
+_INDICE = None
+_INDICE_LOCK = threading.Lock()
+
+
+def obter_indice_roteamento() -> IndiceRoteamento:
+    global _INDICE
+    if _INDICE is None:
+        with _INDICE_LOCK:
+            if _INDICE is None:
+                _INDICE = IndiceRoteamento()
+    return _INDICE
+
+
+# ================== ROTEAMENTO ==================
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+# tema -> sonda que excedeu o tempo e ainda ocupa uma thread do pool
+_SONDAS_PENDENTES = {}
+
+
+def _executor_sondas() -> ThreadPoolExecutor:
+    """Pool compartilhado pelo processo; folga para sondas lentas que ainda não terminaram."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(
+                    max_workers=2 * len(TEMAS_DISPONIVEIS), thread_name_prefix="sonda-tema"
+                )
+    return _EXECUTOR
+
+
+def _sondar_tema(registro, tema, vetor):
+    """Distância do chunk mais próximo no tema (None se a base não existe, está vazia ou falhou)."""
+    try:
+        db = registro.obter_store(tema)
+        if db is None:
+            return None
+
+        # com INDICE_VETORIAL configurado a sonda usa o mesmo backend (sem carregar o HNSW do Chroma)
+        from indices_vetoriais import obter_indice_vetorial
+
+        indice = obter_indice_vetorial(registro.pasta_tema(tema))
+        if indice is not None:
+            resultados = indice.buscar(vetor, k=1)
+        else:
+            resultados = buscar_por_vetor(db, vetor, k=1)
+
+        if not resultados:
+            return None
+
+        _, score = resultados[0]
+        return score
+
+    except Exception:
+        return None
+
+
+def identificar_tema_exaustivo(vetor, temas=None, paralelo: bool = None, timeout: float = TIMEOUT_SONDA):
+    """
+    Busca k=1 em cada base e escolhe a menor distância. Retorna (tema, distancia).
+    Em modo paralelo todas as bases são sondadas ao mesmo tempo; uma sonda que não
+    responde em `timeout` segundos é ignorada (segue rodando em segundo plano) e o tema
+    não é sondado de novo até ela terminar.
+    """
+    registro = obter_registro()
+    temas = list(temas or TEMAS_DISPONIVEIS)
+    paralelo = ROTEAMENTO_PARALELO if paralelo is None else paralelo
+
+    if paralelo and len(temas) > 1:
+        metricas = obter_metricas()
+        with _EXECUTOR_LOCK:
+            # sonda anterior do tema ainda travada: não ocupa outra thread (o pool esgotaria)
+            travados = [t for t in temas if t in _SONDAS_PENDENTES and not _SONDAS_PENDENTES[t].done()]
+            for tema in list(_SONDAS_PENDENTES):
+                if _SONDAS_PENDENTES[tema].done():
+                    del _SONDAS_PENDENTES[tema]
+        if travados:
+            print(f"⚠️ Temas com sonda anterior ainda pendente (ignorados): {', '.join(travados)}")
+            metricas.contar("roteamento.sondas_puladas", len(travados))
+        futuros = {
+            _executor_sondas().submit(_sondar_tema, registro, tema, vetor): tema
+            for tema in temas if tema not in travados
+        }
+        concluidos, pendentes = wait(futuros, timeout=timeout) if futuros else (set(), set())
+        with _EXECUTOR_LOCK:
+            for futuro in pendentes:
+                # cancel() não interrompe uma sonda já rodando: fica registrada até terminar
+                if not futuro.cancel():
+                    _SONDAS_PENDENTES[futuros[futuro]] = futuro
+        for futuro in pendentes:
+            print(f"⏱️ Sonda do tema '{futuros[futuro]}' excedeu {timeout:.1f}s; ignorada.")
+        if pendentes:
+            metricas.contar("roteamento.sondas_expiradas", len(pendentes))
+        scores = [(futuros[f], f.result()) for f in concluidos]
+    else:
+        scores = [(tema, _sondar_tema(registro, tema, vetor)) for tema in temas]
+
+    melhor_tema = "global"
+    melhor_score = float("inf")
+
+    # percorre na ordem de TEMAS_DISPONIVEIS para manter o desempate determinístico
+    ordem = {tema: i for i, tema in enumerate(temas)}
+    for tema, score in sorted(scores, key=lambda ts: ordem[ts[0]]):
+        if score is not None and score < melhor_score:
+            melhor_score = score
+            melhor_tema = tema
+
+    return melhor_tema, melhor_score
+
+
+def temas_sem_prototipos(indice=None, registro=None) -> list:
+    """Temas com base no disco mas fora do índice de protótipos (só eles forçam o desempate)."""
+    indexados = set((indice or obter_indice_roteamento()).temas_indexados)
+    registro = registro or obter_registro()
+    return [t for t in TEMAS_DISPONIVEIS if t not in indexados and registro.obter_store(t) is not None]
+
+
+def identificar_tema_centroides(vetor, margem: float = MARGEM_ROTEAMENTO):
+    """
+    Escolhe o tema com um único produto matriz-vetor contra os protótipos.
+    Quando o 1º e o 2º colocados estão a menos de `margem`, desempata com a busca
+    exaustiva apenas entre os candidatos próximos (e os temas sem protótipos).
+    """
+    indice = obter_indice_roteamento()
+    scores = indice.pontuar(vetor)
+    if not scores:
+        return identificar_tema_exaustivo(vetor)[0]
+
+    ordenados = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    melhor_tema, melhor_sim = ordenados[0]
+    segundo_sim = ordenados[1][1] if len(ordenados) > 1 else -np.inf
+    sem_prototipos = temas_sem_prototipos(indice)
+
+    if melhor_sim - segundo_sim >= margem and not sem_prototipos:
+        return melhor_tema
+
+    candidatos = [t for t, s in ordenados if melhor_sim - s < margem] + sem_prototipos
+    return identificar_tema_exaustivo(vetor, temas=candidatos)[0]
+
+
+def identificar_tema(pergunta, vetor=None, modo: str = None):
+    """
+    Retorna o tema mais adequado para a pergunta.
+    `vetor` é o embedding já calculado da pergunta; se não vier, é calculado aqui (1x).
+    """
+    pergunta = (pergunta or "").strip()
+    if not pergunta:
+        return "global"
+
+    if vetor is None:
+        vetor = obter_registro().embeddings.embed_query(pergunta)
+
+    if (modo or MODO_ROTEAMENTO) == "exaustivo":
+        return identificar_tema_exaustivo(vetor)[0]
+    return identificar_tema_centroides(vetor)
+
+
+# ================== CLI ==================
+def main():
+    """Regera `prototipos.npy` de todos os temas a partir das bases já existentes."""
+    registro = obter_registro()
+    temas = sys.argv[1:] or TEMAS_DISPONIVEIS
+    for tema in temas:
+        db = registro.obter_store(tema)
+        if db is None:
+            print(f"⚠️ Tema '{tema}' sem base em {registro.pasta_tema(tema)}. Pulando.")
+            continue
+        salvar_prototipos(db, registro.pasta_tema(tema))
+    print("\n🏁 Finalizado.")
+
+
+if __name__ == "__main__":
+    main()
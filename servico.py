@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# servico.py
+# Camada de serviço: perguntas atendidas num event loop próprio, com concorrência limitada.
+#
+# O script do Streamlit só envia a pergunta e acompanha o streaming; a espera pelo LLM
+# não prende a thread da sessão e as etapas de CPU (embedding, busca) rodam num pool.
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import responder_pergunta_async
+
+# perguntas em processamento ao mesmo tempo (as demais esperam na fila)
+SERVICO_MAX_CONCORRENTES = int(os.getenv("SERVICO_MAX_CONCORRENTES", "8"))
+# threads para embedding/roteamento/busca (o torch libera o GIL durante o forward)
+SERVICO_TRABALHADORES_CPU = int(os.getenv("SERVICO_TRABALHADORES_CPU", str(max(2, (os.cpu_count() or 2) // 2))))
+
+
+class Tarefa:
+    """Pergunta enviada ao serviço: texto parcial do streaming + resultado final."""
+
+    def __init__(self, futuro, parciais=None):
+        self._futuro = futuro
+        self._parciais = parciais
+
+    @property
+    def concluida(self) -> bool:
+        return self._futuro.done()
+
+    def acompanhar(self, intervalo: float = 0.05):
+        """
+        Gera o texto parcial mais recente até a resposta terminar (para a thread do Streamlit).
+        Tokens que chegam entre duas leituras são agrupados: a tela recebe só o último texto.
+        """
+        if self._parciais is None:
+            return
+        while True:
+            ultimo = None
+            try:
+                ultimo = self._parciais.get(timeout=intervalo)
+                while True:
+                    ultimo = self._parciais.get_nowait()
+            except queue.Empty:
+                pass
+            if ultimo is not None:
+                yield ultimo
+            elif self._futuro.done():
+                return
+
+    def resultado(self, timeout: float = None) -> dict:
+        return self._futuro.result(timeout)
+
+
+class ServicoPerguntas:
+    """
+    Event loop dedicado (uma thread) + pool de CPU + semáforo de concorrência.
+    Compartilhado por todas as sessões do processo.
+    """
+
+    def __init__(self, max_concorrentes: int = SERVICO_MAX_CONCORRENTES,
+                 trabalhadores_cpu: int = SERVICO_TRABALHADORES_CPU):
+        self.max_concorrentes = max_concorrentes
+        self.executor = ThreadPoolExecutor(max_workers=trabalhadores_cpu, thread_name_prefix="servico-cpu")
+        self._loop = asyncio.new_event_loop()
+        self._semaforo = asyncio.Semaphore(max_concorrentes)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="servico-perguntas", daemon=True)
+        self._thread.start()
+        # alterados só dentro do loop
+        self.em_andamento = 0
+        self.na_fila = 0
+        self.atendidas = 0
+
+    async def _executar(self, pergunta: str, memoria, estrategia: str = None, ao_token=None) -> dict:
+        chegada = time.perf_counter()
+        self.na_fila += 1
+        async with self._semaforo:
+            espera = time.perf_counter() - chegada
+            self.na_fila -= 1
+            self.em_andamento += 1
+            try:
+                resultado = await responder_pergunta_async(
+                    pergunta, memoria, ao_token=ao_token, estrategia=estrategia, executor=self.executor
+                )
+            finally:
+                self.em_andamento -= 1
+                self.atendidas += 1
+        resultado.setdefault("metricas", {})["fila_s"] = round(espera, 4)
+        return resultado
+
+    def enviar(self, pergunta: str, memoria, estrategia: str = None, streaming: bool = True) -> Tarefa:
+        """Agenda a pergunta e retorna na hora; use `Tarefa.acompanhar()` e `Tarefa.resultado()`."""
+        parciais = queue.SimpleQueue() if streaming else None
+        futuro = asyncio.run_coroutine_threadsafe(
+            self._executar(pergunta, memoria, estrategia, parciais.put if parciais else None), self._loop
+        )
+        return Tarefa(futuro, parciais)
+
+    async def responder(self, pergunta: str, memoria, estrategia: str = None, ao_token=None) -> dict:
+        """Para quem já está em outro event loop (ex.: uma API ASGI): aguarda sem bloquear o loop de quem chama."""
+        futuro = asyncio.run_coroutine_threadsafe(self._executar(pergunta, memoria, estrategia, ao_token), self._loop)
+        return await asyncio.wrap_future(futuro)
+
+    def estatisticas(self) -> dict:
+        return {
+            "em_andamento": self.em_andamento,
+            "na_fila": self.na_fila,
+            "atendidas": self.atendidas,
+            "max_concorrentes": self.max_concorrentes,
+        }
+
+    def fechar(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
+
+
+_SERVICO = None
+_SERVICO_LOCK = threading.Lock()
+
+
+def obter_servico() -> ServicoPerguntas:
+    """Serviço compartilhado pelo processo (todas as sessões do Streamlit)."""
+    global _SERVICO
+    if _SERVICO is None:
+        with _SERVICO_LOCK:
+            if _SERVICO is None:
+                _SERVICO = ServicoPerguntas()
+    return _SERVICO
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# Os módulos do projeto ficam na raiz (sem pacote).
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+os.environ.setdefault("CACHE_EMBEDDINGS", "0")
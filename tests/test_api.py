@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# API HTTP contra o LLM falso: resposta, streaming SSE, lote, autenticação e sessões.
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import api
+import modelos
+import pipeline
+import registro
+import servico
+from modelos import LLMFalso
+
+TRECHOS = [
+    "Regressão logística estima a probabilidade de um evento binário.",
+    "Um JOIN combina linhas de duas tabelas a partir de uma coluna em comum.",
+    "A mediana é menos sensível a outliers do que a média.",
+]
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    reg = registro.RegistroVetorial(caminho_data=str(tmp_path))
+    reg._embeddings = DeterministicFakeEmbedding(size=32)
+    Chroma(persist_directory=reg.pasta_tema("global"), embedding_function=reg.embeddings).add_texts(TRECHOS)
+    monkeypatch.setattr(registro, "_REGISTRO", reg)
+    monkeypatch.setattr(servico, "_SERVICO", None)
+    monkeypatch.setattr(modelos, "PROVEDOR_LLM", "fake")
+    monkeypatch.setattr(pipeline, "obter_cache", lambda: None)
+    monkeypatch.setattr(pipeline, "identificar_tema", lambda busca, vetor=None: "global")
+    monkeypatch.setattr(api, "API_TOKEN", "")
+    monkeypatch.setattr(api, "_SESSOES", type(api._SESSOES)())
+    with TestClient(api.app) as c:
+        yield c
+
+
+def _eventos(corpo: str):
+    eventos = []
+    for bloco in corpo.strip().split("\n\n"):
+        linhas = dict(linha.split(": ", 1) for linha in bloco.splitlines())
+        eventos.append((linhas["event"], json.loads(linhas["data"])))
+    return eventos
+
+
+def test_perguntar(cliente):
+    r = cliente.post("/perguntar", json={"pergunta": "O que é regressão logística?", "sessao": "s1"})
+    assert r.status_code == 200
+    corpo = r.json()
+    assert corpo["resposta"] == LLMFalso().resposta
+    assert (corpo["tema"], corpo["cache"], corpo["sessao"]) == ("global", False, "s1")
+    assert "fila_s" in corpo["metricas"]
+
+
+def test_stream_sse(cliente):
+    r = cliente.post("/perguntar/stream", json={"pergunta": "O que é um JOIN?"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    eventos = _eventos(r.text)
+    tokens = [dados["texto"] for nome, dados in eventos if nome == "token"]
+    assert len(tokens) > 1
+    assert eventos[-1][0] == "fim"
+    assert "".join(tokens) == eventos[-1][1]["resposta"] == LLMFalso().resposta
+
+
+def test_lote(cliente):
+    perguntas = ["O que é mediana?", "O que é um JOIN?", "O que é regressão?"]
+    r = cliente.post("/perguntar/lote", json={"perguntas": perguntas})
+    assert r.status_code == 200
+    assert [s["resposta"] for s in r.json()["respostas"]] == [LLMFalso().resposta] * 3
+    assert cliente.post("/perguntar/lote", json={"perguntas": []}).status_code == 422
+
+
+def test_autenticacao(cliente, monkeypatch):
+    monkeypatch.setattr(api, "API_TOKEN", "segredo")
+    corpo = {"pergunta": "O que é mediana?"}
+    assert cliente.post("/perguntar", json=corpo).status_code == 401
+    assert cliente.post("/perguntar/stream", json=corpo, headers={"Authorization": "Bearer errado"}).status_code == 401
+    assert cliente.post("/perguntar/lote", json={"perguntas": ["x"]}).status_code == 401
+    assert cliente.post("/perguntar", json=corpo, headers={"Authorization": "Bearer segredo"}).status_code == 200
+    # rotas de observação continuam abertas
+    assert cliente.get("/saude").status_code == 200
+
+
+def test_mesma_sessao_uma_pergunta_por_vez(cliente, monkeypatch):
+    monkeypatch.setenv("LLM_FALSO_ATRASO_INICIAL", "0.1")
+    original = servico.responder_pergunta_async
+    ativas, maximo, lock = {}, {}, threading.Lock()
+
+    async def contar(pergunta, memoria, **opcoes):
+        with lock:
+            ativas[id(memoria)] = ativas.get(id(memoria), 0) + 1
+            maximo[id(memoria)] = max(maximo.get(id(memoria), 0), ativas[id(memoria)])
+        try:
+            return await original(pergunta, memoria, **opcoes)
+        finally:
+            with lock:
+                ativas[id(memoria)] -= 1
+
+    monkeypatch.setattr(servico, "responder_pergunta_async", contar)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(4) as pool:
+        respostas = list(pool.map(
+            lambda i: cliente.post("/perguntar", json={"pergunta": f"Pergunta {i}?", "sessao": "mesma"}), range(4)
+        ))
+    assert all(r.status_code == 200 for r in respostas)
+    assert list(maximo.values()) == [1]
+    assert time.perf_counter() - inicio >= 0.4
+    memoria, _ = api._SESSOES["mesma"]
+    assert len(memoria.load_memory_variables({})[memoria.memory_key]) == 8
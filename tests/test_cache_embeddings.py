@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Cache de embeddings: consulta só leitura, descarga de acessos/contadores e chave por modelo + normalização.
+import sqlite3
+import time
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import cache_embeddings
+from cache_embeddings import CacheEmbeddings
+
+
+def _acessos(cache):
+    with sqlite3.connect(cache.caminho_indice) as con:
+        return dict(con.execute("SELECT hash, acessado_em FROM vetores"))
+
+
+def test_consulta_nao_escreve_e_lru_usa_acessos_pendentes(tmp_path):
+    cache = CacheEmbeddings(str(tmp_path), max_entradas=2, descarga_s=3600)
+    cache.guardar("m", {"a": np.ones(4)})
+    time.sleep(0.01)
+    cache.guardar("m", {"b": np.full(4, 2.0)})
+    antes = _acessos(cache)
+
+    for _ in range(10):
+        encontrados = cache.buscar("m", ["a", "z"])
+    assert np.array_equal(encontrados["a"], np.ones(4, dtype=np.float32))
+    assert _acessos(cache) == antes
+
+    # "a" foi lido depois de "b": a gravação descarrega o acesso e o LRU despeja "b"
+    cache.guardar("m", {"c": np.zeros(4)})
+    assert sorted(_acessos(cache)) == ["a", "c"]
+
+
+def test_estatisticas_incluem_pendentes(tmp_path):
+    cache = CacheEmbeddings(str(tmp_path), descarga_s=3600)
+    cache.guardar("m", {"a": np.ones(4)})
+    cache.buscar("m", ["a", "a", "z"])
+    stats = cache.estatisticas()
+    assert (stats["acertos"], stats["faltas"], stats["taxa_acerto"]) == (2, 1, 0.6667)
+
+
+def test_chave_separa_vetores_normalizados(tmp_path, monkeypatch):
+    class Motor(DeterministicFakeEmbedding):
+        normalizar: bool = False
+
+        @property
+        def chave_cache(self):
+            return "minilm|normalizado" if self.normalizar else "minilm"
+
+        def embed_documents(self, texts):
+            vetores = super().embed_documents(texts)
+            return [list(np.asarray(v) / np.linalg.norm(v)) for v in vetores] if self.normalizar else vetores
+
+    monkeypatch.setattr(cache_embeddings, "obter_cache_embeddings", lambda: CacheEmbeddings(str(tmp_path)))
+    cru = cache_embeddings.com_cache(Motor(size=8), "minilm").embed_query("pergunta")
+    normalizado = cache_embeddings.com_cache(Motor(size=8, normalizar=True), "minilm").embed_query("pergunta")
+    assert np.isclose(np.linalg.norm(normalizado), 1.0, atol=1e-5)
+    assert not np.allclose(cru, normalizado)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Cache semântico: matriz do tema em memória, TTL/versão/LRU e gravações de outro processo.
+import numpy as np
+import pytest
+
+from cache_respostas import CacheSemantico
+
+
+def _vetor(*valores):
+    return np.array(valores, dtype=np.float32)
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / "respostas.sqlite3")
+
+
+def test_acerto_por_similaridade_e_versao(caminho):
+    cache = CacheSemantico(caminho, limiar=0.95)
+    cache.guardar("SQL", "v1", "O que é JOIN?", _vetor(1, 0, 0), ["c1"], "Junta tabelas.")
+    acerto = cache.buscar("SQL", _vetor(0.99, 0.05, 0), "v1")
+    assert acerto["resposta"] == "Junta tabelas." and acerto["chunk_ids"] == ["c1"]
+    assert cache.buscar("SQL", _vetor(0, 1, 0), "v1") is None
+    # base re-ingerida: a entrada da versão anterior não acerta mais
+    assert cache.buscar("SQL", _vetor(1, 0, 0), "v2") is None
+
+
+def test_busca_usa_matriz_em_memoria(caminho, monkeypatch):
+    cache = CacheSemantico(caminho)
+    cache.guardar("SQL", "v1", "p", _vetor(1, 0), [], "r")
+    cache.buscar("SQL", _vetor(1, 0), "v1")
+    monkeypatch.setattr(cache, "_carregar_tema", lambda *a: pytest.fail("matriz relida do SQLite"))
+    # a própria gravação atualiza a matriz em memória
+    cache.guardar("SQL", "v1", "p2", _vetor(0, 1), [], "r2")
+    assert cache.buscar("SQL", _vetor(0, 1), "v1")["resposta"] == "r2"
+    assert cache.buscar("SQL", _vetor(1, 0), "v1")["resposta"] == "r"
+
+
+def test_gravacao_de_outro_processo_recarrega_o_tema(caminho):
+    app, ingestao = CacheSemantico(caminho), CacheSemantico(caminho)
+    assert app.buscar("SQL", _vetor(1, 0), "v1") is None
+    ingestao.guardar("SQL", "v1", "p", _vetor(1, 0), [], "r")
+    assert app.buscar("SQL", _vetor(1, 0), "v1")["resposta"] == "r"
+
+
+def test_ttl_e_lru(caminho):
+    cache = CacheSemantico(caminho, ttl=-1)
+    cache.guardar("SQL", "v1", "p", _vetor(1, 0), [], "r")
+    assert cache.buscar("SQL", _vetor(1, 0), "v1") is None  # expirada não acerta
+
+    cache = CacheSemantico(caminho, max_entradas=1)
+    cache.guardar("SQL", "v1", "p1", _vetor(1, 0), [], "r1")
+    cache.guardar("SQL", "v1", "p2", _vetor(0, 1), [], "r2")
+    assert cache.buscar("SQL", _vetor(1, 0), "v1") is None
+    assert cache.estatisticas()["entradas"] == 1
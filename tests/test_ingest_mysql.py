@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Sincronização incremental da tabela de alunos (SQLite no lugar do MySQL, embeddings falsos).
+import pandas as pd
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from sqlalchemy import create_engine, text
+
+import ingest_mysql
+from motor_embeddings import EtapaEmbedding
+
+TABELA = "alunos"
+
+
+def _alunos(ids, atualizado_em=1, media=7.0):
+    return pd.DataFrame({
+        "id": ids,
+        "nome": [f"Aluno {i}" for i in ids],
+        "genero": "Feminino",
+        "curso": "Direito",
+        "modalidade": "EAD",
+        "media_final": media,
+        "reprovacoes": 0,
+        "faltas_pct": 5,
+        "bolsa": "Sim",
+        "trabalha": "Não",
+        "renda_familiar": "Sim",
+        "evadiu": "Não",
+        "atualizado_em": atualizado_em,
+    })
+
+
+@pytest.fixture
+def ambiente(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'escola.db'}")
+    _alunos(range(10)).to_sql(TABELA, engine, index=False)
+    pasta = str(tmp_path / "base")
+    db = ingest_mysql.abrir_base(pasta, DeterministicFakeEmbedding(size=16), TABELA)
+    etapas = []
+
+    def sincronizar(**opcoes):
+        etapa = EtapaEmbedding(db.embeddings, db)
+        etapas.append(etapa)
+        opcoes.setdefault("coluna", "atualizado_em")
+        opcoes.setdefault("incremental", True)
+        return ingest_mysql.sincronizar(engine, etapa, pasta, TABELA, "id", **opcoes)
+
+    yield engine, db, pasta, sincronizar
+    for etapa in etapas:
+        etapa.fechar()
+
+
+def _executar(engine, sql):
+    with engine.begin() as conexao:
+        conexao.execute(text(sql))
+
+
+def test_primeira_sincronizacao_grava_todas_as_linhas_com_id_por_chave(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    resultado = sincronizar(incremental=False)
+    assert resultado["upserts"] == 10
+    assert sorted(db._collection.get(include=[])["ids"]) == sorted(f"{TABELA}:{i}" for i in range(10))
+    assert resultado["derivados_pendentes"] is True
+
+
+def test_incremental_pega_alteracoes_e_linhas_novas_pela_marca(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    sincronizar()
+    _executar(engine, f"UPDATE {TABELA} SET media_final = 9.5, atualizado_em = 2 WHERE id = 3")
+    _alunos([10], atualizado_em=2).to_sql(TABELA, engine, index=False, if_exists="append")
+
+    resultado = sincronizar()
+
+    # linhas com a marca antiga (>= relê o mesmo instante) não são regravadas se o texto não mudou
+    assert resultado["upserts"] == 2
+    assert resultado["marca"] == 2
+    documento = db._collection.get(ids=[f"{TABELA}:3"], include=["documents"])["documents"][0]
+    assert "9.5" in documento
+    assert db._collection.count() == 11
+
+
+def test_sem_mudancas_nao_regrava_nem_deixa_derivados_pendentes(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    sincronizar()
+    ingest_mysql.marcar_derivados(pasta)
+    resultado = sincronizar()
+    assert resultado["upserts"] == 0
+    assert resultado["derivados_pendentes"] is False
+
+
+def test_incremental_nao_procura_remocoes_sem_pedir(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    sincronizar()
+    _executar(engine, f"DELETE FROM {TABELA} WHERE id IN (1, 7)")
+
+    assert sincronizar()["removidas"] == 0
+    assert db._collection.count() == 10
+
+
+def test_remocoes_detectadas_em_lotes(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    sincronizar()
+    _executar(engine, f"DELETE FROM {TABELA} WHERE id IN (1, 7)")
+    etapa = EtapaEmbedding(db.embeddings, db)
+    try:
+        removidas = ingest_mysql.remover_ausentes(engine, etapa, TABELA, "id", lote=3)
+    finally:
+        etapa.fechar()
+
+    assert removidas == 2
+    ids = set(db._collection.get(include=[])["ids"])
+    assert f"{TABELA}:1" not in ids and f"{TABELA}:7" not in ids and len(ids) == 8
+
+
+def test_sincronizacao_completa_remove_linhas_apagadas(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    sincronizar(incremental=False)
+    _executar(engine, f"DELETE FROM {TABELA} WHERE id = 4")
+    assert sincronizar(incremental=False)["removidas"] == 1
+
+
+def test_incremental_pela_chave_primaria_exige_confirmacao(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    with pytest.raises(ValueError, match="MYSQL_WATERMARK"):
+        sincronizar(coluna="id")
+    assert sincronizar(coluna="id", somente_insercoes=True)["upserts"] == 10
+
+
+def test_falha_sem_coluna_de_chave_primaria(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    with pytest.raises(ValueError, match="chave primária"):
+        ingest_mysql.sincronizar(engine, None, pasta, TABELA, "matricula", "atualizado_em")
+
+
+def test_derivados_respeitam_o_intervalo(ambiente):
+    engine, db, pasta, sincronizar = ambiente
+    resultado = sincronizar()
+    # sem agregados ainda: reconstrói de qualquer forma
+    assert ingest_mysql.derivados_vencidos(resultado, pasta, intervalo=3600)
+
+    open(f"{pasta}/{ingest_mysql.ARQUIVO_AGREGADOS}", "w").close()
+    ingest_mysql.marcar_derivados(pasta)
+    _executar(engine, f"UPDATE {TABELA} SET media_final = 1.0, atualizado_em = 5 WHERE id = 2")
+    resultado = sincronizar()
+    assert resultado["derivados_pendentes"]
+    assert not ingest_mysql.derivados_vencidos(resultado, pasta, intervalo=3600)
+    assert ingest_mysql.derivados_vencidos(resultado, pasta, intervalo=0)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Busca exaustiva de tema: caminhos paralelo, serial e de tema único (bases falsas).
+import pytest
+
+import roteamento
+
+DISTANCIAS = {"global": 0.9, "mysql_escola": 0.2, "SQL": 0.5}
+
+
+class RegistroFalso:
+    def obter_store(self, tema):
+        return tema if tema in DISTANCIAS else None
+
+    def pasta_tema(self, tema):
+        return f"data/{tema}"
+
+
+@pytest.fixture(autouse=True)
+def bases_falsas(monkeypatch):
+    monkeypatch.setattr(roteamento, "obter_registro", lambda: RegistroFalso())
+    monkeypatch.setattr(roteamento, "buscar_por_vetor", lambda db, vetor, k=1: [(None, DISTANCIAS[db])])
+
+
+@pytest.mark.parametrize("paralelo", [True, False])
+def test_escolhe_menor_distancia(paralelo):
+    tema, distancia = roteamento.identificar_tema_exaustivo([0.0], temas=list(DISTANCIAS), paralelo=paralelo)
+    assert (tema, distancia) == ("mysql_escola", 0.2)
+
+
+@pytest.mark.parametrize("paralelo", [True, False])
+def test_tema_unico(paralelo):
+    tema, distancia = roteamento.identificar_tema_exaustivo([0.0], temas=["SQL"], paralelo=paralelo)
+    assert (tema, distancia) == ("SQL", 0.5)
+
+
+def test_configuracao_serial(monkeypatch):
+    monkeypatch.setattr(roteamento, "ROTEAMENTO_PARALELO", False)
+    assert roteamento.identificar_tema_exaustivo([0.0], temas=list(DISTANCIAS))[0] == "mysql_escola"
+
+
+def test_tema_sem_base_ignorado():
+    tema, distancia = roteamento.identificar_tema_exaustivo([0.0], temas=["inexistente"], paralelo=False)
+    assert (tema, distancia) == ("global", float("inf"))